@@ -0,0 +1,76 @@
+"""partition time-series tables by timestamp
+
+Converts existing plain usage_events, performance_metrics and error_logs tables
+into RANGE-partitioned parents (PostgreSQL only). Each table is renamed aside,
+recreated from the model as a partitioned parent, given partitions covering its
+existing data plus the configured look-ahead, refilled and dropped. Tables that
+are missing or already partitioned are left to create_schema / the partition
+manager. SQLite databases are untouched.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from datetime import datetime, timedelta
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+from app.db.base import Base
+from app.db.dialect import as_naive_utc
+from app.db.partitions import PARTITIONED_TABLES, create_partitions, is_partitioned
+import app.models.analytics  # noqa: F401  (registers the tables on Base.metadata)
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _convert(bind, table_name: str) -> None:
+    old = f"{table_name}_unpartitioned"
+    op.execute(f'ALTER TABLE "{table_name}" RENAME TO "{old}"')
+    # Free the names the new parent will claim: PK/indexes and the id sequence
+    op.execute(f'ALTER TABLE "{old}" DROP CONSTRAINT IF EXISTS "{table_name}_pkey"')
+    for (index,) in bind.execute(sa.text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :table AND schemaname = current_schema()"
+    ), {"table": old}):
+        op.execute(f'DROP INDEX IF EXISTS "{index}"')
+    op.execute(f'ALTER SEQUENCE IF EXISTS "{table_name}_id_seq" RENAME TO "{old}_id_seq"')
+
+    Base.metadata.tables[table_name].create(bind)
+
+    lo, = bind.execute(sa.text(f'SELECT min("timestamp") FROM "{old}"')).one()
+    now = datetime.utcnow()
+    since = as_naive_utc(lo) if lo is not None else now
+    create_partitions(bind, table_name, since, now + timedelta(days=settings.ANALYTICS_PARTITION_PREMAKE_DAYS))
+
+    columns = [row[0] for row in bind.execute(sa.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = :table AND table_schema = current_schema()"
+    ), {"table": old})]
+    column_list = ", ".join(f'"{c}"' for c in columns if c in Base.metadata.tables[table_name].c)
+    op.execute(f'INSERT INTO "{table_name}" ({column_list}) SELECT {column_list} FROM "{old}"')
+    op.execute(f'DROP TABLE "{old}"')
+    op.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+        f'COALESCE((SELECT max(id) FROM "{table_name}"), 0) + 1, false)'
+    )
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    inspector = sa.inspect(bind)
+    for table_name in PARTITIONED_TABLES:
+        if inspector.has_table(table_name) and not is_partitioned(bind, table_name):
+            _convert(bind, table_name)
+
+
+def downgrade() -> None:
+    # One-way: the models always declare the partitioned layout on PostgreSQL
+    pass
@@ -4,19 +4,33 @@ Authentication dependencies for FastAPI routes
 from typing import Optional, Union
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from ...core.cache import TTLCache
 from ...core.security import verify_token
 from ...core.config import settings
-from ...db.database import get_db
+from ...db.database import AsyncSessionLocal
 from ...models.analytics import AdminUser
 from ...schemas.analytics import AdminUserResponse
 
 security = HTTPBearer(auto_error=False)
 
+# Token subject (username) -> AdminUserResponse, or None for unknown users.
+# Admin endpoints that create, change or delete users invalidate the username.
+user_cache = TTLCache("auth_user_cache", settings.AUTH_USER_CACHE_TTL_SECONDS, maxsize=settings.AUTH_USER_CACHE_MAXSIZE)
+
+
+async def get_cached_user(username: str) -> Optional[AdminUserResponse]:
+    """Admin user by username from the shared cache, loaded on a dedicated session when missing"""
+    async def load() -> Optional[AdminUserResponse]:
+        async with AsyncSessionLocal() as db:
+            user = await db.scalar(select(AdminUser).where(AdminUser.username == username))
+            return AdminUserResponse.from_orm(user) if user is not None else None
+
+    return await user_cache.get_or_load(username, load)
+
 
 async def get_current_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ) -> AdminUserResponse:
     """Get the current authenticated user"""
     credentials_exception = HTTPException(
@@ -33,8 +47,7 @@ async def get_current_user(
     if username is None:
         raise credentials_exception
     
-    # Get user from database
-    user = db.query(AdminUser).filter(AdminUser.username == username).first()
+    user = await get_cached_user(username)
     if user is None:
         raise credentials_exception
     
@@ -44,7 +57,7 @@ async def get_current_user(
             detail="Inactive user"
         )
     
-    return AdminUserResponse.from_orm(user)
+    return user
 
 
 async def get_current_active_user(
@@ -61,8 +74,7 @@ async def get_current_active_user(
 
 async def get_ingest_or_user(
     x_analytics_ingest_key: Optional[str] = Header(default=None, alias="X-Analytics-Ingest-Key"),
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ):
     """Allow either a special ingest key header or a valid bearer user."""
     # Accept ingest key in production or allow dev bypass when configured
@@ -71,7 +83,7 @@ async def get_ingest_or_user(
     # Development convenience: if enabled, allow bypass when no credentials provided
     if settings.ALLOW_DEV_AUTH_BYPASS and (x_analytics_ingest_key is None or x_analytics_ingest_key == ''):
         return None
-    return await get_current_user(credentials, db)
+    return await get_current_user(credentials)
 
 async def get_current_superuser(
     current_user: AdminUserResponse = Depends(get_current_user)
@@ -85,9 +97,8 @@ async def get_current_superuser(
     return current_user
 
 
-def optional_auth(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
+async def optional_auth(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ) -> Optional[AdminUserResponse]:
     """Optional authentication - returns user if authenticated, None otherwise"""
     if not credentials:
@@ -98,10 +109,10 @@ def optional_auth(
         if username is None:
             return None
         
-        user = db.query(AdminUser).filter(AdminUser.username == username).first()
+        user = await get_cached_user(username)
         if user is None or not user.is_active:
             return None
         
-        return AdminUserResponse.from_orm(user)
+        return user
     except Exception:
         return None
@@ -1,12 +1,14 @@
 """
 Admin management endpoints
 """
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from ...db.database import get_db
-from ...api.deps.auth import get_current_superuser, get_current_active_user
-from ...core.security import get_password_hash
+from ...db.pagination import keyset_page, NEXT_CURSOR_HEADER
+from ...api.deps.auth import get_current_superuser, get_current_active_user, user_cache
+from ...core.security import get_password_hash_async, HashingBusy
 from ...models.analytics import AdminUser
 from ...schemas.analytics import (
     AdminUserCreate, AdminUserResponse, AdminUserBase
@@ -18,14 +20,16 @@ router = APIRouter()
 @router.post("/users", response_model=AdminUserResponse)
 async def create_admin_user(
     user: AdminUserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_superuser)
 ):
     """Create a new admin user (superuser only)"""
     # Check if user already exists
-    existing_user = db.query(AdminUser).filter(
-        (AdminUser.username == user.username) | (AdminUser.email == user.email)
-    ).first()
+    existing_user = await db.scalar(
+        select(AdminUser).where(
+            (AdminUser.username == user.username) | (AdminUser.email == user.email)
+        )
+    )
     
     if existing_user:
         raise HTTPException(
@@ -34,7 +38,14 @@ async def create_admin_user(
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    try:
+        hashed_password = await get_password_hash_async(user.password)
+    except HashingBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Password hashing is busy, retry shortly",
+            headers={"Retry-After": "1"},
+        )
     db_user = AdminUser(
         username=user.username,
         email=user.email,
@@ -44,21 +55,29 @@ async def create_admin_user(
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    # A token for this username may have been rejected (and cached) before the user existed
+    user_cache.invalidate(db_user.username)
     
     return AdminUserResponse.from_orm(db_user)
 
 
 @router.get("/users", response_model=List[AdminUserResponse])
 async def list_admin_users(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_active_user)
 ):
-    """List all admin users"""
-    users = db.query(AdminUser).offset(skip).limit(limit).all()
+    """List all admin users (newest first; pass the X-Next-Cursor header back as `cursor` for the next page)"""
+    users, next_cursor = await keyset_page(
+        db, select(AdminUser), AdminUser.created_at, AdminUser.id, limit, cursor=cursor, skip=skip
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return [AdminUserResponse.from_orm(user) for user in users]
 
 
@@ -74,11 +93,11 @@ async def read_current_user(
 async def update_admin_user(
     user_id: int,
     user_update: AdminUserBase,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_superuser)
 ):
     """Update an admin user (superuser only)"""
-    db_user = db.query(AdminUser).filter(AdminUser.id == user_id).first()
+    db_user = await db.scalar(select(AdminUser).where(AdminUser.id == user_id))
     
     if not db_user:
         raise HTTPException(
@@ -87,12 +106,15 @@ async def update_admin_user(
         )
     
     # Update user fields
+    previous_username = db_user.username
     update_data = user_update.dict(exclude_unset=True)
     for field, value in update_data.items():
         setattr(db_user, field, value)
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    user_cache.invalidate(previous_username)
+    user_cache.invalidate(db_user.username)
     
     return AdminUserResponse.from_orm(db_user)
 
@@ -100,11 +122,11 @@ async def update_admin_user(
 @router.delete("/users/{user_id}")
 async def delete_admin_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_superuser)
 ):
     """Delete an admin user (superuser only)"""
-    db_user = db.query(AdminUser).filter(AdminUser.id == user_id).first()
+    db_user = await db.scalar(select(AdminUser).where(AdminUser.id == user_id))
     
     if not db_user:
         raise HTTPException(
@@ -119,7 +141,8 @@ async def delete_admin_user(
             detail="Cannot delete your own account"
         )
     
-    db.delete(db_user)
-    db.commit()
+    await db.delete(db_user)
+    await db.commit()
+    user_cache.invalidate(db_user.username)
     
     return {"message": "User deleted successfully"}
@@ -2,63 +2,129 @@
 Analytics endpoints for MCP server data
 """
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional, Dict, Any, Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
 from starlette.responses import StreamingResponse
-import asyncio
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from ...db.database import get_db
-from ...api.deps.auth import get_current_active_user, get_ingest_or_user
+from ...db.pagination import keyset_page, NEXT_CURSOR_HEADER
+from ...api.deps.auth import get_current_active_user, get_ingest_or_user, optional_auth
 from ...core.config import settings
-from ...services.analytics import AnalyticsService
+from ...services.analytics import AnalyticsService, get_cached_dashboard_metrics, SESSION_COLUMNS, COST_COLUMNS
+from ...services.ingest_queue import ingest_queue
+from ...services.ingest_spool import ingest_spool
+from ...services.broadcaster import dashboard_broadcaster
+from ...services.timeseries import TimeSeriesService, InvalidTimeSeriesQuery
+from ...services.query import AggregateQueryService, InvalidQuery, QueryTimeout
+from ...services.error_groups import list_error_groups
+from ...services.search import search_error_logs, InvalidSearch
+from ...services.export import EXPORT_FORMATS, InvalidExport, ExportUnavailable, export_stream
 from ...schemas.analytics import (
     UsageEventCreate, UsageEventResponse,
     PerformanceMetricCreate, PerformanceMetricResponse,
-    ErrorLogCreate, ErrorLogResponse,
+    ErrorLogCreate, ErrorLogResponse, ErrorGroupResponse, ErrorSearchResult,
     CostTrackingCreate, CostTrackingResponse,
-    AnalyticsSummary, DashboardMetrics,
+    AnalyticsSummary, DashboardMetrics, TimeSeriesResponse,
+    AnalyticsQuery, AnalyticsQueryResponse,
     AdminUserResponse,
     SessionCreate, SessionResponse, SessionDetailResponse,
+    AnalyticsBatchRequest, AnalyticsBatchResponse,
 )
 import logging
 from ...core.log_buffer import InMemoryLogHandler
 
 router = APIRouter()
 
+CURSOR_QUERY = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} response header; takes precedence over skip")
+
+
+def _set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    """Expose the keyset cursor for the next page; list bodies stay plain arrays for compatibility"""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+
+def _fast_list(rows: List[Dict[str, Any]], next_cursor: Optional[str] = None) -> ORJSONResponse:
+    """List body encoded straight from response-shaped dicts built in SQL.
+
+    Returning a Response skips FastAPI's response_model validation and jsonable_encoder
+    pass; the rows come from our own columns, so there is nothing to validate.
+    """
+    response = ORJSONResponse(rows)
+    _set_next_cursor(response, next_cursor)
+    return response
+
+
+def _queued_response() -> JSONResponse:
+    """202 returned when a record was handed to the spool or write-behind queue"""
+    return JSONResponse(status_code=202, content={"status": "queued"})
+
+
+async def _defer_ingest(kind: str, record: Dict[str, Any]) -> bool:
+    """Hand a record to the durable spool or write-behind queue; False means write synchronously"""
+    if ingest_spool.running:
+        await ingest_spool.append(kind, record)
+        return True
+    return ingest_queue.offer(kind, record)
+
 
 @router.post("/events", response_model=UsageEventResponse)
 async def create_usage_event(
     event: UsageEventCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
 ):
     """Create a new usage event"""
+    if await _defer_ingest("event", event.model_dump(mode="json")):
+        return _queued_response()
+    service = AnalyticsService(db)
+    return await service.create_usage_event(event)
+
+
+@router.post("/batch", response_model=AnalyticsBatchResponse)
+async def ingest_batch(
+    batch: AnalyticsBatchRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
+):
+    """Ingest a mixed array of events, metrics, errors, costs and sessions in one transaction"""
+    if len(batch.items) > settings.ANALYTICS_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds {settings.ANALYTICS_BATCH_MAX_ITEMS} items"
+        )
     service = AnalyticsService(db)
-    return service.create_usage_event(event)
+    return await service.ingest_batch(batch.items)
 
 
 @router.post("/sessions", response_model=SessionResponse)
 async def create_session(
     session: SessionCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
 ):
     """Create or return existing session"""
     service = AnalyticsService(db)
-    return service.create_session(session)
+    return await service.create_session(session)
 
 
 @router.get("/sessions", response_model=List[SessionResponse])
 async def list_sessions(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = CURSOR_QUERY,
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_current_active_user) if not settings.ANALYTICS_PUBLIC_READ else None
 ):
     """List sessions (most recent first)."""
     from ...models.analytics import Session as SessionModel
-    q = db.query(SessionModel).order_by(SessionModel.created_at.desc()).offset(skip).limit(limit).all()
-    return [SessionResponse.from_orm(s) for s in q]
+    sessions, next_cursor = await keyset_page(
+        db, select(*SESSION_COLUMNS), SessionModel.created_at, SessionModel.id, limit,
+        cursor=cursor, skip=skip, as_dicts=True
+    )
+    return _fast_list(sessions, next_cursor)
 
 
 @router.get("/events", response_model=List[UsageEventResponse])
@@ -69,30 +135,35 @@ async def get_usage_events(
     event_type: Optional[str] = Query(None),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = CURSOR_QUERY,
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_active_user)
 ):
     """Get usage events with filtering"""
     service = AnalyticsService(db)
-    return service.get_usage_events(
+    events, next_cursor = await service.get_usage_events(
         skip=skip,
         limit=limit,
         session_id=session_id,
         event_type=event_type,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        cursor=cursor
     )
+    return _fast_list(events, next_cursor)
 
 
 @router.post("/metrics", response_model=PerformanceMetricResponse)
 async def create_performance_metric(
     metric: PerformanceMetricCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
 ):
     """Create a new performance metric"""
+    if await _defer_ingest("metric", metric.model_dump(mode="json")):
+        return _queued_response()
     service = AnalyticsService(db)
-    return service.create_performance_metric(metric)
+    return await service.create_performance_metric(metric)
 
 
 @router.get("/metrics", response_model=List[PerformanceMetricResponse])
@@ -101,28 +172,30 @@ async def get_performance_metrics(
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     limit: int = Query(1000, ge=1, le=10000),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_active_user)
 ):
     """Get performance metrics with filtering"""
     service = AnalyticsService(db)
-    return service.get_performance_metrics(
+    return _fast_list(await service.get_performance_metrics(
         metric_name=metric_name,
         start_date=start_date,
         end_date=end_date,
         limit=limit
-    )
+    ))
 
 
 @router.post("/errors", response_model=ErrorLogResponse)
 async def create_error_log(
     error: ErrorLogCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
 ):
     """Create a new error log"""
+    if await _defer_ingest("error", error.model_dump(mode="json")):
+        return _queued_response()
     service = AnalyticsService(db)
-    return service.create_error_log(error)
+    return await service.create_error_log(error)
 
 
 @router.post("/auth-failure")
@@ -132,7 +205,7 @@ async def log_auth_failure(
     client_ip: Optional[str] = None,
     response_code: Optional[int] = None,
     meta: Optional[dict[str, Any]] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
 ):
     service = AnalyticsService(db)
@@ -140,8 +213,7 @@ async def log_auth_failure(
     from ...models.analytics import AuthFailure
     af = AuthFailure(endpoint=endpoint, request_headers=request_headers or {}, client_ip=client_ip or '', response_code=response_code or 0, meta=meta or {})
     db.add(af)
-    db.commit()
-    db.refresh(af)
+    await db.commit()
     return {"ok": True, "id": af.id}
 
 
@@ -153,30 +225,70 @@ async def get_error_logs(
     resolved: Optional[bool] = Query(None),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = CURSOR_QUERY,
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_active_user)
 ):
     """Get error logs with filtering"""
     service = AnalyticsService(db)
-    return service.get_error_logs(
+    errors, next_cursor = await service.get_error_logs(
         skip=skip,
         limit=limit,
         error_type=error_type,
         resolved=resolved,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        cursor=cursor
     )
+    return _fast_list(errors, next_cursor)
+
+
+@router.get("/errors/search", response_model=List[ErrorSearchResult])
+async def search_errors(
+    q: Optional[str] = Query(None, max_length=500, description='Words, "exact phrases" and prefix* terms, all required'),
+    contains: Optional[str] = Query(None, min_length=3, max_length=200, description="Case-insensitive substring of the message"),
+    error_type: Optional[str] = Query(None),
+    resolved: Optional[bool] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = CURSOR_QUERY,
+    db: AsyncSession = Depends(get_db),
+    current_user: AdminUserResponse = Depends(get_current_active_user)
+):
+    """Full-text search over error messages and stack traces, best match first"""
+    try:
+        errors, next_cursor = await search_error_logs(
+            db, q=q, contains=contains, error_type=error_type, resolved=resolved,
+            start_date=start_date, end_date=end_date, limit=limit, cursor=cursor
+        )
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _fast_list(errors, next_cursor)
+
+
+@router.get("/errors/groups", response_model=List[ErrorGroupResponse])
+async def get_error_groups(
+    limit: int = Query(50, ge=1, le=500),
+    since: Optional[datetime] = Query(None, description="Only groups seen since"),
+    error_type: Optional[str] = Query(None),
+    order: Literal["count", "last_seen"] = Query("count"),
+    db: AsyncSession = Depends(get_db),
+    current_user: AdminUserResponse = Depends(get_current_active_user)
+):
+    """Errors grouped by fingerprint, with occurrence counts and the latest occurrence as sample"""
+    return _fast_list(await list_error_groups(db, limit=limit, since=since, error_type=error_type, order=order))
 
 
 @router.post("/costs", response_model=CostTrackingResponse)
 async def create_cost_tracking(
     cost: CostTrackingCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
 ):
     """Create a new cost tracking entry"""
     service = AnalyticsService(db)
-    return service.create_cost_tracking(cost)
+    return await service.create_cost_tracking(cost)
 
 
 @router.get("/costs", response_model=List[CostTrackingResponse])
@@ -186,54 +298,134 @@ async def list_costs(
     service_name: Optional[str] = Query(None),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = CURSOR_QUERY,
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_active_user)
 ):
     """List raw cost tracking entries"""
     from ...models.analytics import CostTracking as CostModel
-    q = db.query(CostModel)
+    q = select(*COST_COLUMNS)
     if service_name:
-        q = q.filter(CostModel.service_name == service_name)
+        q = q.where(CostModel.service_name == service_name)
     if start_date:
-        q = q.filter(CostModel.timestamp >= start_date)
+        q = q.where(CostModel.timestamp >= start_date)
     if end_date:
-        q = q.filter(CostModel.timestamp <= end_date)
-    items = q.order_by(CostModel.timestamp.desc()).offset(skip).limit(limit).all()
-    return [CostTrackingResponse.from_orm(i) for i in items]
+        q = q.where(CostModel.timestamp <= end_date)
+    items, next_cursor = await keyset_page(
+        db, q, CostModel.timestamp, CostModel.id, limit, cursor=cursor, skip=skip, as_dicts=True
+    )
+    return _fast_list(items, next_cursor)
 
 
 @router.get("/summary", response_model=AnalyticsSummary)
 async def get_analytics_summary(
     start_date: Optional[datetime] = Query(None, description="Start date for summary"),
     end_date: Optional[datetime] = Query(None, description="End date for summary"),
-    db: Session = Depends(get_db),
+    include_archive: bool = Query(False, description="Also count cost and error rows moved to the cold archive"),
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_active_user)
 ):
     """Get comprehensive analytics summary"""
     service = AnalyticsService(db)
-    return service.get_analytics_summary(start_date=start_date, end_date=end_date)
+    try:
+        return await service.get_analytics_summary(
+            start_date=start_date, end_date=end_date, include_archive=include_archive
+        )
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
 
 
 @router.get("/dashboard", response_model=DashboardMetrics)
 async def get_dashboard_metrics(
-    db: Session = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_current_active_user) if not settings.ANALYTICS_PUBLIC_READ else None
 ):
-    """Get real-time dashboard metrics"""
-    service = AnalyticsService(db)
-    return service.get_dashboard_metrics()
-
+    """Get real-time dashboard metrics (shared short-TTL cache)"""
+    return await get_cached_dashboard_metrics()
+
+
+@router.get("/timeseries", response_model=TimeSeriesResponse)
+async def get_timeseries(
+    source: Literal["events", "metrics", "costs", "errors"] = Query(..., description="Table to chart"),
+    start_date: Optional[datetime] = Query(None, description="Range start (default: 24h before end)"),
+    end_date: Optional[datetime] = Query(None, description="Range end (default: now)"),
+    bucket: Literal["auto", "minute", "hour", "day"] = Query("auto", description="Bucket width; auto fits max_points"),
+    aggregate: Optional[Literal["count", "sum", "avg", "min", "max"]] = Query(
+        None, description="Defaults: events/errors count, metrics avg, costs sum"
+    ),
+    group_by: Optional[str] = Query(None, description="Dimension to split series by (e.g. tool_name, metric_name)"),
+    name: Optional[str] = Query(None, description="Filter on tool / metric / service / error type"),
+    max_points: int = Query(500, ge=10, le=5000, description="Point budget per series"),
+    max_series: int = Query(10, ge=1, le=50),
+    lttb: bool = Query(True, description="Thin series over max_points with LTTB"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[AdminUserResponse] = Depends(get_current_active_user) if not settings.ANALYTICS_PUBLIC_READ else None
+):
+    """Chart-ready series aggregated per time bucket in SQL"""
+    try:
+        return await TimeSeriesService(db).series(
+            source, start_date, end_date, bucket, aggregate, group_by, name, max_points, max_series, lttb
+        )
+    except InvalidTimeSeriesQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/query", response_model=AnalyticsQueryResponse)
+async def run_aggregate_query(
+    spec: AnalyticsQuery,
+    db: AsyncSession = Depends(get_db),
+    # optional_auth rather than a None default: a bare model-typed default would be read as a second body field
+    current_user: Optional[AdminUserResponse] = Depends(optional_auth if settings.ANALYTICS_PUBLIC_READ else get_current_active_user)
+):
+    """Declarative aggregate query compiled to one SQL statement, under row-estimate and timeout guards"""
+    try:
+        return await AggregateQueryService(db).run(spec)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueryTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+@router.get("/export/{table}")
+async def export_table(
+    table: Literal["events", "metrics", "errors", "sessions", "costs"],
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    session_id: Optional[str] = Query(None, description="events"),
+    event_type: Optional[str] = Query(None, description="events"),
+    metric_name: Optional[str] = Query(None, description="metrics"),
+    error_type: Optional[str] = Query(None, description="errors"),
+    resolved: Optional[bool] = Query(None, description="errors"),
+    service_name: Optional[str] = Query(None, description="costs"),
+    current_user: AdminUserResponse = Depends(get_current_active_user)
+):
+    """Stream every matching row, oldest first, from a server-side cursor"""
+    try:
+        body = export_stream(
+            table, format, start_date, end_date,
+            session_id=session_id, event_type=event_type, metric_name=metric_name,
+            error_type=error_type, resolved=resolved, service_name=service_name,
+        )
+    except InvalidExport as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"{table}-{datetime.utcnow():%Y%m%dT%H%M%S}.{extension}"
+    return StreamingResponse(
+        body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @router.get("/sessions/{session_id}", response_model=SessionDetailResponse)
 async def get_session_detail(
     session_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_current_active_user) if not settings.ANALYTICS_PUBLIC_READ else None
 ):
     """Get detailed information for a single session: session metadata, events, metrics and logs."""
     service = AnalyticsService(db)
-    detail = service.get_session_detail(session_id)
+    detail = await service.get_session_detail(session_id)
     if not detail:
         raise HTTPException(status_code=404, detail="Session not found")
     return detail
@@ -241,21 +433,23 @@ async def get_session_detail(
 
 @router.get("/stream")
 async def stream_dashboard_metrics(
-    db: Session = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_current_active_user) if not settings.ANALYTICS_PUBLIC_READ else None
 ):
-    """SSE stream for real-time dashboard metrics"""
-    service = AnalyticsService(db)
+    """SSE stream for real-time dashboard metrics (fed by the shared broadcaster)"""
+    subscription = dashboard_broadcaster.subscribe()
 
     async def event_generator():
-        while True:
-            metrics = service.get_dashboard_metrics()
-            payload = AnalyticsSummary.model_json_schema()  # dummy to ensure pydantic import use
-            data = DashboardMetrics(**metrics.dict()).model_dump_json()
-            yield f"data: {data}\n\n"
-            await asyncio.sleep(5)
-
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+        try:
+            async for frame in subscription:
+                yield frame
+        finally:
+            dashboard_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get("/logs")
@@ -281,25 +475,29 @@ async def get_cost_summary(
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     service_name: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    include_archive: bool = Query(False, description="Also count rows moved to the cold archive"),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[AdminUserResponse] = Depends(get_ingest_or_user)
 ):
     """Get cost summary with aggregations"""
     service = AnalyticsService(db)
-    return service.get_cost_summary(
-        start_date=start_date,
-        end_date=end_date,
-        service_name=service_name
-    )
+    try:
+        return await service.get_cost_summary(
+            start_date=start_date,
+            end_date=end_date,
+            service_name=service_name,
+            include_archive=include_archive
+        )
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
 
 
 @router.get("/diag/error-logs")
 async def get_recent_error_logs(
     limit: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: AdminUserResponse = Depends(get_current_active_user)
 ):
-    """Return recent error logs for diagnostic viewing."""
-    service = AnalyticsService(db)
-    recent_errors = service.get_error_logs(skip=0, limit=limit)
-    return {"ok": True, "count": len(recent_errors), "errors": recent_errors}
+    """Return the most recently seen error groups for diagnostic viewing (raw rows: /errors)."""
+    groups = await list_error_groups(db, limit=limit, order="last_seen")
+    return {"ok": True, "count": len(groups), "groups": groups}
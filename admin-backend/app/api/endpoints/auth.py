@@ -4,10 +4,12 @@ Authentication endpoints
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from ...core.config import settings
-from ...core.security import verify_password, create_access_token
+from ...core.security import verify_password_async, create_access_token, HashingBusy
 from ...db.database import get_db
+from ...api.deps.auth import user_cache
 from ...models.analytics import AdminUser
 from ...schemas.analytics import Token
 
@@ -17,12 +19,22 @@ router = APIRouter()
 @router.post("/login", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Login and get access token"""
-    user = db.query(AdminUser).filter(AdminUser.username == form_data.username).first()
+    user = await db.scalar(select(AdminUser).where(AdminUser.username == form_data.username))
+    # End the read transaction so no pooled connection is held while bcrypt runs
+    await db.commit()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    try:
+        valid = user is not None and await verify_password_async(form_data.password, user.hashed_password)
+    except HashingBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -43,6 +55,7 @@ async def login_for_access_token(
     # Update last login
     from datetime import datetime
     user.last_login = datetime.utcnow()
-    db.commit()
+    await db.commit()
+    user_cache.invalidate(user.username)  # cached last_login is now stale
     
     return {"access_token": access_token, "token_type": "bearer"}
@@ -0,0 +1,72 @@
+"""
+Process-wide TTL cache with singleflight loading
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+from .metrics import metrics
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after `ttl_seconds`.
+
+    Concurrent misses for the same key share one in-flight load, so an expensive
+    query runs at most once per key no matter how many callers arrive together.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, maxsize: int = 1024):
+        self.name = name
+        self.ttl = ttl_seconds
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Loads that were invalidated while running; their results are returned but not cached
+        self._stale: Set[asyncio.Future] = set()
+        metrics.gauge(f"{name}.size", lambda: len(self._entries))
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            metrics.inc(f"{self.name}.hits")
+            return entry[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            metrics.inc(f"{self.name}.coalesced")
+            # Shield so one waiter being cancelled does not cancel the shared load
+            return await asyncio.shield(inflight)
+
+        metrics.inc(f"{self.name}.misses")
+        task = asyncio.ensure_future(loader())
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future) -> None:
+        # Runs even if every caller was cancelled, so a finished load is never wasted
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task in self._stale:
+            self._stale.discard(task)
+            return
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+        inflight = self._inflight.pop(key, None)
+        if inflight is not None:
+            self._stale.add(inflight)
+
+    def clear(self) -> None:
+        for key in list(self._inflight):
+            self.invalidate(key)
+        self._entries.clear()
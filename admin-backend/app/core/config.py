@@ -51,6 +51,12 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     ANALYTICS_INGEST_KEY: str = ""
+    # Bearer-authenticated users are cached by token subject; admin user changes invalidate entries
+    AUTH_USER_CACHE_TTL_SECONDS: float = 30
+    AUTH_USER_CACHE_MAXSIZE: int = 1024
+    # bcrypt runs on a dedicated thread pool this wide; callers wait this long for a free slot
+    AUTH_HASH_WORKERS: int = 2
+    AUTH_HASH_QUEUE_TIMEOUT_SECONDS: float = 5
     
     # MCP Server Integration
     MCP_SERVER_URL: str = ""
@@ -73,6 +79,68 @@ class Settings(BaseSettings):
     # Analytics
     ANALYTICS_RETENTION_DAYS: int = 90
     METRICS_UPDATE_INTERVAL: int = 60
+    ANALYTICS_BATCH_MAX_ITEMS: int = 1000
+    # Write-behind ingest: handlers return 202 and a background flusher batches inserts
+    ANALYTICS_WRITE_BEHIND: bool = False
+    ANALYTICS_QUEUE_MAXSIZE: int = 10000
+    ANALYTICS_FLUSH_BATCH_SIZE: int = 500
+    ANALYTICS_FLUSH_INTERVAL_MS: int = 1000
+    # Retries of a flush that failed on a connection error, with exponential backoff
+    ANALYTICS_FLUSH_MAX_RETRIES: int = 5
+    ANALYTICS_FLUSH_RETRY_BACKOFF_MS: int = 200
+    # Durable ingest spool (takes precedence over write-behind when set)
+    ANALYTICS_SPOOL_DIR: str = ""
+    ANALYTICS_SPOOL_SEGMENT_BYTES: int = 8 * 1024 * 1024
+    ANALYTICS_SPOOL_ROTATE_SECONDS: int = 5
+    ANALYTICS_SPOOL_FSYNC_MS: int = 20
+    ANALYTICS_SPOOL_REPLAY_BATCH_SIZE: int = 1000
+    ANALYTICS_SPOOL_REPLAY_INTERVAL_MS: int = 1000
+    # Usage rollups (minute/hour/day aggregates of usage_events)
+    ANALYTICS_ROLLUPS_ENABLED: bool = True
+    ANALYTICS_ROLLUP_INTERVAL_SECONDS: int = 60
+    ANALYTICS_ROLLUP_GRACE_SECONDS: int = 60
+    ANALYTICS_ROLLUP_MAX_SPAN_HOURS: int = 6
+    # Latency percentile sketches (DDSketch relative accuracy; minute sketches kept this long before only hours remain)
+    ANALYTICS_SKETCH_RELATIVE_ACCURACY: float = 0.01
+    ANALYTICS_SKETCH_MINUTE_RETENTION_HOURS: int = 48
+    # performance_metrics tiers: raw samples, then 1-minute aggregates, then hourly aggregates
+    ANALYTICS_METRICS_RAW_HOURS: int = 24
+    ANALYTICS_METRICS_MINUTE_DAYS: int = 30
+    # Dashboard results are shared across viewers for this long
+    ANALYTICS_DASHBOARD_CACHE_TTL_SECONDS: float = 5
+    # Dashboard SSE stream: one producer tick fans out to every subscriber
+    ANALYTICS_STREAM_INTERVAL_SECONDS: float = 5
+    ANALYTICS_STREAM_HEARTBEAT_SECONDS: float = 15
+    ANALYTICS_STREAM_QUEUE_SIZE: int = 10
+    # Per-session counters are coalesced in memory and applied this often; deltas for session ids
+    # without a row yet (events ahead of their session) are retried for this many flushes
+    ANALYTICS_SESSION_COUNTER_FLUSH_MS: int = 1000
+    ANALYTICS_SESSION_COUNTER_MAX_RETRIES: int = 300
+    # Error groups: fingerprint = error_type + scrubbed message + this many innermost stack frames; upserts flushed this often
+    ANALYTICS_ERROR_FINGERPRINT_FRAMES: int = 3
+    ANALYTICS_ERROR_GROUP_FLUSH_MS: int = 1000
+    # PostgreSQL range partitions (usage_events/performance_metrics daily, error_logs monthly) created this far ahead
+    ANALYTICS_PARTITION_PREMAKE_DAYS: int = 7
+    ANALYTICS_PARTITION_INTERVAL_SECONDS: int = 3600
+    # Retention engine for ANALYTICS_RETENTION_DAYS (chunked deletes / partition drops).
+    # Opt-in: it permanently deletes data, so it only runs when enabled explicitly
+    ANALYTICS_RETENTION_ENABLED: bool = False
+    ANALYTICS_RETENTION_INTERVAL_SECONDS: int = 3600
+    ANALYTICS_RETENTION_CHUNK_SIZE: int = 5000
+    ANALYTICS_RETENTION_CHUNK_PAUSE_MS: int = 50
+    # Bulk export streams rows from a server-side cursor this many at a time
+    ANALYTICS_EXPORT_BATCH_SIZE: int = 5000
+    # Cold archive: rows older than this move to zstd Parquet segments under ANALYTICS_ARCHIVE_DIR (empty disables)
+    ANALYTICS_ARCHIVE_DIR: str = ""
+    ANALYTICS_ARCHIVE_AFTER_DAYS: int = 30
+    ANALYTICS_ARCHIVE_INTERVAL_SECONDS: int = 3600
+    # Embedded DuckDB snapshot of usage_events / cost_tracking for long-range aggregations (empty path disables)
+    ANALYTICS_OLAP_PATH: str = ""
+    ANALYTICS_OLAP_REFRESH_SECONDS: int = 300
+    ANALYTICS_OLAP_MIN_RANGE_DAYS: int = 7
+    # /analytics/query guards: scans estimated above this are sampled (PostgreSQL) or rejected; per-statement timeout
+    ANALYTICS_QUERY_MAX_SCAN_ROWS: int = 1000000
+    ANALYTICS_QUERY_TIMEOUT_MS: int = 5000
     # Development helpers
     ALLOW_DEV_AUTH_BYPASS: bool = False
     ANALYTICS_PUBLIC_READ: bool = True
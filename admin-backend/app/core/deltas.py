@@ -0,0 +1,101 @@
+"""
+Commit-gated delta buffers for counters maintained off the ingest path.
+
+Ingest stages deltas on the database session that writes the rows; they move
+into the buffer only when that transaction commits (and are dropped on
+rollback), so counters never include rows that were not stored. The buffer
+coalesces deltas per key with the owner's merge function and a periodic flush
+hands them to the owner's write function in one transaction, turning a hot row
+updated by every ingest transaction into one write per key and interval.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session as OrmSession
+from .metrics import metrics
+from .tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+Deltas = Dict[Hashable, Any]
+
+
+class StagedDeltaBuffer:
+    """Coalesces committed deltas and writes them in batches.
+
+    `merge(existing, new)` returns the combined delta (it may update `existing`
+    in place). `write(db, pending)` applies a batch inside a transaction the
+    buffer commits; it may return deltas to keep for the next flush.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_interval_ms: int,
+        merge: Callable[[Any, Any], Any],
+        write: Callable[[Any, Deltas], Awaitable[Optional[Deltas]]],
+        session_factory: Callable[[], Any]
+    ):
+        self.name = name
+        self._merge = merge
+        self._write = write
+        self._session_factory = session_factory
+        # Key in Session.info holding deltas staged by the current transaction
+        self._staged = f"{name}_deltas"
+        self._pending: Deltas = {}
+        self._lock = asyncio.Lock()
+        self._task = PeriodicTask(name, flush_interval_ms / 1000, self.flush)
+        metrics.gauge(f"{name}.pending", lambda: len(self._pending))
+        event.listen(OrmSession, "after_commit", self._publish_staged)
+        event.listen(OrmSession, "after_rollback", self._discard_staged)
+
+    def _add(self, target: Deltas, key: Hashable, delta: Any) -> None:
+        target[key] = self._merge(target[key], delta) if key in target else delta
+
+    def stage(self, db, key: Hashable, delta: Any) -> None:
+        """Count `delta` under `key` once `db` (an AsyncSession or Session) commits"""
+        self._add(db.info.setdefault(self._staged, {}), key, delta)
+
+    def add(self, deltas: Deltas) -> None:
+        for key, delta in deltas.items():
+            self._add(self._pending, key, delta)
+
+    def start(self) -> None:
+        self._task.start()
+
+    async def stop(self) -> None:
+        await self._task.stop()
+        try:
+            await self.flush()
+        except SQLAlchemyError as e:
+            logger.error(f"Final {self.name} flush failed; {len(self._pending)} keys not written: {e}")
+
+    async def flush(self) -> int:
+        """Write every pending delta in one transaction; returns keys written"""
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                async with self._session_factory() as db:
+                    kept = await self._write(db, pending)
+                    await db.commit()
+            except SQLAlchemyError:
+                # Keep the deltas for the next attempt (PeriodicTask counts the error)
+                self.add(pending)
+                raise
+            if kept:
+                self.add(kept)
+            written = len(pending) - len(kept or ())
+            metrics.inc(f"{self.name}.flushed", written)
+            return written
+
+    def _publish_staged(self, session: OrmSession) -> None:
+        staged = session.info.pop(self._staged, None)
+        if staged:
+            self.add(staged)
+
+    def _discard_staged(self, session: OrmSession) -> None:
+        session.info.pop(self._staged, None)
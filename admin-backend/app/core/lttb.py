@@ -0,0 +1,41 @@
+"""
+Largest-Triangle-Three-Buckets downsampling for line charts.
+
+Keeps the first and last points and, for each of the `threshold - 2` buckets in
+between, the point forming the largest triangle with the point kept in the
+previous bucket and the average of the next bucket. Peaks and dips survive far
+better than with plain averaging or striding.
+"""
+from typing import List, Sequence, Tuple
+
+
+def lttb(points: Sequence[Tuple[float, float]], threshold: int) -> List[int]:
+    """Indexes of the (x, y) points to keep, ascending; `points` must be sorted by x"""
+    n = len(points)
+    if threshold >= n:
+        return list(range(n))
+    if threshold <= 2:
+        return [0, n - 1][:max(threshold, 0)]
+
+    kept = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the triangle's third vertex
+        next_lo = int((i + 1) * every) + 1
+        next_hi = min(int((i + 2) * every) + 1, n)
+        span = next_hi - next_lo
+        avg_x = sum(p[0] for p in points[next_lo:next_hi]) / span
+        avg_y = sum(p[1] for p in points[next_lo:next_hi]) / span
+
+        ax, ay = points[a]
+        best, best_area = -1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
@@ -0,0 +1,75 @@
+"""
+In-process metrics registry for counters, gauges and timings
+"""
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict
+
+
+@dataclass
+class TimingStats:
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    last_ms: float = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "last_ms": round(self.last_ms, 3),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._timings: Dict[str, TimingStats] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, fn: Callable[[], float]) -> None:
+        """Register a callable that is evaluated whenever a snapshot is taken"""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def observe(self, name: str, ms: float) -> None:
+        with self._lock:
+            stats = self._timings.setdefault(name, TimingStats())
+            stats.count += 1
+            stats.total_ms += ms
+            stats.last_ms = ms
+            stats.max_ms = max(stats.max_ms, ms)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {name: stats.as_dict() for name, stats in self._timings.items()}
+        gauge_values = {}
+        for name, fn in gauges.items():
+            try:
+                gauge_values[name] = fn()
+            except Exception:
+                # Never fail a snapshot because of a single gauge
+                gauge_values[name] = None
+        return {"counters": counters, "gauges": gauge_values, "timings": timings}
+
+
+# Global registry instance
+metrics = MetricsRegistry()
@@ -1,15 +1,67 @@
 """
 Security utilities for authentication and authorization
 """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Union, Optional
+from typing import Any, Callable, Union, Optional
 from jose import jwt
 from passlib.context import CryptContext
 from .config import settings
+from .metrics import metrics
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+class HashingBusy(Exception):
+    """No hashing slot became free within the queue timeout"""
+
+
+class HashingPool:
+    """Runs bcrypt on a dedicated thread pool so a login never blocks the event loop.
+
+    At most `workers` hashes run at once (bcrypt releases the GIL, so they run in
+    parallel); further callers wait up to `queue_timeout` seconds for a slot and
+    then get HashingBusy instead of piling up behind a login burst.
+    """
+
+    def __init__(self, workers: int, queue_timeout: float):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._busy = 0
+        metrics.gauge("password_hash.busy", lambda: self._busy)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Semaphores bind to one event loop; the CLI and tests may run several in turn
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots, self._loop = asyncio.Semaphore(self.workers), loop
+        return self._slots
+
+    async def run(self, name: str, fn: Callable[..., Any], *args: Any) -> Any:
+        slots = self._semaphore()
+        try:
+            with metrics.timer("password_hash.wait_ms"):
+                await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("password_hash.rejected")
+            raise HashingBusy(f"No password hashing slot free within {self.queue_timeout}s")
+        self._busy += 1
+        try:
+            with metrics.timer(f"password_hash.{name}_ms"):
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._busy -= 1
+            slots.release()
+
+
+# Shared by login, admin user creation and manage.py
+hashing_pool = HashingPool(settings.AUTH_HASH_WORKERS, settings.AUTH_HASH_QUEUE_TIMEOUT_SECONDS)
+
+
 def create_access_token(
     subject: Union[str, Any], expires_delta: timedelta = None
 ) -> str:
@@ -35,6 +87,16 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing pool; raises HashingBusy when it is saturated"""
+    return await hashing_pool.run("verify", verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the hashing pool; raises HashingBusy when it is saturated"""
+    return await hashing_pool.run("hash", get_password_hash, password)
+
+
 def verify_token(token: str) -> Optional[str]:
     """Verify JWT token and return subject"""
     try:
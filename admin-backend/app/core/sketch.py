@@ -0,0 +1,117 @@
+"""
+DDSketch: a mergeable quantile sketch with a relative-error guarantee.
+
+Values are counted in logarithmically sized bins, so any quantile is returned
+within `relative_accuracy` of the true value and two sketches with the same
+accuracy merge exactly by adding bin counts.
+"""
+import math
+from typing import Any, Dict, Iterable, Optional
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# Values at or below this are counted as zero (log scale can't index them)
+MIN_INDEXABLE_VALUE = 1e-9
+# Bound on memory; the lowest bins are collapsed first, so upper quantiles stay accurate
+MAX_BINS = 2048
+
+
+class DDSketch:
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index: int) -> float:
+        # Midpoint (in relative terms) of the bin (gamma^(i-1), gamma^i]
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, weight: int = 1) -> None:
+        value = max(float(value), 0.0)
+        if value <= MIN_INDEXABLE_VALUE:
+            self.zero_count += weight
+        else:
+            index = self._index(value)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > MAX_BINS:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def update(self, values: Iterable[float]) -> "DDSketch":
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        if not math.isclose(self.gamma, other.gamma):
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > MAX_BINS:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _collapse(self) -> None:
+        keys = sorted(self.bins)
+        overflow = keys[:len(keys) - MAX_BINS + 1]
+        self.bins[keys[len(overflow)]] += sum(self.bins.pop(k) for k in overflow)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0 or not 0 <= q <= 1:
+            return None
+        rank = q * (self.count - 1)
+        running = self.zero_count
+        if rank < running:
+            return 0.0
+        for index in sorted(self.bins):
+            running += self.bins[index]
+            if running > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    # Compact serialization: sorted bin indexes are delta-encoded
+    def to_dict(self) -> Dict[str, Any]:
+        keys = sorted(self.bins)
+        return {
+            "a": self.relative_accuracy,
+            "n": self.count,
+            "s": self.sum,
+            "lo": self.min if self.count else None,
+            "hi": self.max if self.count else None,
+            "z": self.zero_count,
+            "k": [k - prev for prev, k in zip([0] + keys, keys)],
+            "c": [self.bins[k] for k in keys],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DDSketch":
+        sketch = cls(data["a"])
+        index = 0
+        for delta, count in zip(data["k"], data["c"]):
+            index += delta
+            sketch.bins[index] = count
+        sketch.zero_count = data["z"]
+        sketch.count = data["n"]
+        sketch.sum = data["s"]
+        if data["lo"] is not None:
+            sketch.min = data["lo"]
+            sketch.max = data["hi"]
+        return sketch
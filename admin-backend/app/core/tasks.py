@@ -0,0 +1,54 @@
+"""
+Periodic background tasks managed by the application lifespan
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Runs an async callable every `interval_seconds` until stopped"""
+
+    def __init__(self, name: str, interval_seconds: float, fn: Callable[[], Awaitable[object]]):
+        self.name = name
+        self.interval = interval_seconds
+        self.fn = fn
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name=self.name)
+        logger.info(f"Started periodic task {self.name} (every {self.interval}s)")
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            start = time.perf_counter()
+            try:
+                await self.fn()
+            except Exception:
+                metrics.inc(f"{self.name}.errors")
+                logger.exception(f"Periodic task {self.name} failed")
+            finally:
+                metrics.observe(f"{self.name}.run_ms", (time.perf_counter() - start) * 1000)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
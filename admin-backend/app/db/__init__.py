@@ -1,4 +1,4 @@
 from .base import Base
-from .database import engine, get_db, SessionLocal
+from .database import engine, get_db, SessionLocal, async_engine, AsyncSessionLocal
 
-__all__ = ["Base", "engine", "get_db", "SessionLocal"]
+__all__ = ["Base", "engine", "get_db", "SessionLocal", "async_engine", "AsyncSessionLocal"]
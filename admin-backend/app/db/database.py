@@ -1,12 +1,35 @@
 """
 Database configuration and session management
 """
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 from ..core.config import settings
+from ..core.metrics import metrics
 from .base import Base  # Import from new base.py
+from .partitions import ensure_partitions
+from .search import ensure_search_indexes
 
-# Create SQLAlchemy engine
+
+def get_async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto its async driver (asyncpg / aiosqlite)"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+        # asyncpg takes "ssl" rather than libpq's "sslmode"
+        if "sslmode" in parsed.query:
+            query = dict(parsed.query)
+            query["ssl"] = query.pop("sslmode")
+            parsed = parsed.set(query=query)
+    elif backend == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+
+# Create SQLAlchemy engine (sync; used by manage.py and Alembic)
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
@@ -16,10 +39,85 @@ engine = create_engine(
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    """Dependency to get database session"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Async engine used by the API and background workers
+async_engine = create_async_engine(
+    get_async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+    echo=settings.DEBUG
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+# Pool-wide hold time: checkout -> checkin of every async connection (requests and workers).
+# Tracked here rather than via pool.checkedout(), which SQLite's NullPool doesn't have.
+_checked_out = set()
+metrics.gauge("db.connections_checked_out", lambda: len(_checked_out))
+
+
+@event.listens_for(async_engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    connection_record.info["checked_out_at"] = time.perf_counter()
+    _checked_out.add(id(connection_record))
+    metrics.inc("db.checkouts")
+
+
+@event.listens_for(async_engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record) -> None:
+    _checked_out.discard(id(connection_record))
+    checked_out_at = connection_record.info.pop("checked_out_at", None)
+    if checked_out_at is not None:
+        metrics.observe("db.connection_hold_ms", (time.perf_counter() - checked_out_at) * 1000)
+
+
+# Per-request hold time: sessions from get_db carry a _REQUEST_HOLD entry in Session.info,
+# and each root transaction (connection acquired -> released) adds to it
+_REQUEST_HOLD = "request_connection_hold"
+
+
+@event.listens_for(Session, "after_begin")
+def _on_request_begin(session: Session, transaction, connection) -> None:
+    hold = session.info.get(_REQUEST_HOLD)
+    if hold is not None and transaction.parent is None:
+        hold["began_at"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _on_request_end(session: Session, transaction) -> None:
+    hold = session.info.get(_REQUEST_HOLD)
+    if hold is not None and transaction.parent is None and hold.get("began_at") is not None:
+        hold["ms"] += (time.perf_counter() - hold.pop("began_at")) * 1000
+        hold["transactions"] += 1
+
+
+def create_schema(connection) -> None:
+    """Create missing tables, then any indexes added to models after their tables already existed"""
+    Base.metadata.create_all(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    # PostgreSQL: partitioned parents need partitions before they accept rows
+    ensure_partitions(connection, settings.ANALYTICS_PARTITION_PREMAKE_DAYS)
+    # Expression / FTS indexes for error search, which the model metadata can't express
+    ensure_search_indexes(connection)
+
+
+async def get_db():
+    """Dependency to get the request's async database session.
+
+    FastAPI caches dependencies per request, so auth dependencies and the handler
+    share this one session. It is lazy: a pooled connection is checked out only
+    when the first statement runs and goes back on commit/rollback/close, so a
+    request authenticated by ingest key that only enqueues never touches the pool.
+    """
+    async with AsyncSessionLocal() as db:
+        hold = db.sync_session.info[_REQUEST_HOLD] = {"ms": 0.0, "transactions": 0}
+        try:
+            yield db
+        finally:
+            await db.close()
+            if hold["transactions"]:
+                metrics.observe("db.request_hold_ms", hold["ms"])
+            else:
+                metrics.inc("db.requests_without_connection")
@@ -0,0 +1,69 @@
+"""
+Helpers that smooth over PostgreSQL / SQLite differences in generated SQL
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.elements import ColumnElement
+
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# SQLite stores DateTime as "YYYY-MM-DD HH:MM:SS.ffffff"; buckets must use the same format to compare correctly
+_SQLITE_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M:00.000000",
+    "hour": "%Y-%m-%d %H:00:00.000000",
+    "day": "%Y-%m-%d 00:00:00.000000",
+}
+
+
+def time_bucket(column, granularity: str, dialect_name: str) -> ColumnElement:
+    """Truncate a timestamp column to the start of its minute/hour/day bucket"""
+    if dialect_name == "postgresql":
+        # date_trunc on timestamptz truncates in the session TimeZone; truncate the UTC wall
+        # time (like floor_time) and convert back. Inline the literals so SELECT and GROUP BY
+        # render identical expressions.
+        utc = literal_column("'UTC'")
+        return func.timezone(utc, func.date_trunc(literal_column(f"'{granularity}'"), func.timezone(utc, column)))
+    return func.strftime(literal_column(f"'{_SQLITE_BUCKET_FORMATS[granularity]}'"), column)
+
+
+def upsert_insert(table, dialect_name: str):
+    """INSERT construct with on_conflict_do_nothing / on_conflict_do_update for the active dialect"""
+    if dialect_name == "postgresql":
+        return postgresql.insert(table)
+    if dialect_name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"ON CONFLICT upserts are not supported on {dialect_name}")
+
+
+def floor_time(value: datetime, granularity: str) -> datetime:
+    """Python-side equivalent of time_bucket"""
+    if granularity == "minute":
+        return value.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ceil_time(value: datetime, granularity: str) -> datetime:
+    floored = floor_time(value, granularity)
+    return floored if floored == value else floored + GRANULARITIES[granularity]
+
+
+def as_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Normalize driver-returned datetimes (aware on Postgres, naive on SQLite) to naive UTC"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def parse_db_datetime(value) -> Optional[datetime]:
+    """SQLite returns bucket expressions as strings; Postgres returns datetimes"""
+    if value is None or isinstance(value, datetime):
+        return as_naive_utc(value)
+    return datetime.fromisoformat(str(value))
@@ -0,0 +1,94 @@
+"""
+Keyset (cursor) pagination on (timestamp, id), newest first.
+
+Instead of OFFSET, each page resumes strictly after the last row of the
+previous one, so a deep page costs the same as the first one when a
+(timestamp, id) index exists. The cursor is opaque to clients. The sort key
+may also be numeric (e.g. a search rank), highest first.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+from sqlalchemy import DateTime, Float, String, literal, tuple_, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+# Response header carrying the cursor for the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: Any, row_id: int) -> str:
+    value = timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp)
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(timestamp, str) or not isinstance(row_id, int):
+        raise InvalidCursor("Invalid cursor")
+    return timestamp, row_id
+
+
+async def keyset_page(
+    db: AsyncSession,
+    query: Select,
+    timestamp_col,
+    id_col,
+    limit: int,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    as_dicts: bool = False
+) -> Tuple[List[Any], Optional[str]]:
+    """Run an entity query one page at a time; returns (entities, next_cursor).
+
+    With `as_dicts` the query selects plain columns instead (id_col among them) and
+    each row comes back as a {column label: value} dict.
+    `skip` is honoured only when no cursor is given (legacy offset paging).
+    `timestamp_col` may be any DateTime or numeric sort expression.
+    """
+    is_datetime = isinstance(timestamp_col.type, DateTime)
+    # SQLite compares DATETIME as text and stored values don't all share one format,
+    # so the cursor carries the stored text verbatim and is compared as text
+    as_text = is_datetime and db.bind.dialect.name == "sqlite"
+    cursor_ts = type_coerce(timestamp_col, String) if as_text else timestamp_col
+    query = query.add_columns(cursor_ts.label("cursor_ts"))
+
+    if cursor:
+        timestamp, last_id = decode_cursor(cursor)
+        try:
+            if as_text:
+                bound = literal(timestamp, String)
+            elif is_datetime:
+                bound = literal(datetime.fromisoformat(timestamp), timestamp_col.type)
+            else:
+                bound = literal(float(timestamp), Float)
+        except ValueError:
+            raise InvalidCursor("Invalid cursor")
+        # The plain bound is implied by the row comparison but lets PostgreSQL prune partitions
+        query = query.where(timestamp_col <= bound, tuple_(timestamp_col, id_col) < tuple_(bound, last_id))
+    elif skip:
+        query = query.offset(skip)
+
+    rows = (await db.execute(
+        query.order_by(timestamp_col.desc(), id_col.desc()).limit(limit + 1)
+    )).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        last_id = last._mapping[id_col.key] if as_dicts else getattr(last[0], id_col.key)
+        next_cursor = encode_cursor(last.cursor_ts, last_id)
+    if as_dicts:
+        return [{key: value for key, value in row._mapping.items() if key != "cursor_ts"} for row in rows], next_cursor
+    return [row[0] for row in rows], next_cursor
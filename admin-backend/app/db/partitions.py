@@ -0,0 +1,140 @@
+"""
+PostgreSQL declarative range partitioning for the time-series tables.
+
+Tables opt in with `partitioned_by_range("timestamp")` in their __table_args__.
+On PostgreSQL the parent is created with PARTITION BY RANGE and its primary key
+is widened to include the partition column (a PostgreSQL requirement); other
+dialects ignore the option, so SQLite keeps plain tables for local runs.
+
+The partition manager pre-creates upcoming daily/monthly partitions and keeps
+a DEFAULT partition so out-of-range rows are never rejected.
+"""
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import PrimaryKeyConstraint, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.compiler import compiles
+from .dialect import as_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Table -> partition width; error_logs is low volume so months keep the partition count small
+PARTITIONED_TABLES: Dict[str, str] = {
+    "usage_events": "day",
+    "performance_metrics": "day",
+    "error_logs": "month",
+}
+
+
+class Partition(NamedTuple):
+    name: str
+    start: Optional[datetime]  # None for the DEFAULT partition
+    end: Optional[datetime]
+
+
+def partitioned_by_range(column: str) -> dict:
+    """Table kwargs for PostgreSQL RANGE partitioning on `column`"""
+    return {
+        "postgresql_partition_by": f"RANGE ({column})",
+        "info": {"partition_column": column},
+    }
+
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _partitioned_primary_key(constraint, compiler, **kw):
+    """Partitioned tables need the partition column in every unique constraint, including the PK"""
+    sql = compiler.visit_primary_key_constraint(constraint, **kw)
+    column = constraint.table.info.get("partition_column") if constraint.table is not None else None
+    if column and column not in constraint.columns and sql.endswith(")"):
+        sql = f"{sql[:-1]}, {compiler.preparer.quote(column)})"
+    return sql
+
+
+def partition_start(value: datetime, interval: str) -> datetime:
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    return value.replace(day=1) if interval == "month" else value
+
+
+def next_partition_start(value: datetime, interval: str) -> datetime:
+    if interval == "month":
+        return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return value + timedelta(days=1)
+
+
+def partition_name(table: str, start: datetime, interval: str) -> str:
+    return f"{table}_p{start.strftime('%Y%m' if interval == 'month' else '%Y%m%d')}"
+
+
+def is_partitioned(connection: Connection, table: str) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+    ), {"table": table}).scalar())
+
+
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def list_partitions(connection: Connection, table: str) -> List[Partition]:
+    """Attached partitions of `table`, oldest first (DEFAULT partition last)"""
+    rows = connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table AND pg_table_is_visible(p.oid)"
+    ), {"table": table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or "")
+        if match:
+            start, end = (as_naive_utc(datetime.fromisoformat(v)) for v in match.groups())
+            partitions.append(Partition(name, start, end))
+        else:
+            partitions.append(Partition(name, None, None))
+    return sorted(partitions, key=lambda p: (p.start is None, p.start or datetime.min))
+
+
+def create_partitions(connection: Connection, table: str, since: datetime, until: datetime) -> List[str]:
+    """Create the DEFAULT partition and every missing partition of `table` overlapping [since, until]"""
+    interval = PARTITIONED_TABLES[table]
+    existing = {p.name for p in list_partitions(connection, table)}
+    created = []
+    default = f"{table}_default"
+    if default not in existing:
+        connection.execute(text(f'CREATE TABLE IF NOT EXISTS "{default}" PARTITION OF "{table}" DEFAULT'))
+        created.append(default)
+    start = partition_start(since, interval)
+    while start <= until:
+        end = next_partition_start(start, interval)
+        name = partition_name(table, start, interval)
+        if name not in existing:
+            try:
+                # Savepoint: a failure here must not abort the caller's transaction
+                with connection.begin_nested():
+                    # Bounds are UTC; the column is timestamptz
+                    connection.execute(text(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                        f"FOR VALUES FROM ('{start.isoformat()}+00') TO ('{end.isoformat()}+00')"
+                    ))
+                created.append(name)
+            except DBAPIError as e:
+                # Usually rows for this range already landed in DEFAULT while the manager was down
+                logger.warning(f"Could not create partition {name}: {e.orig}")
+        start = end
+    return created
+
+
+def ensure_partitions(connection: Connection, ahead_days: int, now: Optional[datetime] = None) -> List[str]:
+    """Create partitions covering today through `ahead_days` from now for every partitioned table"""
+    if connection.dialect.name != "postgresql":
+        return []
+    now = now or datetime.utcnow()
+    created = []
+    for table in PARTITIONED_TABLES:
+        if is_partitioned(connection, table):
+            created += create_partitions(connection, table, now, now + timedelta(days=ahead_days))
+    return created
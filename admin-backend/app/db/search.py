@@ -0,0 +1,72 @@
+"""
+Full-text indexes over error_logs.error_message and stack_trace.
+
+PostgreSQL gets a GIN index on ERROR_SEARCH_VECTOR (queries must use exactly
+this expression for the planner to match the index) and, when the pg_trgm
+extension can be installed, a trigram GIN index so substring ILIKE on
+error_message doesn't scan. The 'simple' configuration only lowercases, which
+suits identifiers and stack frames better than stemming.
+
+SQLite keeps an FTS5 external-content table (ERROR_SEARCH_FTS) whose rowid is
+error_logs.id, maintained by triggers; it is rebuilt from error_logs once when
+it is first created, so existing databases get their rows indexed.
+"""
+import logging
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+ERROR_SEARCH_VECTOR = (
+    "to_tsvector('simple', coalesce(error_message, '') || ' ' || coalesce(stack_trace, ''))"
+)
+ERROR_SEARCH_FTS = "error_logs_fts"
+
+_POSTGRES_SEARCH_INDEX = f"CREATE INDEX IF NOT EXISTS ix_error_logs_search ON error_logs USING gin (({ERROR_SEARCH_VECTOR}))"
+_POSTGRES_TRIGRAM_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_error_logs_message_trgm ON error_logs USING gin (error_message gin_trgm_ops)"
+)
+
+_SQLITE_FTS = [
+    f"CREATE VIRTUAL TABLE {ERROR_SEARCH_FTS} USING fts5("
+    "error_message, stack_trace, content='error_logs', content_rowid='id')",
+    f"CREATE TRIGGER error_logs_fts_insert AFTER INSERT ON error_logs BEGIN "
+    f"INSERT INTO {ERROR_SEARCH_FTS}(rowid, error_message, stack_trace) "
+    "VALUES (new.id, new.error_message, new.stack_trace); END",
+    f"CREATE TRIGGER error_logs_fts_delete AFTER DELETE ON error_logs BEGIN "
+    f"INSERT INTO {ERROR_SEARCH_FTS}({ERROR_SEARCH_FTS}, rowid, error_message, stack_trace) "
+    "VALUES ('delete', old.id, old.error_message, old.stack_trace); END",
+    f"CREATE TRIGGER error_logs_fts_update AFTER UPDATE OF error_message, stack_trace ON error_logs BEGIN "
+    f"INSERT INTO {ERROR_SEARCH_FTS}({ERROR_SEARCH_FTS}, rowid, error_message, stack_trace) "
+    "VALUES ('delete', old.id, old.error_message, old.stack_trace); "
+    f"INSERT INTO {ERROR_SEARCH_FTS}(rowid, error_message, stack_trace) "
+    "VALUES (new.id, new.error_message, new.stack_trace); END",
+    f"INSERT INTO {ERROR_SEARCH_FTS}({ERROR_SEARCH_FTS}) VALUES ('rebuild')",
+]
+
+
+def ensure_search_indexes(connection: Connection) -> None:
+    """Create the error search indexes for the connection's dialect if missing"""
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        connection.execute(text(_POSTGRES_SEARCH_INDEX))
+        try:
+            with connection.begin_nested():
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                connection.execute(text(_POSTGRES_TRIGRAM_INDEX))
+        except DBAPIError as e:
+            # Creating extensions needs privileges; substring search then falls back to scanning
+            logger.warning(f"Trigram index on error_logs.error_message not created: {e}")
+    elif dialect == "sqlite":
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": ERROR_SEARCH_FTS}
+        ).first()
+        if not exists:
+            try:
+                connection.execute(text(_SQLITE_FTS[0]))
+            except DBAPIError as e:
+                logger.warning(f"SQLite has no FTS5; error search is unavailable: {e}")
+                return
+            for statement in _SQLITE_FTS[1:]:
+                connection.execute(text(statement))
@@ -11,9 +11,23 @@ from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from .core.config import settings
 from .core.log_buffer import InMemoryLogHandler
-from .db.database import engine, get_db
+from .core.metrics import metrics
+from .db.database import async_engine, AsyncSessionLocal, create_schema
+from .db.pagination import InvalidCursor, NEXT_CURSOR_HEADER
 from .db.base import Base
 from .api.endpoints import auth, analytics, admin
+from .services.ingest_queue import ingest_queue
+from .services.ingest_spool import ingest_spool
+from .services.rollups import rollup_task
+from .services.sketches import sketch_task
+from .services.downsampling import downsample_task
+from .services.broadcaster import dashboard_broadcaster
+from .services.partitions import partition_task
+from .services.retention import retention_task
+from .services.archive import archive_task
+from .services.olap import olap_snapshot, olap_refresh_task
+from .services.session_counters import session_counters
+from .services.error_groups import error_groups
 
 
 # Configure logging
@@ -24,6 +38,60 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan events"""
+    # Startup
+    logger.info("Starting MCP Admin Backend...")
+    try:
+        # Create database tables
+        async with async_engine.begin() as conn:
+            await conn.run_sync(create_schema)
+        logger.info("Database tables created successfully")
+    except Exception as e:
+        logger.error(f"Failed to create database tables: {e}")
+
+    if settings.ANALYTICS_SPOOL_DIR:
+        ingest_spool.start()
+    elif settings.ANALYTICS_WRITE_BEHIND:
+        ingest_queue.start()
+    if settings.ANALYTICS_ROLLUPS_ENABLED:
+        rollup_task.start()
+        sketch_task.start()
+        downsample_task.start()
+    dashboard_broadcaster.start()
+    session_counters.start()
+    error_groups.start()
+    if async_engine.dialect.name == "postgresql":
+        partition_task.start()
+    if settings.ANALYTICS_RETENTION_ENABLED:
+        retention_task.start()
+    if settings.ANALYTICS_ARCHIVE_DIR:
+        archive_task.start()
+    if settings.ANALYTICS_OLAP_PATH:
+        olap_refresh_task.start()
+
+    yield
+    
+    # Shutdown
+    logger.info("Shutting down MCP Admin Backend...")
+    await dashboard_broadcaster.stop()
+    await partition_task.stop()
+    await retention_task.stop()
+    await archive_task.stop()
+    await olap_refresh_task.stop()
+    olap_snapshot.close()
+    await rollup_task.stop()
+    await sketch_task.stop()
+    await downsample_task.stop()
+    await ingest_queue.stop()
+    await ingest_spool.stop()
+    # After the ingest flushers so their last commits are counted
+    await session_counters.stop()
+    await error_groups.stop()
+    await async_engine.dispose()
+
+
 # Create FastAPI application instance early
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -32,6 +100,7 @@ app = FastAPI(
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     docs_url=f"{settings.API_V1_STR}/docs",
     redoc_url=f"{settings.API_V1_STR}/redoc",
+    lifespan=lifespan,
     debug=True # Enable debug mode for better error visibility
 )
 
@@ -74,24 +143,6 @@ async def catch_exceptions_middleware(request: Request, call_next):
         return response
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Application lifespan events"""
-    # Startup
-    logger.info("Starting MCP Admin Backend...")
-    try:
-        # Create database tables
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created successfully")
-    except Exception as e:
-        logger.error(f"Failed to create database tables: {e}")
-        
-    yield
-    
-    # Shutdown
-    logger.info("Shutting down MCP Admin Backend...")
-
-
 # Order of middleware is important: Exception handler first, then CORS
 # app.middleware("http")(catch_exceptions_middleware) # Custom exception handler middleware
 app.add_middleware(
@@ -100,9 +151,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
 # Attach in-memory log handler for dashboard retrieval
 _inmem_handler = InMemoryLogHandler(capacity=2000)
 _inmem_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
@@ -122,14 +179,10 @@ async def log_requests(request: Request, call_next):
                 headers = dict(request.headers)
                 client_ip = request.client.host if request.client else ''
                 # Fire-and-forget logging to DB
-                from .db.database import SessionLocal
                 from .services.analytics import AnalyticsService
-                db = SessionLocal()
-                try:
+                async with AsyncSessionLocal() as db:
                     svc = AnalyticsService(db)
-                    svc.log_auth_failure(str(request.url.path), headers, client_ip, 401, {})
-                finally:
-                    db.close()
+                    await svc.log_auth_failure(str(request.url.path), headers, client_ip, 401, {})
             except Exception:
                 logger.exception('Failed to log auth failure')
         return response
@@ -185,6 +238,12 @@ async def health_check():
     return {"status": "healthy", "version": settings.PROJECT_VERSION}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process operational metrics (queue depth, flush latency, ...)"""
+    return metrics.snapshot()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
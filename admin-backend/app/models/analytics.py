@@ -1,14 +1,21 @@
 """
 Analytics and logging models for MCP server data
 """
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, JSON, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, Float, JSON, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from ..db.base import Base  # Import from base.py instead of database.py
+from ..db.partitions import partitioned_by_range
 
 
 class UsageEvent(Base):
     """Track individual tool usage events"""
     __tablename__ = "usage_events"
+    __table_args__ = (
+        # Keyset pagination / time-range scans, newest first
+        Index('ix_usage_events_timestamp_id', 'timestamp', 'id'),
+        Index('ix_usage_events_session_timestamp_id', 'session_id', 'timestamp', 'id'),
+        partitioned_by_range('timestamp'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -29,6 +36,10 @@ class UsageEvent(Base):
 class PerformanceMetric(Base):
     """Track performance metrics over time"""
     __tablename__ = "performance_metrics"
+    __table_args__ = (
+        Index('ix_performance_metrics_timestamp_id', 'timestamp', 'id'),
+        partitioned_by_range('timestamp'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -46,6 +57,10 @@ class PerformanceMetric(Base):
 class ErrorLog(Base):
     """Track errors and exceptions"""
     __tablename__ = "error_logs"
+    __table_args__ = (
+        Index('ix_error_logs_timestamp_id', 'timestamp', 'id'),
+        partitioned_by_range('timestamp'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -65,9 +80,55 @@ class ErrorLog(Base):
         return f"<ErrorLog(id={self.id}, type={self.error_type})>"
 
 
+class ErrorGroup(Base):
+    """Error occurrences aggregated by fingerprint (type, scrubbed message, top stack frames)"""
+    __tablename__ = "error_groups"
+    __table_args__ = (
+        UniqueConstraint('fingerprint', name='uq_error_groups_fingerprint'),
+        Index('ix_error_groups_last_seen', 'last_seen'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String(64), nullable=False)
+    error_type = Column(String(100), nullable=False)
+    message = Column(Text, nullable=False)  # scrubbed message shared by the group
+    frames = Column(Text)  # top stack frames the fingerprint was computed from, one per line
+    count = Column(Integer, nullable=False, default=0)
+    first_seen = Column(DateTime(timezone=True), nullable=False)
+    last_seen = Column(DateTime(timezone=True), nullable=False)
+    # Latest occurrence
+    last_error_id = Column(Integer)
+    sample_message = Column(Text)
+    sample_stack_trace = Column(Text)
+    sample_request_path = Column(String(500))
+
+    def __repr__(self):
+        return f"<ErrorGroup(type={self.error_type}, count={self.count})>"
+
+
+class ErrorGroupHour(Base):
+    """Occurrences of an error group per hour, for ranking groups over recent windows"""
+    __tablename__ = "error_group_hours"
+    __table_args__ = (
+        UniqueConstraint('fingerprint', 'bucket_start', name='uq_error_group_hours_bucket'),
+        Index('ix_error_group_hours_bucket', 'bucket_start'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String(64), nullable=False)
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ErrorGroupHour({self.bucket_start}, {self.fingerprint[:8]}, count={self.count})>"
+
+
 class Session(Base):
     """Track user sessions and activities"""
     __tablename__ = "sessions"
+    __table_args__ = (
+        Index('ix_sessions_created_at_id', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String(255), unique=True, nullable=False, index=True)
@@ -88,7 +149,10 @@ class Session(Base):
 class CostTracking(Base):
     """Track costs for external services"""
     __tablename__ = "cost_tracking"
-    __table_args__ = (UniqueConstraint('service_name', 'operation_type', 'request_id', name='uq_cost_tracking'),)
+    __table_args__ = (
+        UniqueConstraint('service_name', 'operation_type', 'request_id', name='uq_cost_tracking'),
+        Index('ix_cost_tracking_timestamp_id', 'timestamp', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -104,6 +168,99 @@ class CostTracking(Base):
         return f"<CostTracking(service={self.service_name}, cost=${self.cost_usd})>"
 
 
+class UsageRollup(Base):
+    """Pre-aggregated usage events per minute/hour/day bucket"""
+    __tablename__ = "usage_rollups"
+    __table_args__ = (
+        UniqueConstraint('granularity', 'bucket_start', 'tool_name', 'event_type', 'success', name='uq_usage_rollups_bucket'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String(10), nullable=False)  # minute, hour, day
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    tool_name = Column(String(100), nullable=False, default="")  # '' when the event had no tool
+    event_type = Column(String(100), nullable=False)
+    success = Column(Boolean, nullable=False)
+    event_count = Column(Integer, nullable=False, default=0)
+    error_count = Column(Integer, nullable=False, default=0)
+    latency_count = Column(Integer, nullable=False, default=0)  # events with a response_time_ms
+    latency_sum = Column(Float, nullable=False, default=0)
+    latency_min = Column(Integer)
+    latency_max = Column(Integer)
+
+    def __repr__(self):
+        return f"<UsageRollup({self.granularity} {self.bucket_start}, tool={self.tool_name}, count={self.event_count})>"
+
+
+class LatencySketch(Base):
+    """Serialized DDSketch of response_time_ms per minute/hour bucket and tool.
+
+    Ingest appends one row per batch; compaction merges rows that share a bucket.
+    """
+    __tablename__ = "latency_sketches"
+    __table_args__ = (
+        Index('ix_latency_sketches_bucket', 'granularity', 'bucket_start', 'tool_name'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String(10), nullable=False)  # minute, hour
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    tool_name = Column(String(100), nullable=False, default="")
+    count = Column(Integer, nullable=False, default=0)
+    sketch = Column(JSON, nullable=False)
+
+    def __repr__(self):
+        return f"<LatencySketch({self.granularity} {self.bucket_start}, tool={self.tool_name}, count={self.count})>"
+
+
+class MetricRollup(Base):
+    """Downsampled performance_metrics per minute/hour bucket and metric name"""
+    __tablename__ = "metric_rollups"
+    __table_args__ = (
+        UniqueConstraint('granularity', 'bucket_start', 'metric_name', name='uq_metric_rollups_bucket'),
+        Index('ix_metric_rollups_name_bucket', 'granularity', 'metric_name', 'bucket_start'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String(10), nullable=False)  # minute, hour
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    metric_name = Column(String(100), nullable=False)
+    metric_unit = Column(String(50))
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Float, nullable=False, default=0)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    last = Column(Float, nullable=False)  # value of the latest sample in the bucket
+    last_at = Column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<MetricRollup({self.granularity} {self.bucket_start}, {self.metric_name}, count={self.count})>"
+
+
+class RollupWatermark(Base):
+    """Upper bound (exclusive) of the time range already folded into a rollup level"""
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String(100), primary_key=True)
+    watermark = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<RollupWatermark({self.name}={self.watermark})>"
+
+
+class SpoolCheckpoint(Base):
+    """Byte offset of an ingest spool segment already loaded, committed with the rows it covers"""
+    __tablename__ = "spool_checkpoints"
+
+    segment = Column(String(255), primary_key=True)
+    byte_offset = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<SpoolCheckpoint({self.segment}@{self.byte_offset})>"
+
+
 class AuthFailure(Base):
     """Log authentication failures for debugging"""
     __tablename__ = "auth_failures"
@@ -123,6 +280,9 @@ class AuthFailure(Base):
 class AdminUser(Base):
     """Admin users for the dashboard"""
     __tablename__ = "admin_users"
+    __table_args__ = (
+        Index('ix_admin_users_created_at_id', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(100), unique=True, nullable=False, index=True)
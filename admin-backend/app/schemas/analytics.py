@@ -42,8 +42,14 @@ class PerformanceMetricCreate(PerformanceMetricBase):
 
 
 class PerformanceMetricResponse(PerformanceMetricBase):
-    id: int
+    id: Optional[int] = None  # None for downsampled points
     timestamp: datetime
+    # Downsampled points carry their tier and bucket aggregate; metric_value is then the bucket mean
+    resolution: str = "raw"
+    sample_count: Optional[int] = None
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+    last_value: Optional[float] = None
     
     class Config:
         from_attributes = True
@@ -75,6 +81,32 @@ class ErrorLogResponse(ErrorLogBase):
         from_attributes = True
 
 
+class ErrorSearchResult(ErrorLogResponse):
+    """Error log matching a search, with its relevance and <mark>-highlighted excerpts"""
+    rank: Optional[float] = None  # higher is better; None for substring-only searches
+    message_snippet: Optional[str] = None
+    stack_snippet: Optional[str] = None
+
+
+class ErrorGroupResponse(BaseModel):
+    """Error occurrences sharing a fingerprint, with the latest one as sample"""
+    id: int
+    fingerprint: str
+    error_type: str
+    message: str  # scrubbed: ids, numbers and quoted values replaced by placeholders
+    frames: Optional[str] = None  # innermost stack frames, one per line
+    count: int
+    first_seen: datetime
+    last_seen: datetime
+    last_error_id: Optional[int] = None
+    sample_message: Optional[str] = None
+    sample_stack_trace: Optional[str] = None
+    sample_request_path: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
 class SessionBase(BaseModel):
     session_id: str
     user_agent: Optional[str] = None
@@ -140,11 +172,38 @@ class CostTrackingResponse(CostTrackingBase):
         from_attributes = True
 
 
+class AnalyticsBatchItem(BaseModel):
+    """Single record in a mixed-type ingest batch"""
+    type: str  # event, metric, error, cost, session
+    data: Dict[str, Any]
+
+
+class AnalyticsBatchRequest(BaseModel):
+    items: List[AnalyticsBatchItem]
+
+
+class AnalyticsBatchItemResult(BaseModel):
+    index: int
+    type: str
+    status: str  # created, duplicate, invalid, failed
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class AnalyticsBatchResponse(BaseModel):
+    """Per-item outcome of a batch ingest; clients retry items with status 'failed'"""
+    accepted: int
+    rejected: int
+    results: List[AnalyticsBatchItemResult]
+
+
 class AnalyticsSummary(BaseModel):
     """Summary analytics response"""
     total_requests: int
     success_rate: float
     average_response_time_ms: float
+    latency_percentiles_ms: Dict[str, Optional[float]] = {}  # p50/p95/p99
+    tool_latency_percentiles: List[Dict[str, Any]] = []
     total_costs_usd: float
     active_sessions: int
     error_rate: float
@@ -157,6 +216,7 @@ class DashboardMetrics(BaseModel):
     timestamp: datetime
     requests_per_minute: int
     average_response_time: float
+    latency_percentiles_ms: Dict[str, Optional[float]] = {}  # p50/p95/p99, last hour
     success_rate: float
     active_sessions: int
     total_cost_today: float
@@ -167,6 +227,64 @@ class DashboardMetrics(BaseModel):
     usage_distribution_data: List[Dict[str, Any]]
 
 
+class TimeSeriesPoint(BaseModel):
+    timestamp: datetime  # bucket start
+    value: float
+
+
+class TimeSeries(BaseModel):
+    name: Optional[str] = None  # group-by value; None when not grouped
+    points: List[TimeSeriesPoint]
+
+
+class TimeSeriesResponse(BaseModel):
+    """Bucketed series for charts"""
+    source: str
+    aggregate: str
+    bucket: str
+    start: datetime
+    end: datetime
+    downsampled: bool = False  # True when LTTB thinned at least one series
+    series: List[TimeSeries]
+
+
+class QueryFilter(BaseModel):
+    field: str
+    op: str = "eq"  # eq, ne, lt, lte, gt, gte, in
+    value: Any = None
+
+
+class QueryAggregate(BaseModel):
+    fn: str  # count, sum, avg, min, max, p50, p90, p95, p99
+    field: Optional[str] = None  # required for everything but count
+    alias: Optional[str] = None  # result key; defaults to fn or fn_field
+
+
+class AnalyticsQuery(BaseModel):
+    """Declarative aggregate query, compiled to a single SQL statement"""
+    source: str  # events, metrics, errors, costs
+    start_date: Optional[datetime] = None  # default: 24h before end_date
+    end_date: Optional[datetime] = None  # default: now
+    filters: List[QueryFilter] = []
+    group_by: List[str] = []  # dimensions; "bucket" groups by time bucket
+    bucket: Optional[str] = None  # minute, hour, day; required when grouping by bucket
+    aggregates: List[QueryAggregate] = Field(default_factory=lambda: [QueryAggregate(fn="count")])
+    order_by: Optional[str] = None  # dimension or aggregate alias; default: first aggregate
+    descending: bool = True
+    limit: int = Field(100, ge=1, le=10000)
+    allow_sampling: bool = True  # sample instead of rejecting scans over the row budget (PostgreSQL only)
+
+
+class AnalyticsQueryResponse(BaseModel):
+    source: str
+    columns: List[str]
+    rows: List[Dict[str, Any]]
+    estimated_rows: Optional[int] = None  # rows matching the filters, estimated before running
+    sampled: bool = False
+    sample_percent: Optional[float] = None  # counts and sums are scaled up by 100 / sample_percent
+    elapsed_ms: float
+
+
 class AdminUserBase(BaseModel):
     username: str
     email: str
@@ -1,13 +1,16 @@
 """
 Analytics service for processing and aggregating MCP server data
 """
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, desc, insert, select, cast, literal, null, union_all, tuple_, String, DateTime, Float
+from sqlalchemy.exc import SQLAlchemyError
+from pydantic import ValidationError
 from ..models.analytics import (
-    UsageEvent, PerformanceMetric, ErrorLog, 
-    Session as SessionModel, CostTracking
+    UsageEvent, PerformanceMetric, ErrorLog,
+    Session as SessionModel, CostTracking, RollupWatermark
 )
 from ..schemas.analytics import (
     UsageEventCreate, UsageEventResponse,
@@ -15,429 +18,676 @@ from ..schemas.analytics import (
     ErrorLogCreate, ErrorLogResponse,
     SessionCreate, SessionUpdate, SessionResponse,
     CostTrackingCreate, CostTrackingResponse,
-    AnalyticsSummary, DashboardMetrics
+    AnalyticsSummary, DashboardMetrics,
+    AnalyticsBatchItem, AnalyticsBatchItemResult, AnalyticsBatchResponse
 )
+from ..core.cache import TTLCache
+from ..core.config import settings
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import time_bucket, parse_db_datetime, upsert_insert
+from ..db.pagination import keyset_page
+from .downsampling import MetricDownsampler
+from .rollups import RollupService, parse_watermarks
+from .sketches import LatencySketchService, percentiles, merge_all
+from .session_counters import stage_events, stage_errors
+from .error_groups import stage_error_groups, top_groups_query
+
+
+def response_columns(model, schema) -> List[Any]:
+    """Table columns backing a response schema's fields, in field order"""
+    return [model.__table__.c[name] for name in schema.model_fields if name in model.__table__.c]
+
+
+# List reads select just these columns and return plain dicts: no ORM identity map,
+# no from_orm, and the endpoints skip response_model re-validation (see _fast_list)
+EVENT_COLUMNS = response_columns(UsageEvent, UsageEventResponse)
+METRIC_COLUMNS = response_columns(PerformanceMetric, PerformanceMetricResponse)
+ERROR_COLUMNS = response_columns(ErrorLog, ErrorLogResponse)
+SESSION_COLUMNS = response_columns(SessionModel, SessionResponse)
+COST_COLUMNS = response_columns(CostTracking, CostTrackingResponse)
+
+# PerformanceMetricResponse fields that raw samples don't have columns for
+RAW_METRIC_DEFAULTS = {
+    name: field.default for name, field in PerformanceMetricResponse.model_fields.items()
+    if name not in PerformanceMetric.__table__.c
+}
+
+
+# Natural keys of the idempotent record types (each backed by a unique constraint)
+IDEMPOTENCY_KEYS = {
+    SessionModel: ("session_id",),
+    CostTracking: ("service_name", "operation_type", "request_id"),
+}
+
+# Ingest record type -> (create schema, model)
+INGEST_TYPES = {
+    "event": (UsageEventCreate, UsageEvent),
+    "metric": (PerformanceMetricCreate, PerformanceMetric),
+    "error": (ErrorLogCreate, ErrorLog),
+    "cost": (CostTrackingCreate, CostTracking),
+    "session": (SessionCreate, SessionModel),
+}
+
+# Column holding when a record was received; deferred writes (spool replay, write-behind
+# flush) set it explicitly rather than taking the insert-time server default
+RECEIVED_AT_COLUMNS = {
+    UsageEvent: "timestamp",
+    PerformanceMetric: "timestamp",
+    ErrorLog: "timestamp",
+    CostTracking: "timestamp",
+    SessionModel: "created_at",
+}
+
+
+def summarize_usage(rows) -> Dict[str, Any]:
+    """Fold usage_breakdown rows into totals and per-tool / per-event-type counts"""
+    total = successful = latency_count = 0
+    latency_sum = 0.0
+    by_tool: Counter = Counter()
+    by_event_type: Counter = Counter()
+    for row in rows:
+        count = int(row.event_count or 0)
+        total += count
+        if row.success:
+            successful += count
+        latency_count += int(row.latency_count or 0)
+        latency_sum += float(row.latency_sum or 0)
+        if row.tool_name:
+            by_tool[row.tool_name] += count
+        by_event_type[row.event_type] += count
+    return {
+        "total": total,
+        "successful": successful,
+        "avg_response_time_ms": latency_sum / latency_count if latency_count else 0,
+        "by_tool": by_tool,
+        "by_event_type": by_event_type,
+    }
 
 
 class AnalyticsService:
     """Service for managing analytics data"""
-    
-    def __init__(self, db: Session):
+
+    def __init__(self, db: AsyncSession):
         self.db = db
-    
+
     # Usage Events
-    def create_usage_event(self, event_data: UsageEventCreate) -> UsageEventResponse:
+    async def create_usage_event(self, event_data: UsageEventCreate) -> UsageEventResponse:
         """Create a new usage event"""
         db_event = UsageEvent(**event_data.dict())
         self.db.add(db_event)
-        self.db.commit()
-        self.db.refresh(db_event)
+        await self.db.flush()
+        await self.db.refresh(db_event)
+        await LatencySketchService(self.db).record([(db_event.timestamp, db_event.tool_name, db_event.response_time_ms)])
+        stage_events(self.db, [event_data.dict()])
+        await self.db.commit()
         return UsageEventResponse.from_orm(db_event)
-    
-    def get_usage_events(
-        self, 
-        skip: int = 0, 
+
+    async def get_usage_events(
+        self,
+        skip: int = 0,
         limit: int = 100,
         session_id: Optional[str] = None,
         event_type: Optional[str] = None,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
-    ) -> List[UsageEventResponse]:
-        """Get usage events with filtering"""
-        query = self.db.query(UsageEvent)
-        
+        end_date: Optional[datetime] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get a page of usage events (UsageEventResponse-shaped dicts) with filtering; returns (events, next_cursor)"""
+        query = select(*EVENT_COLUMNS)
+
         if session_id:
-            query = query.filter(UsageEvent.session_id == session_id)
+            query = query.where(UsageEvent.session_id == session_id)
         if event_type:
-            query = query.filter(UsageEvent.event_type == event_type)
+            query = query.where(UsageEvent.event_type == event_type)
         if start_date:
-            query = query.filter(UsageEvent.timestamp >= start_date)
+            query = query.where(UsageEvent.timestamp >= start_date)
         if end_date:
-            query = query.filter(UsageEvent.timestamp <= end_date)
-        
-        events = query.order_by(desc(UsageEvent.timestamp)).offset(skip).limit(limit).all()
-        return [UsageEventResponse.from_orm(event) for event in events]
-    
+            query = query.where(UsageEvent.timestamp <= end_date)
+
+        return await keyset_page(
+            self.db, query, UsageEvent.timestamp, UsageEvent.id, limit, cursor=cursor, skip=skip, as_dicts=True
+        )
+
     # Performance Metrics
-    def create_performance_metric(self, metric_data: PerformanceMetricCreate) -> PerformanceMetricResponse:
+    async def create_performance_metric(self, metric_data: PerformanceMetricCreate) -> PerformanceMetricResponse:
         """Create a new performance metric"""
         db_metric = PerformanceMetric(**metric_data.dict())
         self.db.add(db_metric)
-        self.db.commit()
-        self.db.refresh(db_metric)
+        await self.db.commit()
+        await self.db.refresh(db_metric)
         return PerformanceMetricResponse.from_orm(db_metric)
-    
-    def get_performance_metrics(
+
+    async def get_performance_metrics(
         self,
         metric_name: Optional[str] = None,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
         limit: int = 1000
-    ) -> List[PerformanceMetricResponse]:
-        """Get performance metrics with filtering"""
-        query = self.db.query(PerformanceMetric)
-        
-        if metric_name:
-            query = query.filter(PerformanceMetric.metric_name == metric_name)
+    ) -> List[Dict[str, Any]]:
+        """Get performance metrics (PerformanceMetricResponse-shaped dicts) with filtering.
+
+        With a start_date the points come from the finest downsampling tier that covers
+        the range within `limit` points; without one, the latest raw samples are returned.
+        """
         if start_date:
-            query = query.filter(PerformanceMetric.timestamp >= start_date)
+            points = await MetricDownsampler(self.db).read(start_date, end_date, metric_name, limit)
+            return [point.model_dump() for point in points]
+
+        query = select(*METRIC_COLUMNS)
+        if metric_name:
+            query = query.where(PerformanceMetric.metric_name == metric_name)
         if end_date:
-            query = query.filter(PerformanceMetric.timestamp <= end_date)
-        
-        metrics = query.order_by(desc(PerformanceMetric.timestamp)).limit(limit).all()
-        return [PerformanceMetricResponse.from_orm(metric) for metric in metrics]
-    
+            query = query.where(PerformanceMetric.timestamp <= end_date)
+
+        rows = await self.db.execute(query.order_by(desc(PerformanceMetric.timestamp)).limit(limit))
+        return [{**row._mapping, **RAW_METRIC_DEFAULTS} for row in rows]
+
     # Error Logs
-    def create_error_log(self, error_data: ErrorLogCreate) -> ErrorLogResponse:
+    async def create_error_log(self, error_data: ErrorLogCreate) -> ErrorLogResponse:
         """Create a new error log"""
         db_error = ErrorLog(**error_data.dict())
         self.db.add(db_error)
-        self.db.commit()
-        self.db.refresh(db_error)
+        await self.db.flush()
+        await self.db.refresh(db_error)
+        stage_errors(self.db, [error_data.dict()])
+        stage_error_groups(self.db, [{**error_data.dict(), "id": db_error.id, "timestamp": db_error.timestamp}])
+        await self.db.commit()
         return ErrorLogResponse.from_orm(db_error)
-    
-    def get_error_logs(
+
+    async def get_error_logs(
         self,
         skip: int = 0,
         limit: int = 100,
         error_type: Optional[str] = None,
         resolved: Optional[bool] = None,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
-    ) -> List[ErrorLogResponse]:
-        """Get error logs with filtering"""
-        query = self.db.query(ErrorLog)
-        
+        end_date: Optional[datetime] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get a page of error logs (ErrorLogResponse-shaped dicts) with filtering; returns (errors, next_cursor)"""
+        query = select(*ERROR_COLUMNS)
+
         if error_type:
-            query = query.filter(ErrorLog.error_type == error_type)
+            query = query.where(ErrorLog.error_type == error_type)
         if resolved is not None:
-            query = query.filter(ErrorLog.resolved == resolved)
+            query = query.where(ErrorLog.resolved == resolved)
         if start_date:
-            query = query.filter(ErrorLog.timestamp >= start_date)
+            query = query.where(ErrorLog.timestamp >= start_date)
         if end_date:
-            query = query.filter(ErrorLog.timestamp <= end_date)
-        
-        errors = query.order_by(desc(ErrorLog.timestamp)).offset(skip).limit(limit).all()
-        return [ErrorLogResponse.from_orm(error) for error in errors]
-    
+            query = query.where(ErrorLog.timestamp <= end_date)
+
+        return await keyset_page(
+            self.db, query, ErrorLog.timestamp, ErrorLog.id, limit, cursor=cursor, skip=skip, as_dicts=True
+        )
+
     # Sessions
-    def create_session(self, session_data: SessionCreate) -> SessionResponse:
-        """Create a new session"""
-        # Idempotent create: return existing if present
-        existing = self.db.query(SessionModel).filter(
-            SessionModel.session_id == session_data.session_id
-        ).first()
-        if existing:
-            return SessionResponse.from_orm(existing)
-        db_session = SessionModel(**session_data.dict())
-        self.db.add(db_session)
-        self.db.commit()
-        self.db.refresh(db_session)
+    async def create_session(self, session_data: SessionCreate) -> SessionResponse:
+        """Create a new session; idempotent on session_id (returns the existing row)"""
+        db_session = await self._upsert_returning(SessionModel, session_data.dict())
+        await self.db.commit()
         return SessionResponse.from_orm(db_session)
-    
-    def update_session(self, session_id: str, session_data: SessionUpdate) -> Optional[SessionResponse]:
+
+    async def update_session(self, session_id: str, session_data: SessionUpdate) -> Optional[SessionResponse]:
         """Update an existing session"""
-        db_session = self.db.query(SessionModel).filter(
-            SessionModel.session_id == session_id
-        ).first()
-        
+        db_session = await self.db.scalar(
+            select(SessionModel).where(SessionModel.session_id == session_id)
+        )
+
         if not db_session:
             return None
-        
+
         update_data = session_data.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_session, field, value)
-        
-        self.db.commit()
-        self.db.refresh(db_session)
+
+        await self.db.commit()
+        await self.db.refresh(db_session)
         return SessionResponse.from_orm(db_session)
-    
+
     # Cost Tracking
-    def create_cost_tracking(self, cost_data: CostTrackingCreate) -> CostTrackingResponse:
-        """Create a new cost tracking entry"""
-        # Idempotent insert: avoid duplicate entries for the same request_id/service/operation
-        data = cost_data.dict()
-        request_id = data.get('request_id')
-        service_name = data.get('service_name')
-        operation_type = data.get('operation_type')
-        if request_id and service_name and operation_type:
-            existing = self.db.query(CostTracking).filter(
-                CostTracking.request_id == request_id,
-                CostTracking.service_name == service_name,
-                CostTracking.operation_type == operation_type
-            ).first()
-            if existing:
-                return CostTrackingResponse.from_orm(existing)
-
-        db_cost = CostTracking(**data)
-        self.db.add(db_cost)
-        self.db.commit()
-        self.db.refresh(db_cost)
+    async def create_cost_tracking(self, cost_data: CostTrackingCreate) -> CostTrackingResponse:
+        """Create a new cost tracking entry; idempotent on (service_name, operation_type, request_id)"""
+        db_cost = await self._upsert_returning(CostTracking, cost_data.dict())
+        await self.db.commit()
         return CostTrackingResponse.from_orm(db_cost)
-    
-    def get_cost_summary(
+
+    # Idempotent writes
+    async def _upsert_returning(self, model, record: Dict[str, Any]):
+        """Insert one record or fetch the row holding its natural key, in a single statement.
+
+        The no-op DO UPDATE (rather than DO NOTHING) makes RETURNING yield the existing
+        row too, and concurrent retries can't race into a unique violation.
+        """
+        keys = IDEMPOTENCY_KEYS[model]
+        stmt = upsert_insert(model, self.db.bind.dialect.name).values(**record)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={keys[0]: getattr(stmt.excluded, keys[0])}
+        ).returning(model)
+        return await self.db.scalar(stmt, execution_options={"populate_existing": True})
+
+    async def insert_ignoring_duplicates(self, model, rows: List[Dict[str, Any]]) -> Dict[tuple, Tuple[int, bool]]:
+        """Batched idempotent insert: one INSERT ... ON CONFLICT DO NOTHING RETURNING for all rows.
+
+        Returns {natural key: (id, created)}. Ids of rows that already existed are looked
+        up in one extra SELECT, issued only when something conflicted.
+        """
+        keys = IDEMPOTENCY_KEYS[model]
+        unique: Dict[tuple, Dict[str, Any]] = {}
+        for row in rows:
+            unique.setdefault(tuple(row[k] for k in keys), row)
+        if not unique:
+            return {}
+        key_columns = [getattr(model, k) for k in keys]
+        stmt = upsert_insert(model.__table__, self.db.bind.dialect.name).values(list(unique.values()))
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(keys)).returning(model.id, *key_columns)
+        found = {tuple(row[1:]): (row[0], True) for row in await self.db.execute(stmt)}
+        missing = [key for key in unique if key not in found]
+        if missing:
+            for row in await self.db.execute(select(model.id, *key_columns).where(tuple_(*key_columns).in_(missing))):
+                found[tuple(row[1:])] = (row[0], False)
+        return found
+
+    async def get_cost_summary(
         self,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
-        service_name: Optional[str] = None
+        service_name: Optional[str] = None,
+        include_archive: bool = False
     ) -> Dict[str, Any]:
-        """Get cost summary with aggregations"""
-        query = self.db.query(
+        """Get cost summary with aggregations; `include_archive` adds rows moved to the cold archive.
+
+        Long ranges read everything before the analytical snapshot's watermark from DuckDB.
+        """
+        query = select(
             func.sum(CostTracking.cost_usd).label("total_cost"),
             func.sum(CostTracking.tokens_used).label("total_tokens"),
             func.count(CostTracking.id).label("total_requests")
         )
-        
-        if start_date:
-            query = query.filter(CostTracking.timestamp >= start_date)
+
+        from .olap import olap_snapshot
+        summary = {"total_cost_usd": 0.0, "total_tokens": 0, "total_requests": 0}
+        # The snapshot only covers live rows, so the archive is read over the caller's whole range
+        tail_start = start_date
+        split = olap_snapshot.split_point("cost_tracking", start_date, end_date)
+        if split is not None:
+            snapshot = await olap_snapshot.totals(
+                "cost_tracking", start_date, split, sums=("cost_usd", "tokens_used"), service_name=service_name
+            )
+            summary = {
+                "total_cost_usd": snapshot["cost_usd"],
+                "total_tokens": int(snapshot["tokens_used"]),
+                "total_requests": snapshot["rows"],
+            }
+            tail_start = split
+
+        if tail_start:
+            query = query.where(CostTracking.timestamp >= tail_start)
         if end_date:
-            query = query.filter(CostTracking.timestamp <= end_date)
+            query = query.where(CostTracking.timestamp <= end_date)
         if service_name:
-            query = query.filter(CostTracking.service_name == service_name)
-        
-        result = query.first()
-        return {
-            "total_cost_usd": float(result.total_cost or 0),
-            "total_tokens": int(result.total_tokens or 0),
-            "total_requests": int(result.total_requests or 0)
-        }
-    
+            query = query.where(CostTracking.service_name == service_name)
+
+        result = (await self.db.execute(query)).first()
+        summary["total_cost_usd"] += float(result.total_cost or 0)
+        summary["total_tokens"] += int(result.total_tokens or 0)
+        summary["total_requests"] += int(result.total_requests or 0)
+        if include_archive:
+            from .archive import ArchiveReader
+            archived = await ArchiveReader().totals(
+                "cost_tracking", start_date or datetime.min, end_date or datetime.utcnow(),
+                sums=("cost_usd", "tokens_used"), service_name=service_name
+            )
+            summary["total_cost_usd"] += archived["cost_usd"]
+            summary["total_tokens"] += int(archived["tokens_used"])
+            summary["total_requests"] += archived["rows"]
+        return summary
+
+    # Batch ingest
+    async def bulk_insert(self, model, rows: List[Dict[str, Any]]) -> List[int]:
+        """Insert rows with a single executemany statement (no commit); returns ids in order.
+
+        Sessions and costs are inserted idempotently; duplicates resolve to the existing id.
+        """
+        if not rows:
+            return []
+        if model in IDEMPOTENCY_KEYS:
+            ids = await self.insert_ignoring_duplicates(model, rows)
+            return [ids[tuple(row[k] for k in IDEMPOTENCY_KEYS[model])][0] for row in rows]
+        if model is ErrorLog:
+            stage_errors(self.db, rows)
+            # Groups record the id and server-assigned timestamp of their latest occurrence
+            stmt = insert(model).returning(model.id, model.timestamp, sort_by_parameter_order=True)
+            inserted = (await self.db.execute(stmt, rows)).all()
+            stage_error_groups(self.db, [
+                {**row, "id": stored.id, "timestamp": stored.timestamp} for row, stored in zip(rows, inserted)
+            ])
+            return [stored.id for stored in inserted]
+        if model is UsageEvent:
+            stage_events(self.db, rows)
+            # Latency sketches need the server-assigned timestamps, so return them with the ids
+            stmt = insert(model).returning(
+                model.id, model.timestamp, model.tool_name, model.response_time_ms, sort_by_parameter_order=True
+            )
+            inserted = (await self.db.execute(stmt, rows)).all()
+            await LatencySketchService(self.db).record(
+                (row.timestamp, row.tool_name, row.response_time_ms) for row in inserted
+            )
+            return [row.id for row in inserted]
+        stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+        return list(await self.db.scalars(stmt, rows))
+
+    async def ingest_batch(self, items: List[AnalyticsBatchItem]) -> AnalyticsBatchResponse:
+        """Validate a mixed batch once and write every valid record in one transaction"""
+        results: List[AnalyticsBatchItemResult] = []
+        pending: Dict[str, List[tuple]] = {kind: [] for kind in INGEST_TYPES}
+
+        for index, item in enumerate(items):
+            result = AnalyticsBatchItemResult(index=index, type=item.type, status="invalid")
+            results.append(result)
+            if item.type not in INGEST_TYPES:
+                result.error = f"Unknown item type '{item.type}'"
+                continue
+            schema, _ = INGEST_TYPES[item.type]
+            try:
+                record = schema.model_validate(item.data).dict()
+            except ValidationError as e:
+                result.error = "; ".join(
+                    f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+                )
+                continue
+            if item.type == "cost" and not record.get("request_id"):
+                result.error = "request_id: Field required"
+                continue
+            pending[item.type].append((result, record))
+
+        try:
+            for kind, entries in pending.items():
+                _, model = INGEST_TYPES[kind]
+                if model in IDEMPOTENCY_KEYS:
+                    # Sessions and costs: existing keys and repeats within the batch are duplicates
+                    keys = IDEMPOTENCY_KEYS[model]
+                    ids = await self.insert_ignoring_duplicates(model, [record for _, record in entries])
+                    seen = set()
+                    for result, record in entries:
+                        key = tuple(record[k] for k in keys)
+                        result.id, created = ids[key]
+                        result.status = "created" if created and key not in seen else "duplicate"
+                        seen.add(key)
+                    continue
+                ids = await self.bulk_insert(model, [record for _, record in entries])
+                for (result, _), new_id in zip(entries, ids):
+                    result.status = "created"
+                    result.id = new_id
+            await self.db.commit()
+        except SQLAlchemyError as e:
+            await self.db.rollback()
+            failed = [result for entries in pending.values() for result, _ in entries]
+            for result in failed:
+                result.status = "failed"
+                result.id = None
+                result.error = f"Database error: {e.__class__.__name__}"
+
+        accepted = sum(1 for r in results if r.status in ("created", "duplicate"))
+        return AnalyticsBatchResponse(
+            accepted=accepted,
+            rejected=len(results) - accepted,
+            results=results
+        )
+
     # Analytics Summaries
-    def get_analytics_summary(
+    async def get_analytics_summary(
         self,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
+        end_date: Optional[datetime] = None,
+        include_archive: bool = False
     ) -> AnalyticsSummary:
-        """Get comprehensive analytics summary"""
+        """Get comprehensive analytics summary.
+
+        Usage totals come from rollups, which outlive archived events; `include_archive`
+        adds archived cost and error rows, which are only counted from raw tables.
+        """
         if not start_date:
             start_date = datetime.utcnow() - timedelta(days=7)
         if not end_date:
             end_date = datetime.utcnow()
-        
-        # Total requests
-        total_requests = self.db.query(func.count(UsageEvent.id)).filter(
-            UsageEvent.timestamp >= start_date,
-            UsageEvent.timestamp <= end_date
-        ).scalar() or 0
-        
-        # Success rate
-        successful_requests = self.db.query(func.count(UsageEvent.id)).filter(
-            UsageEvent.timestamp >= start_date,
-            UsageEvent.timestamp <= end_date,
-            UsageEvent.success == True
-        ).scalar() or 0
-        
-        success_rate = (successful_requests / total_requests * 100) if total_requests > 0 else 0
-        
-        # Average response time
-        avg_response_time = self.db.query(
-            func.avg(UsageEvent.response_time_ms)
-        ).filter(
-            UsageEvent.timestamp >= start_date,
-            UsageEvent.timestamp <= end_date,
-            UsageEvent.response_time_ms.isnot(None)
-        ).scalar() or 0
-        
-        # Total costs
-        total_costs = self.db.query(
-            func.sum(CostTracking.cost_usd)
-        ).filter(
-            CostTracking.timestamp >= start_date,
-            CostTracking.timestamp <= end_date
-        ).scalar() or 0
-        
+
+        # Totals, success rate and latency come from rollups for completed buckets plus raw rows for the rest
+        usage = summarize_usage(await RollupService(self.db).usage_breakdown(start_date, end_date))
+        total_requests = usage["total"]
+        success_rate = (usage["successful"] / total_requests * 100) if total_requests > 0 else 0
+        avg_response_time = usage["avg_response_time_ms"]
+
+        # Total costs (the snapshot serves long ranges; see get_cost_summary)
+        costs = await self.get_cost_summary(start_date, end_date, include_archive=include_archive)
+        total_costs = costs["total_cost_usd"]
+
         # Active sessions
-        active_sessions = self.db.query(func.count(SessionModel.id)).filter(
-            SessionModel.ended_at.is_(None)
-        ).scalar() or 0
-        
+        active_sessions = await self.db.scalar(
+            select(func.count(SessionModel.id)).where(SessionModel.ended_at.is_(None))
+        ) or 0
+
         # Error rate
-        total_errors = self.db.query(func.count(ErrorLog.id)).filter(
-            ErrorLog.timestamp >= start_date,
-            ErrorLog.timestamp <= end_date
-        ).scalar() or 0
-        
+        total_errors = await self.db.scalar(
+            select(func.count(ErrorLog.id)).where(
+                ErrorLog.timestamp >= start_date,
+                ErrorLog.timestamp <= end_date
+            )
+        ) or 0
+
+        if include_archive:
+            from .archive import ArchiveReader
+            total_errors += (await ArchiveReader().totals("error_logs", start_date, end_date))["rows"]
+
         error_rate = (total_errors / total_requests * 100) if total_requests > 0 else 0
-        
+
         # Top tools
-        top_tools_query = self.db.query(
-            UsageEvent.tool_name,
-            func.count(UsageEvent.id).label("count")
-        ).filter(
-            UsageEvent.timestamp >= start_date,
-            UsageEvent.timestamp <= end_date,
-            UsageEvent.tool_name.isnot(None)
-        ).group_by(UsageEvent.tool_name).order_by(desc("count")).limit(5)
-        
         top_tools = [
-            {"tool_name": row.tool_name, "usage_count": row.count}
-            for row in top_tools_query.all()
+            {"tool_name": tool_name, "usage_count": count}
+            for tool_name, count in usage["by_tool"].most_common(5)
         ]
-        
+
+        # Tail latency from merged sketches
+        tool_sketches = await LatencySketchService(self.db).sketches_by_tool(start_date, end_date)
+        tool_latency_percentiles = [
+            {"tool_name": tool_name, "count": sketch.count, **percentiles(sketch)}
+            for tool_name, sketch in sorted(tool_sketches.items(), key=lambda item: item[1].count, reverse=True)
+            if tool_name
+        ][:10]
+
         # Recent errors
-        recent_errors = self.get_error_logs(limit=5)
-        
+        recent_errors, _ = await self.get_error_logs(limit=5)
+
         return AnalyticsSummary(
             total_requests=total_requests,
             success_rate=round(success_rate, 2),
             average_response_time_ms=round(float(avg_response_time), 2),
+            latency_percentiles_ms=percentiles(merge_all(tool_sketches.values())),
+            tool_latency_percentiles=tool_latency_percentiles,
             total_costs_usd=round(float(total_costs), 2),
             active_sessions=active_sessions,
             error_rate=round(error_rate, 2),
             top_tools=top_tools,
             recent_errors=recent_errors
         )
-    
-    def get_dashboard_metrics(self) -> DashboardMetrics:
-        """Get real-time dashboard metrics"""
+
+    async def get_dashboard_metrics(self) -> DashboardMetrics:
+        """Get real-time dashboard metrics in three queries: overview, usage windows and latency sketches"""
         now = datetime.utcnow()
         one_minute_ago = now - timedelta(minutes=1)
-        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # Requests per minute
-        requests_per_minute = self.db.query(func.count(UsageEvent.id)).filter(
-            UsageEvent.timestamp >= one_minute_ago
-        ).scalar() or 0
-        
-        # Average response time (last hour)
         one_hour_ago = now - timedelta(hours=1)
-        avg_response_time = self.db.query(
-            func.avg(UsageEvent.response_time_ms)
-        ).filter(
-            UsageEvent.timestamp >= one_hour_ago,
-            UsageEvent.response_time_ms.isnot(None)
-        ).scalar() or 0
-        
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # Pass 1: scalars, short lists and rollup watermarks as tagged rows of one UNION ALL
+        overview: Dict[str, list] = {}
+        for row in await self.db.execute(self._dashboard_overview_query(now, today, self.db.bind.dialect.name)):
+            overview.setdefault(row.kind, []).append(row)
+
+        watermark_rows = [(row.name, row.ts) for row in overview.get("watermark", [])]
+
+        # Pass 2: every usage window in one rollup-aware statement
+        usage_rows: Dict[str, list] = {}
+        for row in await RollupService(self.db).usage_windows(
+            {"minute": (one_minute_ago, now), "hour": (one_hour_ago, now), "today": (today, now)},
+            watermarks=parse_watermarks(watermark_rows)
+        ):
+            usage_rows.setdefault(row.window_name, []).append(row)
+        last_minute = summarize_usage(usage_rows.get("minute", []))
+        last_hour = summarize_usage(usage_rows.get("hour", []))
+        today_usage = summarize_usage(usage_rows.get("today", []))
+
+        def scalar(kind: str) -> float:
+            rows = overview.get(kind)
+            return float(rows[0].value or 0) if rows else 0
+
         # Success rate (last hour)
-        total_last_hour = self.db.query(func.count(UsageEvent.id)).filter(
-            UsageEvent.timestamp >= one_hour_ago
-        ).scalar() or 0
-        
-        successful_last_hour = self.db.query(func.count(UsageEvent.id)).filter(
-            UsageEvent.timestamp >= one_hour_ago,
-            UsageEvent.success == True
-        ).scalar() or 0
-        
-        success_rate = (successful_last_hour / total_last_hour * 100) if total_last_hour > 0 else 0
-        
-        # Active sessions
-        active_sessions = self.db.query(func.count(SessionModel.id)).filter(
-            SessionModel.ended_at.is_(None)
-        ).scalar() or 0
-        
-        # Total cost today
-        total_cost_today = self.db.query(
-            func.sum(CostTracking.cost_usd)
-        ).filter(
-            CostTracking.timestamp >= today
-        ).scalar() or 0
-        
-        # Top errors (last hour)
-        top_errors_query = self.db.query(
-            ErrorLog.error_type,
-            func.count(ErrorLog.id).label("count")
-        ).filter(
-            ErrorLog.timestamp >= one_hour_ago
-        ).group_by(ErrorLog.error_type).order_by(desc("count")).limit(3)
-        
-        top_errors = [row.error_type for row in top_errors_query.all()]
-
-        # Cost history (last 24 hours)
+        total_last_hour = last_hour["total"]
+        success_rate = (last_hour["successful"] / total_last_hour * 100) if total_last_hour > 0 else 0
+
+        # Pass 3: tail latency (last hour), planned on the sketch watermark from pass 1
+        last_hour_sketches = await LatencySketchService(self.db).sketches_by_tool(
+            one_hour_ago, now, now=now, watermark_rows=watermark_rows
+        )
+
+        # Top error groups (by occurrences in the last hour)
+        top_errors = [
+            row.name for row in sorted(overview.get("top_error", []), key=lambda r: r.value, reverse=True)
+        ]
+
+        # Cost history (today, hourly)
         cost_history = [
-            {"date": c.timestamp.isoformat(), "cost": round(float(c.cost_usd or 0), 2)}
-            for c in self.db.query(CostTracking.timestamp, func.sum(CostTracking.cost_usd).label("cost_usd"))
-            .filter(CostTracking.timestamp >= today)
-            .group_by(CostTracking.timestamp)
-            .order_by(CostTracking.timestamp)
-            .all()
+            {"date": parse_db_datetime(c.ts).isoformat(), "cost": round(float(c.value or 0), 2)}
+            for c in sorted(overview.get("cost", []), key=lambda r: parse_db_datetime(r.ts))
         ]
 
-        # Performance metrics data (last 24 hours)
-        # Filter for 'average_response_time' specifically, then get metric_value
+        # Performance metrics data (today, hourly averages)
         performance_metrics_data = [
-            {"name": p.metric_name, "value": round(float(p.metric_value), 2)}
-            for p in self.db.query(PerformanceMetric.metric_name, PerformanceMetric.metric_value)
-            .filter(PerformanceMetric.timestamp >= today, PerformanceMetric.metric_name == "average_response_time")
-            .order_by(PerformanceMetric.timestamp)
-            .all()
+            {"name": p.name, "value": round(float(p.value), 2)}
+            for p in sorted(overview.get("perf", []), key=lambda r: parse_db_datetime(r.ts))
         ]
 
-        # Usage distribution data (last 24 hours)
+        # Usage distribution data (today)
         usage_distribution_data = [
-            {"name": u.event_type, "count": u.count}
-            for u in self.db.query(UsageEvent.event_type, func.count(UsageEvent.id).label("count"))
-            .filter(UsageEvent.timestamp >= today)
-            .group_by(UsageEvent.event_type)
-            .order_by(desc("count"))
-            .all()
+            {"name": event_type, "count": count}
+            for event_type, count in today_usage["by_event_type"].most_common()
         ]
 
         return DashboardMetrics(
             timestamp=now,
-            requests_per_minute=requests_per_minute,
-            average_response_time=round(float(avg_response_time), 2),
+            requests_per_minute=last_minute["total"],
+            average_response_time=round(float(last_hour["avg_response_time_ms"]), 2),
+            latency_percentiles_ms=percentiles(merge_all(last_hour_sketches.values())),
             success_rate=round(success_rate, 2),
-            active_sessions=active_sessions,
-            total_cost_today=round(float(total_cost_today), 2),
+            active_sessions=int(scalar("active_sessions")),
+            total_cost_today=round(scalar("cost_today"), 2),
             top_errors=top_errors,
             cost_history=cost_history,
             performance_metrics_data=performance_metrics_data,
             usage_distribution_data=usage_distribution_data
         )
 
-    def get_session_detail(self, session_id: str) -> Optional[Dict[str, Any]]:
+    @staticmethod
+    def _dashboard_overview_query(now: datetime, today: datetime, dialect_name: str):
+        """UNION ALL of (kind, name, ts, value) rows covering everything on the dashboard except usage"""
+        no_name = cast(null(), String)
+        no_ts = cast(null(), DateTime)
+        cost_hour = time_bucket(CostTracking.timestamp, "hour", dialect_name)
+        perf_hour = time_bucket(PerformanceMetric.timestamp, "hour", dialect_name)
+
+        def tagged(kind: str, name, ts, value):
+            return select(
+                literal(kind).label("kind"),
+                name.label("name"),
+                ts.label("ts"),
+                cast(value, Float).label("value")
+            )
+
+        # Error groups with the most occurrences in the last hour; reads hourly group counts, not error rows
+        top_errors = top_groups_query(now).subquery()
+
+        return union_all(
+            tagged("active_sessions", no_name, no_ts, func.count(SessionModel.id))
+            .where(SessionModel.ended_at.is_(None)),
+            tagged("cost_today", no_name, no_ts, func.sum(CostTracking.cost_usd))
+            .where(CostTracking.timestamp >= today),
+            tagged("top_error", top_errors.c.label, no_ts, top_errors.c.count),
+            tagged("cost", no_name, cost_hour, func.sum(CostTracking.cost_usd))
+            .where(CostTracking.timestamp >= today)
+            .group_by(cost_hour),
+            tagged("perf", PerformanceMetric.metric_name, perf_hour, func.avg(PerformanceMetric.metric_value))
+            .where(PerformanceMetric.timestamp >= today, PerformanceMetric.metric_name == "average_response_time")
+            .group_by(PerformanceMetric.metric_name, perf_hour),
+            tagged("watermark", RollupWatermark.name, RollupWatermark.watermark, null()),
+        )
+
+    async def get_session_detail(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Fetch session metadata, usage events, performance metrics and recent error logs for a session."""
         # Load session
-        db_session = self.db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
+        db_session = await self.db.scalar(select(SessionModel).where(SessionModel.session_id == session_id))
         if not db_session:
             return None
+        session = SessionResponse.from_orm(db_session)
 
         # Events (limit 1000)
-        events_q = self.db.query(UsageEvent).filter(UsageEvent.session_id == session_id).order_by(desc(UsageEvent.timestamp)).limit(1000).all()
+        events_q = await self.db.scalars(
+            select(UsageEvent).where(UsageEvent.session_id == session_id).order_by(desc(UsageEvent.timestamp)).limit(1000)
+        )
         events = [UsageEventResponse.from_orm(e) for e in events_q]
 
         # Metrics (limit 1000)
         # Prefer session_id column lookup for compatibility; fallback to tags JSON lookup if necessary
         try:
-            metrics_q = (
-                self.db.query(PerformanceMetric)
-                .filter(PerformanceMetric.session_id == session_id)
+            metrics_q = list(await self.db.scalars(
+                select(PerformanceMetric)
+                .where(PerformanceMetric.session_id == session_id)
                 .order_by(desc(PerformanceMetric.timestamp))
                 .limit(1000)
-                .all()
-            )
+            ))
         except Exception:
             # Rollback failed transaction so subsequent queries work
-            self.db.rollback()
+            await self.db.rollback()
             try:
-                metrics_q = (
-                    self.db.query(PerformanceMetric)
-                    .filter(PerformanceMetric.tags['session_id'].astext == session_id)
+                metrics_q = list(await self.db.scalars(
+                    select(PerformanceMetric)
+                    .where(PerformanceMetric.tags['session_id'].astext == session_id)
                     .order_by(desc(PerformanceMetric.timestamp))
                     .limit(1000)
-                    .all()
-                )
+                ))
             except Exception:
-                self.db.rollback()
+                await self.db.rollback()
                 metrics_q = []
 
         metrics = [PerformanceMetricResponse.from_orm(m) for m in metrics_q]
 
         # Logs (limit 500)
-        logs_q = self.db.query(ErrorLog).filter(ErrorLog.session_id == session_id).order_by(desc(ErrorLog.timestamp)).limit(500).all()
+        logs_q = await self.db.scalars(
+            select(ErrorLog).where(ErrorLog.session_id == session_id).order_by(desc(ErrorLog.timestamp)).limit(500)
+        )
         logs = [ErrorLogResponse.from_orm(l) for l in logs_q]
 
         return {
-            "session": SessionResponse.from_orm(db_session),
+            "session": session,
             "events": events,
             "metrics": metrics,
             "logs": logs,
         }
 
-    def log_auth_failure(self, endpoint: str, request_headers: Dict[str, Any], client_ip: str, response_code: int, meta: Dict[str, Any]) -> Dict[str, Any]:
+    async def log_auth_failure(self, endpoint: str, request_headers: Dict[str, Any], client_ip: str, response_code: int, meta: Dict[str, Any]) -> Dict[str, Any]:
         from ..models.analytics import AuthFailure
         db_af = AuthFailure(endpoint=endpoint, request_headers=request_headers or {}, client_ip=client_ip or '', response_code=response_code or 0, meta=meta or {})
         self.db.add(db_af)
-        self.db.commit()
-        self.db.refresh(db_af)
+        await self.db.commit()
         return {"ok": True, "id": db_af.id}
+
+
+# Shared across requests so concurrent dashboard viewers trigger a single query
+dashboard_cache = TTLCache("dashboard_cache", settings.ANALYTICS_DASHBOARD_CACHE_TTL_SECONDS, maxsize=1)
+
+
+async def get_cached_dashboard_metrics() -> DashboardMetrics:
+    """Dashboard metrics from the shared cache, computed on a dedicated session when stale"""
+    async def load() -> DashboardMetrics:
+        async with AsyncSessionLocal() as db:
+            return await AnalyticsService(db).get_dashboard_metrics()
+
+    return await dashboard_cache.get_or_load("dashboard", load)
@@ -0,0 +1,319 @@
+"""
+Cold archive: moves aged rows out of the hot tables into zstd Parquet segments.
+
+Rows older than ANALYTICS_ARCHIVE_AFTER_DAYS are archived one table-day at a
+time under ANALYTICS_ARCHIVE_DIR as `<table>/date=YYYY-MM-DD/part-NNNN.parquet`.
+Each day is one transaction: the rows are streamed from a server-side cursor
+into the segment, the segment is fsynced and recorded in manifest.json, and only
+then are exactly those rows (by max id, within the same snapshot) deleted and
+committed. If the commit fails the segment is dropped from the manifest again.
+
+A crash between the manifest write and the commit leaves rows that are already
+archived; the next run deletes them (ids up to the day's archived max id)
+instead of archiving them twice.
+
+Runs hold an exclusive flock on `archive.lock` in the archive root, so workers
+and `manage.py archive` never write the same day's segment or the manifest at
+once; a periodic run that finds the lock taken skips, and the manifest is
+(re)read only once the lock is held.
+
+Summaries can fold archived ranges back in through ArchiveReader. Usage totals
+don't need it: they come from hour/day rollups, which outlive the raw rows.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..core.tasks import PeriodicTask
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import floor_time, parse_db_datetime, as_naive_utc
+from ..models.analytics import UsageEvent, ErrorLog, CostTracking
+from .export import arrow_schema, arrow_table, require_pyarrow
+
+logger = logging.getLogger(__name__)
+
+# Archived tables by name; every column is kept. performance_metrics is absent: the
+# downsampler drops raw samples after ANALYTICS_METRICS_RAW_HOURS, long before any
+# archive cutoff, and the hourly rollups that replace them are kept for good.
+ARCHIVE_MODELS = {
+    "usage_events": UsageEvent,
+    "error_logs": ErrorLog,
+    "cost_tracking": CostTracking,
+}
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "archive.lock"
+
+
+@dataclass
+class Segment:
+    table: str
+    day: str  # YYYY-MM-DD
+    path: str  # relative to the archive root
+    rows: int
+    bytes: int
+    min_timestamp: datetime
+    max_timestamp: datetime
+    max_id: int
+    created_at: datetime
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = dict(self.__dict__)
+        for key in ("min_timestamp", "max_timestamp", "created_at"):
+            data[key] = data[key].isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Segment":
+        data = dict(data)
+        for key in ("min_timestamp", "max_timestamp", "created_at"):
+            data[key] = datetime.fromisoformat(data[key])
+        return cls(**data)
+
+
+class ArchiveManifest:
+    """Index of archive segments, rewritten atomically (temp file + rename) on every change"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.path = root / MANIFEST_NAME
+        self.segments: List[Segment] = []
+        if self.path.exists():
+            data = json.loads(self.path.read_text())
+            self.segments = [Segment.from_dict(s) for s in data.get("segments", [])]
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "segments": [s.as_dict() for s in self.segments]}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def for_table(self, table: str) -> List[Segment]:
+        return [s for s in self.segments if s.table == table]
+
+    def overlapping(self, table: str, start: datetime, end: datetime) -> List[Segment]:
+        return [s for s in self.for_table(table) if s.max_timestamp >= start and s.min_timestamp <= end]
+
+    def archived_max_id(self, table: str, day: str) -> Optional[int]:
+        ids = [s.max_id for s in self.for_table(table) if s.day == day]
+        return max(ids) if ids else None
+
+
+@dataclass
+class ArchiveReport:
+    cutoff: datetime
+    rows: Dict[str, int] = field(default_factory=dict)
+    segments: Dict[str, int] = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+    skipped: bool = False  # another run held the archive lock
+
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ColdArchiver:
+    """Archives aged rows day by day; each day commits (or rolls back) on its own"""
+
+    def __init__(self, db: AsyncSession, root: Optional[str] = None):
+        self.db = db
+        self.root = Path(root or settings.ANALYTICS_ARCHIVE_DIR)
+
+    async def _lock(self, wait: bool) -> Optional[int]:
+        """File descriptor holding the archive lock (closing it releases), or None when taken and not waiting"""
+        fd = os.open(self.root / LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if wait:
+                await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    async def run(self, days: Optional[int] = None, now: Optional[datetime] = None, wait: bool = False) -> ArchiveReport:
+        """Archive every day before the cutoff; with `wait` block on a concurrent run instead of skipping"""
+        require_pyarrow()
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        cutoff = floor_time(now - timedelta(days=days if days is not None else settings.ANALYTICS_ARCHIVE_AFTER_DAYS), "day")
+        self.root.mkdir(parents=True, exist_ok=True)
+        report = ArchiveReport(cutoff=cutoff)
+        lock = await self._lock(wait)
+        if lock is None:
+            logger.info("Another archive run holds the lock; skipping")
+            report.skipped = True
+            return report
+        try:
+            await self._run(report)
+        finally:
+            os.close(lock)
+        report.elapsed_ms = (time.perf_counter() - started) * 1000
+        return report
+
+    async def _run(self, report: ArchiveReport) -> None:
+        cutoff = report.cutoff
+        # Read under the lock: another process may have added segments since this one last looked
+        manifest = ArchiveManifest(self.root)
+        for table, model in ARCHIVE_MODELS.items():
+            report.rows[table] = report.segments[table] = 0
+            while True:
+                first = parse_db_datetime(await self.db.scalar(
+                    select(func.min(model.timestamp)).where(model.timestamp < cutoff)
+                ))
+                await self.db.commit()
+                if first is None:
+                    break
+                day = floor_time(first, "day")
+                archived, removed = await self.archive_day(manifest, table, model, day)
+                report.rows[table] += archived
+                report.segments[table] += 1 if archived else 0
+                if not removed:
+                    # Nothing left to take for this day (e.g. rows hidden by concurrent writers); retry next run
+                    break
+            metrics.inc(f"archive.{table}.rows", report.rows[table])
+
+    async def archive_day(self, manifest: ArchiveManifest, table: str, model, day: datetime) -> tuple:
+        """Archive one table-day; returns (rows archived, rows deleted)"""
+        require_pyarrow()
+        import pyarrow.parquet as pq
+
+        day_key = f"{day:%Y-%m-%d}"
+        lo, hi = day, day + timedelta(days=1)
+        previous_max_id = manifest.archived_max_id(table, day_key)
+        columns = list(model.__table__.columns)
+        schema = arrow_schema(columns)
+
+        if self.db.bind.dialect.name == "postgresql":
+            # The DELETE must see exactly the snapshot the segment was written from
+            await self.db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+        query = select(*columns).where(model.timestamp >= lo, model.timestamp < hi)
+        if previous_max_id is not None:
+            query = query.where(model.id > previous_max_id)
+        query = query.order_by(model.timestamp, model.id)
+
+        directory = self.root / table / f"date={day_key}"
+        directory.mkdir(parents=True, exist_ok=True)
+        part = len([s for s in manifest.for_table(table) if s.day == day_key]) + 1
+        path = directory / f"part-{part:04d}.parquet"
+        tmp = path.with_suffix(".parquet.tmp")
+
+        rows = 0
+        max_id = previous_max_id
+        min_ts = max_ts = None
+        writer = pq.ParquetWriter(str(tmp), schema, compression="zstd")
+        segment = None
+        try:
+            try:
+                result = await self.db.stream(query.execution_options(yield_per=settings.ANALYTICS_EXPORT_BATCH_SIZE))
+                async for partition in result.mappings().partitions():
+                    batch = [dict(row) for row in partition]
+                    await asyncio.to_thread(writer.write_table, arrow_table(batch, columns, schema))
+                    rows += len(batch)
+                    max_id = max(max_id or 0, *(row["id"] for row in batch))
+                    min_ts = min_ts or as_naive_utc(batch[0]["timestamp"])
+                    max_ts = as_naive_utc(batch[-1]["timestamp"])
+            finally:
+                writer.close()
+
+            if rows:
+                with open(tmp, "rb+") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+                _fsync_dir(directory)
+                segment = Segment(
+                    table=table, day=day_key, path=str(path.relative_to(self.root)), rows=rows,
+                    bytes=path.stat().st_size, min_timestamp=min_ts, max_timestamp=max_ts,
+                    max_id=max_id, created_at=datetime.utcnow(),
+                )
+                manifest.segments.append(segment)
+                manifest.save()
+            else:
+                tmp.unlink(missing_ok=True)
+
+            removed = 0
+            if max_id is not None:
+                result = await self.db.execute(
+                    delete(model).where(model.timestamp >= lo, model.timestamp < hi, model.id <= max_id)
+                    .execution_options(synchronize_session=False)
+                )
+                removed = result.rowcount
+            await self.db.commit()
+        except BaseException:
+            await self.db.rollback()
+            tmp.unlink(missing_ok=True)
+            if segment is not None:
+                manifest.segments.remove(segment)
+                manifest.save()
+                path.unlink(missing_ok=True)
+            raise
+        if rows:
+            logger.info(f"Archived {rows} {table} rows for {day_key} to {segment.path}")
+        return rows, removed
+
+
+class ArchiveReader:
+    """Aggregates over archived segments, for folding archived ranges into summaries"""
+
+    def __init__(self, root: Optional[str] = None):
+        root = root or settings.ANALYTICS_ARCHIVE_DIR
+        self.root = Path(root) if root else None
+
+    def _totals(self, table: str, start: datetime, end: datetime, sums: Sequence[str], equals: Dict[str, Any]) -> Dict[str, float]:
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        totals = {"rows": 0, **{column: 0.0 for column in sums}}
+        if self.root is None or not (self.root / MANIFEST_NAME).exists():
+            return totals
+        filters = [("timestamp", ">=", start), ("timestamp", "<=", end)]
+        filters += [(column, "=", value) for column, value in equals.items() if value is not None]
+        for segment in ArchiveManifest(self.root).overlapping(table, start, end):
+            data = pq.read_table(self.root / segment.path, columns=list(sums) or ["id"], filters=filters)
+            totals["rows"] += data.num_rows
+            for column in sums:
+                totals[column] += pc.sum(data[column]).as_py() or 0
+        return totals
+
+    async def totals(
+        self,
+        table: str,
+        start: datetime,
+        end: datetime,
+        sums: Sequence[str] = (),
+        **equals: Any
+    ) -> Dict[str, float]:
+        """Archived row count and column sums for [start, end] (both inclusive); zeros when no archive is configured"""
+        if self.root is not None:
+            require_pyarrow()
+        return await asyncio.to_thread(self._totals, table, as_naive_utc(start), as_naive_utc(end), sums, equals)
+
+
+async def run_archive() -> ArchiveReport:
+    async with AsyncSessionLocal() as db:
+        return await ColdArchiver(db).run()
+
+
+# Lifespan-managed job; only started when ANALYTICS_ARCHIVE_DIR is set
+archive_task = PeriodicTask("archive", settings.ANALYTICS_ARCHIVE_INTERVAL_SECONDS, run_archive)
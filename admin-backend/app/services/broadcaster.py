@@ -0,0 +1,104 @@
+"""
+Fan-out broadcaster for the dashboard SSE stream: one producer computes metrics
+per tick and pushes the serialized frame to every subscriber's queue
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Optional, Set
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..core.tasks import PeriodicTask
+from .analytics import get_cached_dashboard_metrics
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FRAME = ": heartbeat\n\n"
+
+
+class Subscription:
+    """A single SSE client; iterating yields frames until the client is evicted or the server stops"""
+
+    def __init__(self, queue_size: int, heartbeat_seconds: float):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.heartbeat = heartbeat_seconds
+        self.closed = False
+
+    def close(self) -> None:
+        """Drop anything pending and wake the reader with the end-of-stream sentinel"""
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        while True:
+            try:
+                frame = await asyncio.wait_for(self.queue.get(), self.heartbeat)
+            except asyncio.TimeoutError:
+                # Comment frames keep proxies and load balancers from closing an idle stream
+                yield HEARTBEAT_FRAME
+                continue
+            if frame is None:
+                return
+            yield frame
+
+
+class DashboardBroadcaster:
+    """Computes dashboard metrics once per tick, only while someone is listening"""
+
+    def __init__(self, interval_seconds: float, heartbeat_seconds: float, queue_size: int):
+        self.heartbeat = heartbeat_seconds
+        self.queue_size = queue_size
+        self._subscribers: Set[Subscription] = set()
+        self._last_frame: Optional[str] = None
+        self._task = PeriodicTask("sse_broadcaster", interval_seconds, self._tick)
+        metrics.gauge("sse.subscribers", lambda: len(self._subscribers))
+
+    def start(self) -> None:
+        self._task.start()
+
+    async def stop(self) -> None:
+        await self._task.stop()
+        for subscription in list(self._subscribers):
+            self.unsubscribe(subscription)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size, self.heartbeat)
+        if self._last_frame is not None:
+            # New viewers get the latest snapshot immediately instead of waiting a tick
+            subscription.queue.put_nowait(self._last_frame)
+        self._subscribers.add(subscription)
+        metrics.inc("sse.subscribed")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+        if not subscription.closed:
+            subscription.close()
+
+    def publish(self, frame: str) -> None:
+        self._last_frame = frame
+        for subscription in list(self._subscribers):
+            try:
+                subscription.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # A client that can't keep up would otherwise grow memory without bound
+                metrics.inc("sse.evicted")
+                logger.warning("Evicting slow SSE subscriber")
+                self.unsubscribe(subscription)
+
+    async def _tick(self) -> None:
+        if not self._subscribers:
+            self._last_frame = None
+            return
+        dashboard = await get_cached_dashboard_metrics()
+        self.publish(f"data: {dashboard.model_dump_json()}\n\n")
+        metrics.inc("sse.frames", len(self._subscribers))
+
+
+# Global broadcaster; started by the application lifespan
+dashboard_broadcaster = DashboardBroadcaster(
+    interval_seconds=settings.ANALYTICS_STREAM_INTERVAL_SECONDS,
+    heartbeat_seconds=settings.ANALYTICS_STREAM_HEARTBEAT_SECONDS,
+    queue_size=settings.ANALYTICS_STREAM_QUEUE_SIZE,
+)
@@ -0,0 +1,277 @@
+"""
+Tiered downsampling of performance_metrics.
+
+Raw samples are kept for ANALYTICS_METRICS_RAW_HOURS, 1-minute aggregates
+(count/sum/min/max/last) for ANALYTICS_METRICS_MINUTE_DAYS and hourly aggregates
+after that. Compaction folds completed minutes of raw samples into minute rows
+and completed hours of minute rows into hour rows, each level behind a watermark
+in rollup_watermarks, then prunes a tier once it is past its age and covered by
+the next one. Reads pick the finest tier that still covers the requested range
+and fits the point budget; the part of the range past a tier's watermark is
+rebuilt from the tier below.
+"""
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.tasks import PeriodicTask
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import time_bucket, floor_time, as_naive_utc, parse_db_datetime
+from ..models.analytics import PerformanceMetric, MetricRollup, RollupWatermark
+from ..schemas.analytics import PerformanceMetricResponse
+from .retention import delete_in_chunks, drop_partitions_before
+
+# Tiers, finest first
+TIERS = ("raw", "minute", "hour")
+
+# rollup_watermarks rows marking the (exclusive) end of time already folded into each tier
+WATERMARKS = {"minute": "metrics_minute", "hour": "metrics_hour"}
+
+# How much source data one compaction transaction folds while catching up
+FOLD_SPAN = {"minute": timedelta(hours=1), "hour": timedelta(days=1)}
+
+BucketKey = Tuple[datetime, str]
+
+
+@dataclass
+class MetricBucket:
+    """Running count/sum/min/max/last of the samples in one bucket"""
+    metric_unit: Optional[str] = None
+    count: int = 0
+    sum: float = 0.0
+    min: float = math.inf
+    max: float = -math.inf
+    last: Optional[float] = None
+    last_at: Optional[datetime] = None
+
+    def merge(self, other: "MetricBucket") -> None:
+        self.metric_unit = self.metric_unit or other.metric_unit
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.last_at is None or (other.last_at is not None and other.last_at >= self.last_at):
+            self.last, self.last_at = other.last, other.last_at
+
+    @classmethod
+    def from_row(cls, row: MetricRollup) -> "MetricBucket":
+        return cls(row.metric_unit, row.count, row.sum, row.min, row.max, row.last, as_naive_utc(row.last_at))
+
+
+def _to_response(granularity: str, key: BucketKey, bucket: MetricBucket) -> PerformanceMetricResponse:
+    bucket_start, metric_name = key
+    return PerformanceMetricResponse(
+        id=None,
+        timestamp=bucket_start,
+        metric_name=metric_name,
+        metric_value=round(bucket.sum / bucket.count, 4),
+        metric_unit=bucket.metric_unit,
+        resolution=granularity,
+        sample_count=bucket.count,
+        min_value=bucket.min,
+        max_value=bucket.max,
+        last_value=bucket.last,
+    )
+
+
+class MetricDownsampler:
+    """Compacts performance_metrics into minute/hour tiers and reads from the best-fitting tier"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    # Reads
+    async def read(
+        self,
+        start: datetime,
+        end: Optional[datetime] = None,
+        metric_name: Optional[str] = None,
+        limit: int = 1000,
+        now: Optional[datetime] = None
+    ) -> List[PerformanceMetricResponse]:
+        """Newest-first points for [start, end] from the finest tier that covers it within `limit` points"""
+        now = now or datetime.utcnow()
+        start, end = as_naive_utc(start), as_naive_utc(end) or now
+        watermarks = await self.get_watermarks()
+        for tier in self.eligible_tiers(start, now):
+            if tier == "raw":
+                query = select(PerformanceMetric).where(
+                    PerformanceMetric.timestamp >= start, PerformanceMetric.timestamp <= end
+                )
+                if metric_name:
+                    query = query.where(PerformanceMetric.metric_name == metric_name)
+                rows = (await self.db.scalars(
+                    query.order_by(PerformanceMetric.timestamp.desc()).limit(limit + 1)
+                )).all()
+                points = [PerformanceMetricResponse.from_orm(row) for row in rows]
+            else:
+                buckets = await self.buckets(
+                    tier, floor_time(start, tier), end + timedelta(microseconds=1), metric_name, watermarks, limit + 1
+                )
+                points = [
+                    _to_response(tier, key, buckets[key])
+                    for key in sorted(buckets, key=lambda k: k[0], reverse=True)
+                ]
+            # Coarsen when the budget overflows; the hour tier is the last resort and is just truncated
+            if len(points) <= limit or tier == TIERS[-1]:
+                return points[:limit]
+        return []
+
+    @staticmethod
+    def eligible_tiers(start: datetime, now: datetime) -> List[str]:
+        """Tiers that still hold data as old as `start`, finest first"""
+        tiers = []
+        if start >= now - timedelta(hours=settings.ANALYTICS_METRICS_RAW_HOURS):
+            tiers.append("raw")
+        if start >= now - timedelta(days=settings.ANALYTICS_METRICS_MINUTE_DAYS):
+            tiers.append("minute")
+        tiers.append("hour")
+        return tiers
+
+    async def buckets(
+        self,
+        granularity: str,
+        lo: datetime,
+        hi: datetime,
+        metric_name: Optional[str],
+        watermarks: Dict[str, datetime],
+        limit: Optional[int] = None
+    ) -> Dict[BucketKey, MetricBucket]:
+        """`granularity` buckets for [lo, hi): stored rows up to the tier's watermark, the rest rebuilt from below"""
+        watermark = watermarks.get(granularity)
+        stored_hi = min(hi, watermark) if watermark else lo
+        buckets: Dict[BucketKey, MetricBucket] = {}
+
+        # Unfolded tail first: it is the newest data and must not be squeezed out by the limit
+        if hi > stored_hi:
+            if granularity == "minute":
+                finer = await self._fold_raw(stored_hi, hi, metric_name)
+            else:
+                finer = await self.buckets("minute", stored_hi, hi, metric_name, watermarks)
+            for (bucket_start, name), bucket in finer.items():
+                buckets.setdefault((floor_time(bucket_start, granularity), name), MetricBucket()).merge(bucket)
+
+        if stored_hi > lo and (limit is None or len(buckets) < limit):
+            query = select(MetricRollup).where(
+                MetricRollup.granularity == granularity,
+                MetricRollup.bucket_start >= lo,
+                MetricRollup.bucket_start < stored_hi
+            )
+            if metric_name:
+                query = query.where(MetricRollup.metric_name == metric_name)
+            query = query.order_by(MetricRollup.bucket_start.desc())
+            if limit is not None:
+                query = query.limit(limit - len(buckets))
+            for row in await self.db.scalars(query):
+                buckets[(parse_db_datetime(row.bucket_start), row.metric_name)] = MetricBucket.from_row(row)
+        return buckets
+
+    async def _fold_raw(self, lo: datetime, hi: datetime, metric_name: Optional[str] = None) -> Dict[BucketKey, MetricBucket]:
+        """Minute buckets aggregated from raw samples in [lo, hi)"""
+        bucket = time_bucket(PerformanceMetric.timestamp, "minute", self.db.bind.dialect.name)
+        query = select(
+            bucket.label("bucket_start"), PerformanceMetric.metric_name,
+            func.max(PerformanceMetric.metric_unit).label("metric_unit"),
+            func.count().label("count"),
+            func.sum(PerformanceMetric.metric_value).label("sum"),
+            func.min(PerformanceMetric.metric_value).label("min"),
+            func.max(PerformanceMetric.metric_value).label("max"),
+            func.max(PerformanceMetric.timestamp).label("last_at"),
+        ).where(PerformanceMetric.timestamp >= lo, PerformanceMetric.timestamp < hi)
+        if metric_name:
+            query = query.where(PerformanceMetric.metric_name == metric_name)
+        aggregates = query.group_by(bucket, PerformanceMetric.metric_name).subquery()
+
+        # `last` is the sample at each bucket's newest timestamp; on ties the latest inserted wins
+        rows = await self.db.execute(
+            select(aggregates, PerformanceMetric.metric_value)
+            .join(PerformanceMetric, (PerformanceMetric.metric_name == aggregates.c.metric_name)
+                  & (PerformanceMetric.timestamp == aggregates.c.last_at))
+            .order_by(PerformanceMetric.id)
+        )
+        buckets: Dict[BucketKey, MetricBucket] = {}
+        for bucket_start, name, unit, count, total, low, high, last_at, last in rows:
+            buckets[(parse_db_datetime(bucket_start), name)] = MetricBucket(
+                unit, count, total, low, high, last, parse_db_datetime(last_at)
+            )
+        return buckets
+
+    # Compaction
+    async def compact(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Fold raw samples into minutes and minutes into hours, then prune tiers past their age"""
+        now = now or datetime.utcnow()
+        minutes = await self._fold("minute", floor_time(now - timedelta(seconds=settings.ANALYTICS_ROLLUP_GRACE_SECONDS), "minute"))
+        minute_watermark = (await self.get_watermarks()).get("minute")
+        hours = await self._fold("hour", floor_time(minute_watermark, "hour")) if minute_watermark else 0
+
+        watermarks = await self.get_watermarks()
+        pruned_raw = pruned_minutes = 0
+        if "minute" in watermarks:
+            cutoff = min(watermarks["minute"], now - timedelta(hours=settings.ANALYTICS_METRICS_RAW_HOURS))
+            _, pruned_raw = await drop_partitions_before(self.db, PerformanceMetric.__tablename__, cutoff)
+            pruned_raw += await delete_in_chunks(self.db, PerformanceMetric.id, PerformanceMetric.timestamp, cutoff)
+        if "hour" in watermarks:
+            cutoff = min(watermarks["hour"], now - timedelta(days=settings.ANALYTICS_METRICS_MINUTE_DAYS))
+            pruned_minutes = await delete_in_chunks(
+                self.db, MetricRollup.id, MetricRollup.bucket_start, cutoff, [MetricRollup.granularity == "minute"]
+            )
+        return {"minute": minutes, "hour": hours, "raw_pruned": pruned_raw, "minute_pruned": pruned_minutes}
+
+    async def _fold(self, granularity: str, target: datetime) -> int:
+        """Build `granularity` rows from the tier below up to `target`, one FOLD_SPAN per transaction"""
+        current = (await self.get_watermarks()).get(granularity)
+        if current is None:
+            if granularity == "minute":
+                first = await self.db.scalar(select(func.min(PerformanceMetric.timestamp)))
+            else:
+                first = await self.db.scalar(
+                    select(func.min(MetricRollup.bucket_start)).where(MetricRollup.granularity == "minute")
+                )
+            first = parse_db_datetime(first)
+            if first is None:
+                return 0
+            current = floor_time(first, granularity)
+
+        written = 0
+        while current < target:
+            upper = min(target, current + FOLD_SPAN[granularity])
+            if granularity == "minute":
+                buckets = await self._fold_raw(current, upper)
+            else:
+                buckets = await self.buckets("minute", current, upper, None, {"minute": upper})
+                regrouped: Dict[BucketKey, MetricBucket] = {}
+                for (bucket_start, name), bucket in buckets.items():
+                    regrouped.setdefault((floor_time(bucket_start, "hour"), name), MetricBucket()).merge(bucket)
+                buckets = regrouped
+            if buckets:
+                await self.db.execute(insert(MetricRollup), [
+                    {"granularity": granularity, "bucket_start": bucket_start, "metric_name": name,
+                     "metric_unit": b.metric_unit, "count": b.count, "sum": b.sum, "min": b.min, "max": b.max,
+                     "last": b.last, "last_at": b.last_at}
+                    for (bucket_start, name), b in buckets.items()
+                ])
+            await self.db.merge(RollupWatermark(name=WATERMARKS[granularity], watermark=upper))
+            await self.db.commit()
+            written += len(buckets)
+            current = upper
+        return written
+
+    async def get_watermarks(self) -> Dict[str, datetime]:
+        rows = await self.db.execute(
+            select(RollupWatermark.name, RollupWatermark.watermark)
+            .where(RollupWatermark.name.in_(WATERMARKS.values()))
+        )
+        levels = {name: level for level, name in WATERMARKS.items()}
+        return {levels[name]: parse_db_datetime(watermark) for name, watermark in rows}
+
+
+async def run_metric_downsampling() -> Dict[str, int]:
+    async with AsyncSessionLocal() as db:
+        return await MetricDownsampler(db).compact()
+
+
+# Lifespan-managed job; started alongside the usage rollups
+downsample_task = PeriodicTask("metric_downsampling", settings.ANALYTICS_ROLLUP_INTERVAL_SECONDS, run_metric_downsampling)
@@ -0,0 +1,263 @@
+"""
+Error fingerprinting and grouped error aggregates.
+
+Every ingested error gets a fingerprint: a hash of its error_type, its message
+with volatile parts (ids, numbers, addresses, quoted values) replaced by
+placeholders, and its top ANALYTICS_ERROR_FINGERPRINT_FRAMES stack frames
+(file and function, without line numbers, so a redeploy keeps the group).
+
+Like the session counters, per-fingerprint deltas go through a StagedDeltaBuffer
+(app.core.deltas) and are upserted into error_groups by its periodic flush, so a
+noisy failure turns into one counter update per interval instead of a hot row
+locked by every ingest transaction. The same flush adds each group's
+occurrences to error_group_hours, so recent windows can be ranked by what
+happened inside them rather than by lifetime counts.
+"""
+import hashlib
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Float, case, cast, delete, desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.deltas import StagedDeltaBuffer
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import upsert_insert, as_naive_utc, floor_time
+from ..models.analytics import ErrorLog, ErrorGroup, ErrorGroupHour
+
+MAX_MESSAGE_LENGTH = 500
+
+# Applied in order; earlier patterns swallow what later ones would split up
+_SCRUBBERS = [
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<uuid>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<ip>"),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), "<hex>"),
+    (re.compile(r"\b[0-9a-fA-F]{12,}\b"), "<hex>"),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (re.compile(r"\b\d+(?:\.\d+)?"), "<num>"),  # also "30s", "500ms"
+    (re.compile(r"\s+"), " "),
+]
+
+# Python tracebacks list the innermost frame last; JS stacks list it first
+_PYTHON_FRAME = re.compile(r'File "([^"]+)", line \d+, in (\S+)')
+_JS_FRAME = re.compile(r"at (?:([^\s(]+) )?\(?([^\s()]+?):\d+:\d+\)?")
+
+
+def scrub_message(message: str) -> str:
+    """Message with volatile values replaced by placeholders"""
+    for pattern, placeholder in _SCRUBBERS:
+        message = pattern.sub(placeholder, message)
+    return message.strip()[:MAX_MESSAGE_LENGTH]
+
+
+def _short_path(path: str) -> str:
+    # Install prefixes differ between hosts; keep the last two path components
+    return "/".join(path.replace("\\", "/").split("/")[-2:])
+
+
+def top_frames(stack_trace: Optional[str], limit: Optional[int] = None) -> List[str]:
+    """Innermost `limit` frames of a Python or JS stack trace as 'file:function'"""
+    limit = settings.ANALYTICS_ERROR_FINGERPRINT_FRAMES if limit is None else limit
+    if not stack_trace or limit <= 0:
+        return []
+    python = _PYTHON_FRAME.findall(stack_trace)
+    if python:
+        return [f"{_short_path(path)}:{function}" for path, function in python[-limit:]][::-1]
+    return [f"{_short_path(path)}:{function or '<anonymous>'}" for function, path in _JS_FRAME.findall(stack_trace)[:limit]]
+
+
+def fingerprint(error_type: str, message: str, frames: List[str]) -> str:
+    return hashlib.sha256("\0".join([error_type, message, *frames]).encode()).hexdigest()
+
+
+@dataclass
+class GroupDelta:
+    error_type: str
+    message: str
+    frames: List[str]
+    count: int
+    first_seen: datetime
+    last_seen: datetime
+    last_error_id: Optional[int]
+    sample_message: str
+    sample_stack_trace: Optional[str]
+    sample_request_path: Optional[str]
+    hours: Dict[datetime, int] = field(default_factory=dict)  # occurrences per hour bucket
+
+    def merge(self, other: "GroupDelta") -> "GroupDelta":
+        self.count += other.count
+        for hour, count in other.hours.items():
+            self.hours[hour] = self.hours.get(hour, 0) + count
+        self.first_seen = min(self.first_seen, other.first_seen)
+        if other.last_seen >= self.last_seen:
+            self.last_seen = other.last_seen
+            self.last_error_id = other.last_error_id
+            self.sample_message = other.sample_message
+            self.sample_stack_trace = other.sample_stack_trace
+            self.sample_request_path = other.sample_request_path
+        return self
+
+
+def error_delta(e: Dict[str, Any]) -> Tuple[str, GroupDelta]:
+    """(fingerprint, GroupDelta) for one error row with its id and timestamp"""
+    message = scrub_message(e["error_message"])
+    frames = top_frames(e.get("stack_trace"))
+    seen = as_naive_utc(e.get("timestamp")) or datetime.utcnow()
+    return fingerprint(e["error_type"], message, frames), GroupDelta(
+        error_type=e["error_type"], message=message, frames=frames, count=1,
+        first_seen=seen, last_seen=seen, last_error_id=e.get("id"),
+        sample_message=e["error_message"], sample_stack_trace=e.get("stack_trace"),
+        sample_request_path=e.get("request_path"), hours={floor_time(seen, "hour"): 1},
+    )
+
+
+def stage_error_groups(db: AsyncSession, errors: Iterable[Dict[str, Any]]) -> None:
+    """Count stored error rows into their groups once `db` commits"""
+    for e in errors:
+        error_groups.stage(db, *error_delta(e))
+
+
+def _upsert_params(deltas: Dict[str, GroupDelta]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "fingerprint": key, "error_type": d.error_type, "message": d.message,
+            "frames": "\n".join(d.frames) or None, "count": d.count,
+            "first_seen": d.first_seen, "last_seen": d.last_seen, "last_error_id": d.last_error_id,
+            "sample_message": d.sample_message, "sample_stack_trace": d.sample_stack_trace,
+            "sample_request_path": d.sample_request_path,
+        }
+        for key, d in sorted(deltas.items())  # stable order avoids row-lock deadlocks
+    ]
+
+
+def _upsert_statement(dialect_name: str):
+    table = ErrorGroup.__table__
+    stmt = upsert_insert(table, dialect_name)
+    newer = stmt.excluded.last_seen >= table.c.last_seen
+
+    def latest(column: str):
+        return case((newer, stmt.excluded[column]), else_=table.c[column])
+
+    return stmt.on_conflict_do_update(
+        index_elements=["fingerprint"],
+        set_={
+            "count": table.c.count + stmt.excluded["count"],
+            "first_seen": case((stmt.excluded.first_seen < table.c.first_seen, stmt.excluded.first_seen), else_=table.c.first_seen),
+            "last_seen": latest("last_seen"),
+            "last_error_id": latest("last_error_id"),
+            "sample_message": latest("sample_message"),
+            "sample_stack_trace": latest("sample_stack_trace"),
+            "sample_request_path": latest("sample_request_path"),
+        },
+    )
+
+
+def _hour_params(deltas: Dict[str, GroupDelta]) -> List[Dict[str, Any]]:
+    return [
+        {"fingerprint": key, "bucket_start": hour, "count": count}
+        for key, d in sorted(deltas.items()) for hour, count in sorted(d.hours.items())
+    ]
+
+
+def _hour_upsert_statement(dialect_name: str):
+    table = ErrorGroupHour.__table__
+    stmt = upsert_insert(table, dialect_name)
+    return stmt.on_conflict_do_update(
+        index_elements=["fingerprint", "bucket_start"],
+        set_={"count": table.c.count + stmt.excluded["count"]},
+    )
+
+
+async def _write(db: AsyncSession, pending: Dict[str, GroupDelta]) -> None:
+    """Upsert every pending group and its hourly counts, one executemany each"""
+    await db.execute(_upsert_statement(db.bind.dialect.name), _upsert_params(pending))
+    await db.execute(_hour_upsert_statement(db.bind.dialect.name), _hour_params(pending))
+
+
+def top_groups_query(now: datetime, limit: int = 3):
+    """(label, count) of the groups with the most occurrences in the hour before `now`.
+
+    Counts are kept per clock hour, so the previous hour's bucket is weighted by the
+    share of it still inside the window (a sliding-window estimate).
+    """
+    current = floor_time(now, "hour")
+    previous = current - timedelta(hours=1)
+    weight = 1 - (now - current).total_seconds() / 3600
+    recent = select(
+        ErrorGroupHour.fingerprint,
+        func.sum(case(
+            (ErrorGroupHour.bucket_start < current, cast(ErrorGroupHour.count, Float) * weight),
+            else_=cast(ErrorGroupHour.count, Float)
+        )).label("count"),
+    ).where(ErrorGroupHour.bucket_start >= previous).group_by(ErrorGroupHour.fingerprint).subquery()
+    return select(
+        func.substr(ErrorGroup.error_type + ": " + ErrorGroup.message, 1, 120).label("label"),
+        recent.c.count,
+    ).join(recent, ErrorGroup.fingerprint == recent.c.fingerprint).where(
+        recent.c.count > 0
+    ).order_by(desc(recent.c.count), ErrorGroup.id).limit(limit)
+
+
+async def list_error_groups(
+    db: AsyncSession,
+    limit: int = 50,
+    since: Optional[datetime] = None,
+    error_type: Optional[str] = None,
+    order: str = "count"
+) -> List[Dict[str, Any]]:
+    """Groups (ErrorGroupResponse-shaped dicts), largest or most recently seen first"""
+    query = select(*ErrorGroup.__table__.columns)
+    if since:
+        query = query.where(ErrorGroup.last_seen >= since)
+    if error_type:
+        query = query.where(ErrorGroup.error_type == error_type)
+    ordering = [desc(ErrorGroup.count), desc(ErrorGroup.last_seen)] if order == "count" else [desc(ErrorGroup.last_seen)]
+    rows = await db.execute(query.order_by(*ordering, ErrorGroup.id).limit(limit))
+    return [
+        {**row._mapping, "first_seen": as_naive_utc(row.first_seen), "last_seen": as_naive_utc(row.last_seen)}
+        for row in rows
+    ]
+
+
+async def rebuild_error_groups(db: AsyncSession) -> Dict[str, int]:
+    """Recompute error_groups from the error_logs rows still stored.
+
+    Replaces the groups in one transaction. Occurrences committed while it runs but
+    not yet flushed by a server are counted twice, so pause ingest or run it on a
+    quiet system.
+    """
+    await error_groups.flush()
+    max_id = await db.scalar(select(func.max(ErrorLog.id))) or 0
+    columns = [ErrorLog.id, ErrorLog.timestamp, ErrorLog.error_type, ErrorLog.error_message,
+               ErrorLog.stack_trace, ErrorLog.request_path]
+    deltas: Dict[str, GroupDelta] = {}
+    errors = 0
+    result = await db.stream(
+        select(*columns).where(ErrorLog.id <= max_id).order_by(ErrorLog.id)
+        .execution_options(yield_per=settings.ANALYTICS_EXPORT_BATCH_SIZE)
+    )
+    async for partition in result.mappings().partitions():
+        for row in partition:
+            key, delta = error_delta(row)
+            deltas[key] = deltas[key].merge(delta) if key in deltas else delta
+        errors += len(partition)
+    await db.execute(delete(ErrorGroup))
+    await db.execute(delete(ErrorGroupHour))
+    batch = settings.ANALYTICS_EXPORT_BATCH_SIZE
+    for statement, params in (
+        (_upsert_statement(db.bind.dialect.name), _upsert_params(deltas)),
+        (_hour_upsert_statement(db.bind.dialect.name), _hour_params(deltas)),
+    ):
+        for start in range(0, len(params), batch):
+            await db.execute(statement, params[start:start + batch])
+    await db.commit()
+    return {"errors": errors, "groups": len(deltas)}
+
+
+# Global buffer; started from the lifespan, flushed once more on shutdown
+error_groups = StagedDeltaBuffer(
+    "error_groups", settings.ANALYTICS_ERROR_GROUP_FLUSH_MS, GroupDelta.merge, _write, AsyncSessionLocal
+)
@@ -0,0 +1,193 @@
+"""
+Bulk export of analytics tables as NDJSON, CSV or Parquet.
+
+Rows are read through a server-side cursor (stream_results + yield_per) in
+timestamp order and each batch is encoded and handed on before the next one is
+fetched, so memory stays flat no matter how many rows match. The same stream
+backs the /analytics/export endpoint and `manage.py export`.
+"""
+import asyncio
+import csv
+import io
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+import orjson
+from sqlalchemy import select, Boolean, DateTime, Float, Integer, JSON
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import as_naive_utc
+from ..models.analytics import UsageEvent, PerformanceMetric, ErrorLog, Session as SessionModel, CostTracking
+from .analytics import EVENT_COLUMNS, METRIC_COLUMNS, ERROR_COLUMNS, SESSION_COLUMNS, COST_COLUMNS
+
+
+class InvalidExport(ValueError):
+    pass
+
+
+class ExportUnavailable(RuntimeError):
+    """The requested format needs an optional dependency that is not installed"""
+
+
+@dataclass(frozen=True)
+class ExportTable:
+    model: type
+    timestamp: Any
+    columns: List[Any]
+    filters: Dict[str, Any]  # equality filters, by query parameter name
+
+
+# Same columns and filters as the matching list endpoints
+EXPORT_TABLES: Dict[str, ExportTable] = {
+    "events": ExportTable(UsageEvent, UsageEvent.timestamp, EVENT_COLUMNS, {
+        "session_id": UsageEvent.session_id, "event_type": UsageEvent.event_type,
+    }),
+    "metrics": ExportTable(PerformanceMetric, PerformanceMetric.timestamp, METRIC_COLUMNS, {
+        "metric_name": PerformanceMetric.metric_name,
+    }),
+    "errors": ExportTable(ErrorLog, ErrorLog.timestamp, ERROR_COLUMNS, {
+        "error_type": ErrorLog.error_type, "resolved": ErrorLog.resolved,
+    }),
+    "sessions": ExportTable(SessionModel, SessionModel.created_at, SESSION_COLUMNS, {}),
+    "costs": ExportTable(CostTracking, CostTracking.timestamp, COST_COLUMNS, {
+        "service_name": CostTracking.service_name,
+    }),
+}
+
+# Format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def export_query(table: str, start: Optional[datetime] = None, end: Optional[datetime] = None, **filters: Any):
+    """Oldest-first SELECT of the table's export columns; None-valued filters are ignored"""
+    spec = EXPORT_TABLES[table]
+    query = select(*spec.columns)
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in spec.filters:
+            raise InvalidExport(
+                f"'{table}' can be filtered by: {', '.join(['start_date', 'end_date', *spec.filters])}"
+            )
+        query = query.where(spec.filters[name] == value)
+    if start:
+        query = query.where(spec.timestamp >= start)
+    if end:
+        query = query.where(spec.timestamp <= end)
+    return query.order_by(spec.timestamp, spec.model.id)
+
+
+async def stream_rows(query, batch_size: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Batches of row dicts from a server-side cursor on a dedicated session"""
+    batch_size = batch_size or settings.ANALYTICS_EXPORT_BATCH_SIZE
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for partition in result.mappings().partitions():
+            metrics.inc("export.rows", len(partition))
+            yield [dict(row) for row in partition]
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def arrow_schema(columns: Iterable[Any]):
+    """pyarrow schema for SQLAlchemy columns; JSON columns are stored as JSON text"""
+    pa = require_pyarrow()
+    fields = []
+    for column in columns:
+        if isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us")  # naive UTC, as everywhere else in the app
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def arrow_table(rows: List[Dict[str, Any]], columns: List[Any], schema):
+    pa = require_pyarrow()
+    data = {}
+    for column in columns:
+        values = [row[column.name] for row in rows]
+        if isinstance(column.type, JSON):
+            values = [None if v is None else orjson.dumps(v).decode() for v in values]
+        elif isinstance(column.type, DateTime):
+            values = [as_naive_utc(v) for v in values]
+        data[column.name] = values
+    return pa.Table.from_pydict(data, schema=schema)
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ExportUnavailable("Parquet support requires pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+async def encode(batches: AsyncIterator[List[Dict[str, Any]]], fmt: str, columns: List[Any]) -> AsyncIterator[bytes]:
+    """Encode row batches as `fmt`, yielding one chunk per batch"""
+    names = [column.name for column in columns]
+    if fmt == "ndjson":
+        async for rows in batches:
+            yield b"".join(orjson.dumps(row) + b"\n" for row in rows)
+    elif fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        async for rows in batches:
+            writer.writerows([_csv_value(row[name]) for name in names] for row in rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        schema = arrow_schema(columns)
+        # One row group per batch; the sink is drained after every write
+        sink = io.BytesIO()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+        def write_batch(rows: List[Dict[str, Any]]) -> bytes:
+            writer.write_table(arrow_table(rows, columns, schema))
+            chunk = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return chunk
+
+        try:
+            async for rows in batches:
+                # Arrow conversion and zstd compression are CPU-bound; keep them off the event loop
+                yield await asyncio.to_thread(write_batch, rows)
+        finally:
+            writer.close()
+        yield sink.getvalue()
+    else:
+        raise InvalidExport(f"Unknown format '{fmt}'")
+
+
+def export_stream(table: str, fmt: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  batch_size: Optional[int] = None, **filters: Any) -> AsyncIterator[bytes]:
+    """Encoded export of `table`; validates the request up front so errors surface before streaming starts"""
+    if fmt not in EXPORT_FORMATS:
+        raise InvalidExport(f"Format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if fmt == "parquet":
+        require_pyarrow()
+    query = export_query(table, start, end, **filters)
+    return encode(stream_rows(query, batch_size), fmt, EXPORT_TABLES[table].columns)
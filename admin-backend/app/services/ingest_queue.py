@@ -0,0 +1,154 @@
+"""
+Write-behind ingest queue: handlers enqueue validated records and a background
+flusher writes them to the database in batches.
+
+Records are stamped with their enqueue time, so a slow flush doesn't move them.
+A flush that fails on a connection error is retried with exponential backoff;
+one rejected by the database is split in halves until the bad records are
+isolated, so only those are dropped.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.exc import SQLAlchemyError, OperationalError, InterfaceError
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..db.database import AsyncSessionLocal
+from .analytics import AnalyticsService, INGEST_TYPES, RECEIVED_AT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """Bounded in-process queue drained by a lifespan-managed flusher task"""
+
+    def __init__(
+        self,
+        maxsize: int,
+        batch_size: int,
+        flush_interval_ms: int,
+        max_retries: int = 5,
+        retry_backoff_ms: int = 200,
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        metrics.gauge("ingest_queue.depth", lambda: self._queue.qsize() if self._queue else 0)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="ingest-queue-flusher")
+        logger.info(f"Write-behind ingest queue started (maxsize={self.maxsize}, batch={self.batch_size})")
+
+    async def stop(self) -> None:
+        """Stop accepting work and flush everything still queued"""
+        if not self.running:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        logger.info("Write-behind ingest queue stopped")
+
+    def offer(self, kind: str, record: Dict[str, Any]) -> bool:
+        """Queue a validated record; returns False when the caller should write synchronously"""
+        if not self.running or self._stopping.is_set():
+            return False
+        _, model = INGEST_TYPES[kind]
+        try:
+            self._queue.put_nowait((kind, {**record, RECEIVED_AT_COLUMNS[model]: datetime.utcnow()}))
+        except asyncio.QueueFull:
+            metrics.inc("ingest_queue.full")
+            return False
+        metrics.inc("ingest_queue.enqueued")
+        return True
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            batch = await self._collect_batch()
+            if batch:
+                await self._flush(batch)
+        # Shutdown: drain whatever is left
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait() for _ in range(min(self.batch_size, self._queue.qsize()))]
+            await self._flush(batch)
+
+    async def _collect_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Wait for the first record, then gather more until the batch is full or the interval elapses"""
+        batch: List[Tuple[str, Dict[str, Any]]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stopping.is_set():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        start = time.perf_counter()
+        try:
+            await self._flush_with_retry(batch)
+        finally:
+            metrics.observe("ingest_queue.flush_latency_ms", (time.perf_counter() - start) * 1000)
+
+    async def _flush_with_retry(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Write a batch, retrying connection errors and bisecting batches the database rejects"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._write(batch)
+                metrics.inc("ingest_queue.flushed", len(batch))
+                return
+            except (OperationalError, InterfaceError) as e:
+                if attempt == self.max_retries:
+                    metrics.inc("ingest_queue.dropped", len(batch))
+                    logger.error(f"Write-behind flush of {len(batch)} records failed after {attempt + 1} attempts: {e}")
+                    return
+                metrics.inc("ingest_queue.retries")
+                logger.warning(f"Write-behind flush of {len(batch)} records failed, retrying: {e.__class__.__name__}: {e}")
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            except SQLAlchemyError as e:
+                if len(batch) == 1:
+                    metrics.inc("ingest_queue.dropped")
+                    logger.error(f"Write-behind dropped a {batch[0][0]} record the database rejected: {e}")
+                    return
+                middle = len(batch) // 2
+                await self._flush_with_retry(batch[:middle])
+                await self._flush_with_retry(batch[middle:])
+                return
+
+    async def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for kind, record in batch:
+            grouped.setdefault(kind, []).append(record)
+        async with AsyncSessionLocal() as db:
+            service = AnalyticsService(db)
+            for kind, records in grouped.items():
+                _, model = INGEST_TYPES[kind]
+                await service.bulk_insert(model, records)
+            await db.commit()
+
+
+# Global queue instance; only started when ANALYTICS_WRITE_BEHIND is enabled
+ingest_queue = IngestQueue(
+    maxsize=settings.ANALYTICS_QUEUE_MAXSIZE,
+    batch_size=settings.ANALYTICS_FLUSH_BATCH_SIZE,
+    flush_interval_ms=settings.ANALYTICS_FLUSH_INTERVAL_MS,
+    max_retries=settings.ANALYTICS_FLUSH_MAX_RETRIES,
+    retry_backoff_ms=settings.ANALYTICS_FLUSH_RETRY_BACKOFF_MS,
+)
@@ -0,0 +1,312 @@
+"""
+Crash-safe disk spool for analytics ingest.
+
+Records are appended as JSON lines, stamped with their receive time, to the
+active segment file and acknowledged once a batched fsync covers them. Segments
+are sealed by size or age; a replay worker bulk-loads sealed segments into the
+database and deletes each segment once it is fully loaded. Replayed rows keep
+the receive time as their timestamp (created_at for sessions), so an outage
+doesn't shift them to when the database came back.
+
+Each chunk's end offset is committed to spool_checkpoints in the same
+transaction as its rows (and the session counter / error group deltas they
+stage), so a crash at any point resumes after the last committed chunk without
+loading a record twice. Segment names carry a random token, so checkpoint keys
+are never reused.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError, OperationalError, InterfaceError
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..db.database import AsyncSessionLocal
+from ..models.analytics import SpoolCheckpoint
+from .analytics import AnalyticsService, INGEST_TYPES, RECEIVED_AT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_SUFFIX = ".ckpt"
+REJECTED_SUFFIX = ".rejected"
+
+
+class IngestSpool:
+    """Append-only segment spool with group-committed fsync and a replay worker"""
+
+    def __init__(
+        self,
+        directory: str,
+        segment_max_bytes: int,
+        rotate_seconds: int,
+        fsync_interval_ms: int,
+        replay_batch_size: int,
+        replay_interval_ms: int,
+    ):
+        self.directory = Path(directory) if directory else None
+        self.segment_max_bytes = segment_max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.replay_batch_size = replay_batch_size
+        self.replay_interval = replay_interval_ms / 1000
+        self._active = None
+        self._active_path: Optional[Path] = None
+        self._active_opened = 0.0
+        self._next_seq = 0
+        self._waiters: List[asyncio.Future] = []
+        self._tasks: List[asyncio.Task] = []
+        self._stopping: Optional[asyncio.Event] = None
+        metrics.gauge("spool.pending_segments", lambda: len(self._sealed_segments()) if self.running else 0)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks) and self._active is not None
+
+    def start(self) -> None:
+        if self.running or self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Segments left by a previous process are sealed; new writes go to a fresh segment
+        existing = [self._segment_seq(p) for p in self.directory.glob(f"*{SEGMENT_SUFFIX}")]
+        self._next_seq = max(existing, default=0) + 1
+        self._open_segment()
+        self._stopping = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._sync_loop(), name="spool-fsync"),
+            asyncio.create_task(self._replay_loop(), name="spool-replay"),
+        ]
+        logger.info(f"Ingest spool started at {self.directory} ({len(existing)} segments pending replay)")
+
+    async def stop(self) -> None:
+        """Fsync outstanding appends, seal the active segment and attempt a final replay"""
+        if not self.running:
+            return
+        self._stopping.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._rotate(reopen=False)
+        try:
+            await self._replay_pending()
+        except SQLAlchemyError as e:
+            logger.warning(f"Final spool replay failed; segments kept for next start: {e}")
+        logger.info("Ingest spool stopped")
+
+    async def append(self, kind: str, record: Dict[str, Any]) -> None:
+        """Append a record and wait until it is durable on disk"""
+        entry = {"k": kind, "t": datetime.utcnow().isoformat(), "r": record}
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        self._active.write(line.encode())
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.inc("spool.appended")
+        await waiter
+
+    # Segment files
+
+    def _segment_seq(self, path: Path) -> int:
+        # segment-<seq>-<token>; segments written by older versions have no token
+        return int(path.stem.split("-")[1])
+
+    def _open_segment(self) -> None:
+        self._active_path = self.directory / f"segment-{self._next_seq:012d}-{uuid.uuid4().hex[:12]}{SEGMENT_SUFFIX}"
+        self._next_seq += 1
+        self._active = open(self._active_path, "ab")
+        self._active_opened = time.monotonic()
+
+    def _seal_active(self) -> None:
+        if self._active is None:
+            return
+        empty = self._active.tell() == 0
+        self._active.close()
+        if empty:
+            self._active_path.unlink(missing_ok=True)
+        self._active = None
+        self._active_path = None
+
+    def _sealed_segments(self) -> List[Path]:
+        return sorted(
+            (p for p in self.directory.glob(f"*{SEGMENT_SUFFIX}") if p != self._active_path),
+            key=self._segment_seq,
+        )
+
+    def _read_checkpoint(self, segment: Path) -> int:
+        try:
+            return int(segment.with_suffix(CHECKPOINT_SUFFIX).read_text().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    # Group-committed fsync
+
+    async def _sync(self) -> None:
+        if self._active is None:
+            return
+        waiters, self._waiters = self._waiters, []
+        if not waiters:
+            return
+        start = time.perf_counter()
+        try:
+            self._active.flush()
+            await asyncio.to_thread(os.fsync, self._active.fileno())
+        except OSError as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            raise
+        metrics.observe("spool.fsync_ms", (time.perf_counter() - start) * 1000)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _rotate(self, reopen: bool) -> None:
+        """Seal the active segment once every append to it is durable"""
+        # No await between the last sync and sealing, so no append can slip in unsynced
+        while self._waiters:
+            await self._sync()
+        self._seal_active()
+        if reopen:
+            self._open_segment()
+
+    async def _sync_loop(self) -> None:
+        while not self._stopping.is_set():
+            await asyncio.sleep(self.fsync_interval)
+            try:
+                await self._sync()
+            except OSError as e:
+                logger.error(f"Spool fsync failed: {e}")
+                continue
+            size = self._active.tell()
+            aged = time.monotonic() - self._active_opened >= self.rotate_seconds
+            if size >= self.segment_max_bytes or (size and aged):
+                await self._rotate(reopen=True)
+
+    # Replay
+
+    async def _replay_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self._replay_pending()
+            except SQLAlchemyError as e:
+                # Database unavailable: keep segments and retry on the next tick
+                metrics.inc("spool.replay_errors")
+                logger.warning(f"Spool replay deferred: {e.__class__.__name__}: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.replay_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _replay_pending(self) -> None:
+        for segment in self._sealed_segments():
+            await self._replay_segment(segment)
+
+    async def _replay_segment(self, segment: Path) -> None:
+        key = segment.stem
+        offset = await self._load_checkpoint(key, segment)
+        while True:
+            lines, next_offset = await asyncio.to_thread(self._read_chunk, segment, offset)
+            if not lines:
+                break
+            start = time.perf_counter()
+            await self._load(segment, lines, next_offset)
+            metrics.inc("spool.replayed", len(lines))
+            metrics.observe("spool.replay_ms", (time.perf_counter() - start) * 1000)
+            offset = next_offset
+        segment.unlink(missing_ok=True)
+        segment.with_suffix(CHECKPOINT_SUFFIX).unlink(missing_ok=True)
+        # A crash before this only leaves a row for a name that is never reused
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(SpoolCheckpoint).where(SpoolCheckpoint.segment == key))
+            await db.commit()
+
+    async def _load_checkpoint(self, key: str, segment: Path) -> int:
+        async with AsyncSessionLocal() as db:
+            offset = await db.scalar(select(SpoolCheckpoint.byte_offset).where(SpoolCheckpoint.segment == key))
+        # Segments spooled before checkpoints moved into the database kept them in a file
+        return offset if offset is not None else self._read_checkpoint(segment)
+
+    def _read_chunk(self, segment: Path, offset: int) -> Tuple[List[Tuple[bytes, int]], int]:
+        """Up to replay_batch_size complete lines from `offset`, each with the offset just past it"""
+        lines: List[Tuple[bytes, int]] = []
+        with open(segment, "rb") as f:
+            f.seek(offset)
+            while len(lines) < self.replay_batch_size:
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    # Torn write from a crash mid-append; the record was never acknowledged
+                    logger.warning(f"Discarding partial record at end of {segment.name}")
+                    offset = f.tell()
+                    break
+                offset = f.tell()
+                lines.append((line, offset))
+        return lines, offset
+
+    async def _load(self, segment: Path, lines: List[Tuple[bytes, int]], next_offset: int) -> None:
+        """Insert a chunk and move the segment's checkpoint to `next_offset` in the same transaction"""
+        entries: List[Tuple[bytes, int, str, Dict[str, Any]]] = []
+        replayed_at = datetime.utcnow()
+        for line, end in lines:
+            try:
+                entry = json.loads(line)
+                kind, record = entry["k"], entry["r"]
+                # Records spooled before receive times were recorded take the replay time
+                received = datetime.fromisoformat(entry["t"]) if "t" in entry else replayed_at
+            except (ValueError, KeyError, TypeError):
+                self._reject(segment, [line])
+                continue
+            if kind not in INGEST_TYPES:
+                self._reject(segment, [line])
+                continue
+            _, model = INGEST_TYPES[kind]
+            entries.append((line, end, kind, {**record, RECEIVED_AT_COLUMNS[model]: received}))
+        try:
+            await self._insert(segment.stem, next_offset, entries)
+        except (OperationalError, InterfaceError):
+            raise
+        except SQLAlchemyError:
+            # A bad record poisons the whole chunk; load one record per transaction, in file
+            # order, so the checkpoint only ever moves past records stored or rejected
+            for entry in entries:
+                try:
+                    await self._insert(segment.stem, entry[1], [entry])
+                except (OperationalError, InterfaceError):
+                    raise
+                except SQLAlchemyError:
+                    self._reject(segment, [entry[0]])
+            await self._insert(segment.stem, next_offset, [])
+
+    async def _insert(self, key: str, offset: int, entries: List[Tuple[bytes, int, str, Dict[str, Any]]]) -> None:
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for _, _, kind, record in entries:
+            grouped.setdefault(kind, []).append(record)
+        async with AsyncSessionLocal() as db:
+            service = AnalyticsService(db)
+            for kind, records in grouped.items():
+                _, model = INGEST_TYPES[kind]
+                await service.bulk_insert(model, records)
+            await db.merge(SpoolCheckpoint(segment=key, byte_offset=offset))
+            await db.commit()
+
+    def _reject(self, segment: Path, lines: List[bytes]) -> None:
+        metrics.inc("spool.rejected", len(lines))
+        with open(segment.with_suffix(REJECTED_SUFFIX), "ab") as f:
+            f.writelines(lines)
+        logger.error(f"Moved {len(lines)} unloadable record(s) from {segment.name} to {REJECTED_SUFFIX}")
+
+
+# Global spool instance; only started when ANALYTICS_SPOOL_DIR is set
+ingest_spool = IngestSpool(
+    directory=settings.ANALYTICS_SPOOL_DIR,
+    segment_max_bytes=settings.ANALYTICS_SPOOL_SEGMENT_BYTES,
+    rotate_seconds=settings.ANALYTICS_SPOOL_ROTATE_SECONDS,
+    fsync_interval_ms=settings.ANALYTICS_SPOOL_FSYNC_MS,
+    replay_batch_size=settings.ANALYTICS_SPOOL_REPLAY_BATCH_SIZE,
+    replay_interval_ms=settings.ANALYTICS_SPOOL_REPLAY_INTERVAL_MS,
+)
@@ -0,0 +1,268 @@
+"""
+Embedded DuckDB snapshot for long-range aggregations.
+
+When ANALYTICS_OLAP_PATH is set, usage_events and cost_tracking are mirrored
+into a columnar DuckDB file. A periodic refresh copies rows stamped after the
+table's watermark (up to now minus ANALYTICS_ROLLUP_GRACE_SECONDS, the same
+grace the rollups leave for in-flight transactions) and advances the watermark
+in the same DuckDB transaction, so a failed refresh copies nothing. Rows are
+copied by timestamp rather than id because ids can commit out of order.
+
+Retention and the cold archive only ever delete a prefix of each table, so the
+refresh mirrors deletions by dropping snapshot rows older than the oldest row
+still in the database.
+
+Range queries are split at the watermark: DuckDB answers everything before it
+and the database only the recent tail. Ranges shorter than
+ANALYTICS_OLAP_MIN_RANGE_DAYS stay on the database, where indexes win.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import select, func
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..core.tasks import PeriodicTask
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import GRANULARITIES, as_naive_utc, parse_db_datetime
+from ..models.analytics import UsageEvent, CostTracking
+from .export import arrow_schema, arrow_table
+
+logger = logging.getLogger(__name__)
+
+# Mirrored tables by name; every column is kept
+OLAP_MODELS = {
+    "usage_events": UsageEvent,
+    "cost_tracking": CostTracking,
+}
+
+AGGREGATES = {"count", "sum", "avg", "min", "max"}
+
+
+class OlapUnavailable(RuntimeError):
+    """The snapshot is disabled, duckdb is not installed, or another process holds the file"""
+
+
+def require_duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        raise OlapUnavailable("The analytical snapshot requires duckdb (pip install duckdb)")
+    return duckdb
+
+
+def _column(model, name: str) -> str:
+    if name not in model.__table__.c:
+        raise ValueError(f"{model.__tablename__} has no column '{name}'")
+    return f'"{name}"'
+
+
+class OlapSnapshot:
+    """Columnar copy of the append-only analytics tables, refreshed incrementally"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else settings.ANALYTICS_OLAP_PATH
+        self._con = None
+        self._failed = False
+        self._lock = asyncio.Lock()  # one refresh at a time
+        self.watermarks: Dict[str, datetime] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and not self._failed
+
+    def connect(self, read_only: bool = False):
+        if self._con is not None:
+            return self._con
+        if not self.enabled:
+            raise OlapUnavailable("ANALYTICS_OLAP_PATH is not set")
+        duckdb = require_duckdb()
+        try:
+            con = duckdb.connect(self.path, read_only=read_only)
+        except duckdb.IOException as e:
+            # DuckDB files take one writer process; other workers fall back to the database
+            self._failed = True
+            logger.warning(f"Analytical snapshot disabled in this process: {e}")
+            raise OlapUnavailable(str(e))
+        if not read_only:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS olap_watermarks ("
+                "table_name VARCHAR PRIMARY KEY, watermark TIMESTAMP NOT NULL, "
+                "rows BIGINT NOT NULL, refreshed_at TIMESTAMP NOT NULL)"
+            )
+            for table, model in OLAP_MODELS.items():
+                empty = arrow_table([], list(model.__table__.columns), arrow_schema(model.__table__.columns))
+                con.register("empty_batch", empty)
+                con.execute(f'CREATE TABLE IF NOT EXISTS "{table}" AS SELECT * FROM empty_batch')
+                con.unregister("empty_batch")
+        self.watermarks = {
+            table: watermark for table, watermark in con.execute("SELECT table_name, watermark FROM olap_watermarks").fetchall()
+        }
+        self._con = con
+        return con
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    # Refresh
+    async def refresh(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Copy newly settled rows into the snapshot; returns rows copied per table"""
+        con = self.connect()
+        upper = (now or datetime.utcnow()) - timedelta(seconds=settings.ANALYTICS_ROLLUP_GRACE_SECONDS)
+        copied = {}
+        async with self._lock:
+            for table, model in OLAP_MODELS.items():
+                copied[table] = await self._refresh_table(con, table, model, upper)
+        return copied
+
+    async def _refresh_table(self, con, table: str, model, upper: datetime) -> int:
+        started = time.perf_counter()
+        columns = list(model.__table__.columns)
+        schema = arrow_schema(columns)
+        watermark = self.watermarks.get(table)
+        query = select(*columns).where(model.timestamp <= upper)
+        if watermark is not None:
+            query = query.where(model.timestamp > watermark)
+        query = query.order_by(model.timestamp, model.id)
+
+        cur = con.cursor()
+        copied = 0
+        try:
+            cur.execute("BEGIN TRANSACTION")
+            async with AsyncSessionLocal() as db:
+                oldest = parse_db_datetime(await db.scalar(select(func.min(model.timestamp))))
+                result = await db.stream(query.execution_options(yield_per=settings.ANALYTICS_EXPORT_BATCH_SIZE))
+                async for partition in result.mappings().partitions():
+                    data = arrow_table([dict(row) for row in partition], columns, schema)
+                    await asyncio.to_thread(self._append, cur, table, data)
+                    copied += len(partition)
+
+            def finish():
+                # Mirror retention / archive deletions, which always remove the oldest rows
+                if oldest is None:
+                    cur.execute(f'DELETE FROM "{table}"')
+                else:
+                    cur.execute(f'DELETE FROM "{table}" WHERE "timestamp" < ?', [oldest])
+                rows = cur.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+                cur.execute(
+                    "INSERT OR REPLACE INTO olap_watermarks VALUES (?, ?, ?, ?)",
+                    [table, upper, rows, datetime.utcnow()],
+                )
+                cur.execute("COMMIT")
+
+            await asyncio.to_thread(finish)
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            cur.close()
+        self.watermarks[table] = upper
+        metrics.inc(f"olap.{table}.rows_copied", copied)
+        metrics.observe("olap.refresh_ms", (time.perf_counter() - started) * 1000)
+        if copied:
+            logger.info(f"Copied {copied} {table} rows into the analytical snapshot (watermark {upper.isoformat()})")
+        return copied
+
+    @staticmethod
+    def _append(cur, table: str, data) -> None:
+        cur.register("batch", data)
+        cur.execute(f'INSERT INTO "{table}" SELECT * FROM batch')
+        cur.unregister("batch")
+
+    # Routing
+    def split_point(self, table: str, start: Optional[datetime], end: Optional[datetime]) -> Optional[datetime]:
+        """Where to hand [start, end] over from the snapshot to the database, or None to skip the snapshot.
+
+        The snapshot serves timestamps before the returned point, the database the rest.
+        """
+        if not self.enabled or self._con is None:
+            return None
+        watermark = self.watermarks.get(table)
+        start, end = as_naive_utc(start), as_naive_utc(end) or datetime.utcnow()
+        if watermark is None or (start is not None and start >= watermark):
+            return None
+        if start is not None and end - start < timedelta(days=settings.ANALYTICS_OLAP_MIN_RANGE_DAYS):
+            return None
+        return min(watermark, end + timedelta(microseconds=1))
+
+    # Queries
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        """Run a query against the snapshot on a worker thread"""
+        con = self.connect()
+        started = time.perf_counter()
+
+        def run():
+            cur = con.cursor()
+            try:
+                return cur.execute(sql, list(params)).fetchall()
+            finally:
+                cur.close()
+
+        try:
+            return await asyncio.to_thread(run)
+        finally:
+            metrics.inc("olap.queries")
+            metrics.observe("olap.query_ms", (time.perf_counter() - started) * 1000)
+
+    def _where(self, model, start: Optional[datetime], before: datetime, equals: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        clauses, params = ['"timestamp" < ?'], [before]
+        if start is not None:
+            clauses.append('"timestamp" >= ?')
+            params.append(as_naive_utc(start))
+        for name, value in equals.items():
+            if value is not None:
+                clauses.append(f"{_column(model, name)} = ?")
+                params.append(value)
+        return " AND ".join(clauses), params
+
+    async def totals(
+        self,
+        table: str,
+        start: Optional[datetime],
+        before: datetime,
+        sums: Sequence[str] = (),
+        **equals: Any
+    ) -> Dict[str, float]:
+        """Row count and column sums for start <= timestamp < before"""
+        model = OLAP_MODELS[table]
+        where, params = self._where(model, start, before, equals)
+        selected = ", ".join(["count(*)"] + [f"coalesce(sum({_column(model, c)}), 0)" for c in sums])
+        row = (await self.execute(f'SELECT {selected} FROM "{table}" WHERE {where}', params))[0]
+        return {"rows": int(row[0]), **{column: float(value) for column, value in zip(sums, row[1:])}}
+
+    async def series(
+        self,
+        table: str,
+        bucket: str,
+        start: datetime,
+        before: datetime,
+        aggregate: str = "count",
+        value: Optional[str] = None,
+        group_by: Optional[str] = None,
+        **equals: Any
+    ) -> List[Tuple]:
+        """(series, bucket start, value) rows for start <= timestamp < before, like TimeSeriesService._sql_rows"""
+        model = OLAP_MODELS[table]
+        if bucket not in GRANULARITIES or aggregate not in AGGREGATES:
+            raise ValueError(f"Unsupported bucket/aggregate {bucket}/{aggregate}")
+        where, params = self._where(model, start, before, equals)
+        measure = "count(*)" if aggregate == "count" else f"{aggregate}({_column(model, value)})"
+        series = _column(model, group_by) if group_by else "NULL"
+        sql = (
+            f"SELECT {series} AS series, date_trunc('{bucket}', \"timestamp\") AS bucket, {measure} AS value "
+            f'FROM "{table}" WHERE {where} GROUP BY ALL'
+        )
+        return await self.execute(sql, params)
+
+
+async def refresh_snapshot() -> Dict[str, int]:
+    return await olap_snapshot.refresh()
+
+
+# Lifespan-managed snapshot and refresh job; only started when ANALYTICS_OLAP_PATH is set
+olap_snapshot = OlapSnapshot()
+olap_refresh_task = PeriodicTask("olap_refresh", settings.ANALYTICS_OLAP_REFRESH_SECONDS, refresh_snapshot)
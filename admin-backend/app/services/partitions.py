@@ -0,0 +1,28 @@
+"""
+Partition manager: keeps daily/monthly partitions created ahead of incoming data.
+
+Runs at startup (via create_schema) and periodically from the lifespan so a
+long-running process never writes into the DEFAULT partition. No-op on SQLite.
+"""
+import logging
+from typing import List
+from ..core.config import settings
+from ..core.tasks import PeriodicTask
+from ..db.database import async_engine
+from ..db.partitions import ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+
+async def maintain_partitions() -> List[str]:
+    if async_engine.dialect.name != "postgresql":
+        return []
+    async with async_engine.begin() as conn:
+        created = await conn.run_sync(ensure_partitions, settings.ANALYTICS_PARTITION_PREMAKE_DAYS)
+    if created:
+        logger.info(f"Created partitions: {', '.join(created)}")
+    return created
+
+
+# Lifespan-managed job; started on PostgreSQL only
+partition_task = PeriodicTask("partition_manager", settings.ANALYTICS_PARTITION_INTERVAL_SECONDS, maintain_partitions)
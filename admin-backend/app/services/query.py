@@ -0,0 +1,297 @@
+"""
+Declarative aggregate queries.
+
+An AnalyticsQuery (source, filters, group-by dimensions, aggregates, limit) is
+validated against a per-source whitelist and compiled to one SELECT ... GROUP BY
+statement. Before it runs, the rows its filters match are estimated (EXPLAIN on
+PostgreSQL, a capped count on SQLite). Queries over ANALYTICS_QUERY_MAX_SCAN_ROWS
+are answered from a TABLESAMPLE on PostgreSQL, with counts and sums scaled back
+up, or rejected. Every query runs under ANALYTICS_QUERY_TIMEOUT_MS.
+
+Percentiles compile to percentile_cont, which SQLite doesn't have.
+"""
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, func, text, literal_column
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..db.dialect import GRANULARITIES, time_bucket, as_naive_utc, parse_db_datetime
+from ..models.analytics import UsageEvent, PerformanceMetric, ErrorLog, CostTracking
+from ..schemas.analytics import AnalyticsQuery, AnalyticsQueryResponse
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+class QueryTooExpensive(InvalidQuery):
+    pass
+
+
+class QueryTimeout(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class QuerySource:
+    model: type
+    dimensions: Tuple[str, ...]  # group-by / filter columns
+    measures: Tuple[str, ...]  # numeric columns for sum/avg/min/max/percentiles
+
+
+# performance_metrics only keeps raw samples for ANALYTICS_METRICS_RAW_HOURS
+QUERY_SOURCES: Dict[str, QuerySource] = {
+    "events": QuerySource(
+        UsageEvent, ("tool_name", "event_type", "session_id", "success"), ("response_time_ms",)
+    ),
+    "metrics": QuerySource(
+        PerformanceMetric, ("metric_name", "metric_unit", "session_id"), ("metric_value",)
+    ),
+    "errors": QuerySource(
+        ErrorLog, ("error_type", "session_id", "request_path", "request_method", "resolved"), ()
+    ),
+    "costs": QuerySource(
+        CostTracking, ("service_name", "operation_type", "session_id"), ("cost_usd", "tokens_used")
+    ),
+}
+
+BUCKET = "bucket"
+AGGREGATES = ("count", "sum", "avg", "min", "max")
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p95": 0.95, "p99": 0.99}
+FILTER_OPS = {
+    "eq": lambda column, value: column == value,
+    "ne": lambda column, value: column != value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "in": lambda column, value: column.in_(value),
+}
+MAX_IN_VALUES = 1000
+_BOOLEAN_STRINGS = {"true": True, "1": True, "false": False, "0": False}
+
+
+def coerce_filter_value(column, value: Any) -> Any:
+    """Filter value converted to the column's Python type; raises InvalidQuery when it doesn't fit"""
+    python_type = column.type.python_type
+    if value is None:
+        return None
+    try:
+        if not isinstance(value, (str, int, float)):
+            raise TypeError(value)
+        if python_type is bool:
+            if isinstance(value, str):
+                return _BOOLEAN_STRINGS[value.strip().lower()]
+            if value not in (0, 1):
+                raise ValueError(value)
+            return bool(value)
+        if python_type in (int, float):
+            if isinstance(value, bool):
+                raise TypeError(value)
+            number = python_type(value)
+            if python_type is int and isinstance(value, float) and number != value:
+                raise ValueError(value)
+            return number
+        return str(value)
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise InvalidQuery(f"'{column.name}' filters take {python_type.__name__} values, got {value!r}")
+
+
+class ExplainJson(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a statement, compiled with its bound parameters"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(ExplainJson, "postgresql")
+def _explain_json(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+class AggregateQueryService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.dialect = db.bind.dialect.name
+
+    async def run(self, spec: AnalyticsQuery, now: Optional[datetime] = None) -> AnalyticsQueryResponse:
+        started = time.perf_counter()
+        source = self._source(spec)
+        end = as_naive_utc(spec.end_date) or now or datetime.utcnow()
+        start = as_naive_utc(spec.start_date) or end - timedelta(hours=24)
+        if start >= end:
+            raise InvalidQuery("start_date must be before end_date")
+
+        table = source.model.__table__
+        estimated = await self.estimate_rows(table, self._where(table, source, spec, start, end))
+        sample_percent = None
+        if estimated > settings.ANALYTICS_QUERY_MAX_SCAN_ROWS:
+            if not (spec.allow_sampling and self.dialect == "postgresql"):
+                metrics.inc("query.rejected")
+                hint = " or set allow_sampling" if self.dialect == "postgresql" else ""
+                raise QueryTooExpensive(
+                    f"Query would scan about {estimated} rows (limit {settings.ANALYTICS_QUERY_MAX_SCAN_ROWS}); "
+                    f"narrow the date range, add filters{hint}"
+                )
+            sample_percent = max(0.01, round(100.0 * settings.ANALYTICS_QUERY_MAX_SCAN_ROWS / estimated, 2))
+            table = table.tablesample(func.system(literal_column(repr(sample_percent))))
+            metrics.inc("query.sampled")
+
+        query, columns, scaled = self.compile(spec, source, table, start, end)
+        rows = await self._execute(query)
+
+        results = []
+        factor = 100.0 / sample_percent if sample_percent else 1.0
+        for row in rows:
+            result = dict(row._mapping)
+            if BUCKET in result:
+                result[BUCKET] = parse_db_datetime(result[BUCKET])
+            for alias in scaled:
+                if result[alias] is not None and factor != 1.0:
+                    scaled_value = result[alias] * factor
+                    result[alias] = round(scaled_value) if isinstance(result[alias], int) else scaled_value
+            results.append(result)
+        elapsed = (time.perf_counter() - started) * 1000
+        metrics.observe("query.ms", elapsed)
+        return AnalyticsQueryResponse(
+            source=spec.source, columns=columns, rows=results, estimated_rows=estimated,
+            sampled=sample_percent is not None, sample_percent=sample_percent, elapsed_ms=round(elapsed, 2),
+        )
+
+    # Validation / compilation
+    def _source(self, spec: AnalyticsQuery) -> QuerySource:
+        if spec.source not in QUERY_SOURCES:
+            raise InvalidQuery(f"source must be one of: {', '.join(QUERY_SOURCES)}")
+        return QUERY_SOURCES[spec.source]
+
+    def _where(self, table, source: QuerySource, spec: AnalyticsQuery, start: datetime, end: datetime) -> List[Any]:
+        clauses = [table.c.timestamp >= start, table.c.timestamp <= end]
+        for condition in spec.filters:
+            if condition.field not in source.dimensions + source.measures:
+                raise InvalidQuery(
+                    f"'{spec.source}' can be filtered by: {', '.join(source.dimensions + source.measures)}"
+                )
+            if condition.op not in FILTER_OPS:
+                raise InvalidQuery(f"Filter op must be one of: {', '.join(FILTER_OPS)}")
+            if condition.op == "in" and (
+                not isinstance(condition.value, list) or not 0 < len(condition.value) <= MAX_IN_VALUES
+            ):
+                raise InvalidQuery(f"'in' takes a list of 1 to {MAX_IN_VALUES} values")
+            column = table.c[condition.field]
+            if condition.op == "in":
+                value = [coerce_filter_value(column, item) for item in condition.value]
+            else:
+                value = coerce_filter_value(column, condition.value)
+            clauses.append(FILTER_OPS[condition.op](column, value))
+        return clauses
+
+    def compile(self, spec: AnalyticsQuery, source: QuerySource, table, start: datetime, end: datetime):
+        """SELECT for the spec over `table` (the table itself or a TABLESAMPLE of it).
+
+        Returns (query, result columns, aliases of counts/sums to scale when sampled).
+        """
+        columns = table.c
+        dimensions = []
+        for name in spec.group_by:
+            if name == BUCKET:
+                if spec.bucket not in GRANULARITIES:
+                    raise InvalidQuery(f"Grouping by bucket needs bucket: {', '.join(GRANULARITIES)}")
+                dimensions.append(time_bucket(columns.timestamp, spec.bucket, self.dialect).label(BUCKET))
+            elif name in source.dimensions:
+                dimensions.append(columns[name].label(name))
+            else:
+                raise InvalidQuery(f"'{spec.source}' can be grouped by: {', '.join((*source.dimensions, BUCKET))}")
+        if len(set(spec.group_by)) != len(spec.group_by):
+            raise InvalidQuery("group_by has duplicate dimensions")
+
+        if not spec.aggregates:
+            raise InvalidQuery("At least one aggregate is required")
+        aggregates, scaled = [], []
+        for aggregate in spec.aggregates:
+            alias = aggregate.alias or (f"{aggregate.fn}_{aggregate.field}" if aggregate.field else aggregate.fn)
+            if aggregate.fn not in AGGREGATES and aggregate.fn not in PERCENTILES:
+                raise InvalidQuery(f"Aggregate fn must be one of: {', '.join((*AGGREGATES, *PERCENTILES))}")
+            if aggregate.fn == "count" and aggregate.field is None:
+                expression = func.count()
+            elif aggregate.field not in source.measures and not (aggregate.fn == "count" and aggregate.field in source.dimensions):
+                measures = ", ".join(source.measures) or "none; only count is available"
+                raise InvalidQuery(f"'{aggregate.fn}' needs a numeric field of '{spec.source}': {measures}")
+            elif aggregate.fn in AGGREGATES:
+                expression = getattr(func, aggregate.fn)(columns[aggregate.field])
+            else:
+                if self.dialect != "postgresql":
+                    raise InvalidQuery("Percentiles need PostgreSQL (percentile_cont); use /analytics/summary latency percentiles on SQLite")
+                expression = func.percentile_cont(PERCENTILES[aggregate.fn]).within_group(columns[aggregate.field])
+            if aggregate.fn in ("count", "sum"):
+                scaled.append(alias)
+            aggregates.append(expression.label(alias))
+
+        names = [d.name for d in dimensions] + [a.name for a in aggregates]
+        if len(set(names)) != len(names):
+            raise InvalidQuery("Result columns must have unique names; set alias on repeated aggregates")
+        order_name = spec.order_by or aggregates[0].name
+        if order_name not in names:
+            raise InvalidQuery(f"order_by must be one of: {', '.join(names)}")
+        order = next(c for c in dimensions + aggregates if c.name == order_name)
+
+        query = (
+            select(*dimensions, *aggregates)
+            .select_from(table)
+            .where(*self._where(table, source, spec, start, end))
+            .group_by(*[d.element for d in dimensions])
+            .order_by(order.desc() if spec.descending else order.asc())
+            .limit(spec.limit)
+        )
+        return query, names, scaled
+
+    # Guards
+    async def estimate_rows(self, table, where: List[Any]) -> int:
+        """Rows the filters match: the planner's estimate on PostgreSQL, a count capped just over the budget elsewhere"""
+        probe = select(literal_column("1")).select_from(table).where(*where)
+        if self.dialect == "postgresql":
+            plan = await self.db.scalar(ExplainJson(probe))
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+        capped = probe.limit(settings.ANALYTICS_QUERY_MAX_SCAN_ROWS + 1).subquery()
+        return int(await self.db.scalar(select(func.count()).select_from(capped)))
+
+    async def _execute(self, query) -> List[Any]:
+        timeout_ms = settings.ANALYTICS_QUERY_TIMEOUT_MS
+        if self.dialect == "postgresql":
+            await self.db.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+            try:
+                return (await self.db.execute(query)).all()
+            except DBAPIError as e:
+                if getattr(e.orig, "sqlstate", None) == "57014" or getattr(e.orig, "pgcode", None) == "57014":
+                    metrics.inc("query.timeouts")
+                    raise QueryTimeout(f"Query exceeded {timeout_ms} ms")
+                raise
+            finally:
+                # Ends the read transaction and with it the SET LOCAL
+                await self.db.rollback()
+
+        # SQLite has no statement timeout; interrupt the connection instead
+        connection = await self.db.connection()
+        driver = (await connection.get_raw_connection()).driver_connection
+        task = asyncio.ensure_future(self.db.execute(query))
+        done, _ = await asyncio.wait({task}, timeout=timeout_ms / 1000)
+        if task in done:
+            return task.result().all()
+        await driver.interrupt()
+        try:
+            await task
+        except OperationalError:
+            pass
+        await self.db.rollback()
+        metrics.inc("query.timeouts")
+        raise QueryTimeout(f"Query exceeded {timeout_ms} ms")
@@ -0,0 +1,154 @@
+"""
+Retention engine: enforces ANALYTICS_RETENTION_DAYS on the time-series tables.
+
+Partitions that end before the cutoff are dropped whole (PostgreSQL). Everything
+else is deleted in bounded chunks, each in its own short transaction with a
+pause in between, so no run holds long locks or writes a burst of WAL.
+Hour/day rollups and hour latency sketches are kept: they are small and keep
+long-range summaries working after the raw rows are gone.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.metrics import metrics
+from ..core.tasks import PeriodicTask
+from ..db.database import AsyncSessionLocal
+from ..db.partitions import PARTITIONED_TABLES, list_partitions
+from ..models.analytics import (
+    UsageEvent, PerformanceMetric, ErrorLog, ErrorGroup, ErrorGroupHour, Session, CostTracking, AuthFailure, UsageRollup
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TableReport:
+    rows: int = 0
+    partitions: int = 0
+    elapsed_ms: float = 0.0
+
+
+@dataclass
+class RetentionReport:
+    cutoff: datetime
+    tables: Dict[str, TableReport] = field(default_factory=dict)
+
+    @property
+    def rows(self) -> int:
+        return sum(t.rows for t in self.tables.values())
+
+    @property
+    def elapsed_ms(self) -> float:
+        return sum(t.elapsed_ms for t in self.tables.values())
+
+
+def _targets(cutoff: datetime) -> List[tuple]:
+    """(table, id column, timestamp column, extra conditions) for every table under retention"""
+    return [
+        ("usage_events", UsageEvent.id, UsageEvent.timestamp, []),
+        ("performance_metrics", PerformanceMetric.id, PerformanceMetric.timestamp, []),
+        ("error_logs", ErrorLog.id, ErrorLog.timestamp, []),
+        # Groups go once their latest occurrence is past the cutoff
+        ("error_groups", ErrorGroup.id, ErrorGroup.last_seen, []),
+        ("error_group_hours", ErrorGroupHour.id, ErrorGroupHour.bucket_start, []),
+        ("cost_tracking", CostTracking.id, CostTracking.timestamp, []),
+        ("auth_failures", AuthFailure.id, AuthFailure.timestamp, []),
+        # Sessions go once their last activity is past the cutoff, not just their start
+        ("sessions", Session.id, Session.created_at,
+         [func.coalesce(Session.ended_at, Session.updated_at, Session.created_at) < cutoff]),
+        ("usage_rollups", UsageRollup.id, UsageRollup.bucket_start, [UsageRollup.granularity == "minute"]),
+    ]
+
+
+async def drop_partitions_before(db: AsyncSession, table: str, cutoff: datetime) -> Tuple[int, int]:
+    """Drop partitions of `table` that end at or before `cutoff`; returns (partitions, estimated rows). PostgreSQL only.
+
+    Rows are the planner's pg_class.reltuples estimate; counting them would scan
+    every partition the drop is meant to discard cheaply.
+    """
+    if db.bind.dialect.name != "postgresql" or table not in PARTITIONED_TABLES:
+        return 0, 0
+    conn = await db.connection()
+    expired = [
+        p for p in await conn.run_sync(list_partitions, table)
+        if p.end is not None and p.end <= cutoff
+    ]
+    await db.commit()
+    rows = 0
+    for partition in expired:
+        rows += int(await db.scalar(
+            text("SELECT greatest(reltuples, 0) FROM pg_class WHERE oid = to_regclass(:name)"),
+            {"name": f'"{partition.name}"'},
+        ) or 0)
+        # A catalog change: no per-row deletes, no per-row WAL
+        await db.execute(text(f'DROP TABLE "{partition.name}"'))
+        await db.commit()
+    return len(expired), rows
+
+
+async def delete_in_chunks(
+    db: AsyncSession,
+    id_col,
+    ts_col,
+    cutoff: datetime,
+    conditions: Sequence = (),
+    chunk_size: Optional[int] = None
+) -> int:
+    """Delete rows with ts_col < cutoff oldest first, one chunk per transaction with a pause in between"""
+    chunk_size = chunk_size or settings.ANALYTICS_RETENTION_CHUNK_SIZE
+    chunk = select(id_col).where(ts_col < cutoff, *conditions).order_by(ts_col).limit(chunk_size)
+    removed = 0
+    while True:
+        result = await db.execute(
+            # The repeated timestamp bound lets PostgreSQL prune partitions for the outer delete
+            delete(id_col.class_).where(ts_col < cutoff, id_col.in_(chunk.scalar_subquery())),
+            execution_options={"synchronize_session": False}
+        )
+        await db.commit()
+        deleted = max(result.rowcount or 0, 0)
+        removed += deleted
+        if deleted < chunk_size:
+            return removed
+        await asyncio.sleep(settings.ANALYTICS_RETENTION_CHUNK_PAUSE_MS / 1000)
+
+
+class RetentionService:
+    """Removes rows older than the retention window, table by table"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.chunk_size = settings.ANALYTICS_RETENTION_CHUNK_SIZE
+
+    async def run(self, days: Optional[int] = None, now: Optional[datetime] = None) -> RetentionReport:
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(days=days if days is not None else settings.ANALYTICS_RETENTION_DAYS)
+        report = RetentionReport(cutoff=cutoff)
+        for table, id_col, ts_col, conditions in _targets(cutoff):
+            start = time.perf_counter()
+            result = report.tables[table] = TableReport()
+            result.partitions, result.rows = await drop_partitions_before(self.db, table, cutoff)
+            result.rows += await delete_in_chunks(self.db, id_col, ts_col, cutoff, conditions, self.chunk_size)
+            result.elapsed_ms = (time.perf_counter() - start) * 1000
+            metrics.inc(f"retention.{table}.rows", result.rows)
+            metrics.observe(f"retention.{table}.ms", result.elapsed_ms)
+            if result.rows:
+                logger.info(
+                    f"Retention removed {result.rows} rows from {table} "
+                    f"({result.partitions} partitions) in {result.elapsed_ms:.0f} ms"
+                )
+        return report
+
+
+async def run_retention() -> RetentionReport:
+    async with AsyncSessionLocal() as db:
+        return await RetentionService(db).run()
+
+
+# Lifespan-managed job; only started when ANALYTICS_RETENTION_ENABLED is set
+retention_task = PeriodicTask("retention", settings.ANALYTICS_RETENTION_INTERVAL_SECONDS, run_retention)
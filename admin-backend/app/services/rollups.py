@@ -0,0 +1,233 @@
+"""
+Usage event rollups.
+
+An incremental job folds raw usage_events into minute buckets, minute buckets
+into hours and hours into days. Each level keeps a watermark: everything before
+it is already aggregated. Range queries are split so completed buckets are read
+from the coarsest covering rollup and only the remainder (the unfinished
+current bucket and unaligned edges) is read from raw rows.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, insert, func, case, or_, literal, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.tasks import PeriodicTask
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import time_bucket, floor_time, ceil_time, parse_db_datetime
+from ..models.analytics import UsageEvent, UsageRollup, RollupWatermark
+
+# Rollup levels, finest first; each level is built from the previous one
+LEVELS = ("minute", "hour", "day")
+
+ROLLUP_COLUMNS = [
+    "granularity", "bucket_start", "tool_name", "event_type", "success",
+    "event_count", "error_count", "latency_count", "latency_sum", "latency_min", "latency_max",
+]
+
+Segment = Tuple[Optional[str], datetime, datetime]
+
+
+def plan_ranges(start: datetime, end: datetime, watermarks: Dict[str, datetime]) -> List[Segment]:
+    """Split [start, end) into (granularity, lo, hi) segments; granularity None means raw rows"""
+    levels = [(level, watermarks[level]) for level in reversed(LEVELS) if level in watermarks]
+
+    def split(lo: datetime, hi: datetime, candidates) -> List[Segment]:
+        if lo >= hi:
+            return []
+        for i, (level, watermark) in enumerate(candidates):
+            inner_lo = ceil_time(lo, level)
+            inner_hi = min(floor_time(hi, level), watermark)
+            if inner_lo < inner_hi:
+                finer = candidates[i + 1:]
+                return split(lo, inner_lo, finer) + [(level, inner_lo, inner_hi)] + split(inner_hi, hi, finer)
+        return [(None, lo, hi)]
+
+    return split(start, end, levels)
+
+
+def parse_watermarks(rows) -> Dict[str, datetime]:
+    """Map (name, watermark) rows from rollup_watermarks to {level: watermark}"""
+    return {
+        name.removeprefix("usage_"): parse_db_datetime(watermark)
+        for name, watermark in rows
+        if name.startswith("usage_")
+    }
+
+
+class RollupService:
+    """Maintains and queries usage_rollups"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.dialect = db.bind.dialect.name
+
+    async def get_watermarks(self) -> Dict[str, datetime]:
+        return parse_watermarks(await self.db.execute(select(RollupWatermark.name, RollupWatermark.watermark)))
+
+    # Incremental job
+    async def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Fold newly completed buckets into every level; returns rollup rows written per level"""
+        now = now or datetime.utcnow()
+        watermarks = await self.get_watermarks()
+        written = {}
+        for level in LEVELS:
+            written[level] = await self._roll_level(level, now, watermarks)
+        return written
+
+    async def _roll_level(self, level: str, now: datetime, watermarks: Dict[str, datetime]) -> int:
+        if level == "minute":
+            # Leave a grace period for in-flight transactions stamped just before the boundary
+            target = floor_time(now - timedelta(seconds=settings.ANALYTICS_ROLLUP_GRACE_SECONDS), level)
+            first_source = select(func.min(UsageEvent.timestamp))
+            max_span = timedelta(hours=settings.ANALYTICS_ROLLUP_MAX_SPAN_HOURS)
+        else:
+            finer = LEVELS[LEVELS.index(level) - 1]
+            if finer not in watermarks:
+                return 0
+            target = floor_time(watermarks[finer], level)
+            first_source = select(func.min(UsageRollup.bucket_start)).where(UsageRollup.granularity == finer)
+            # Coarser levels read the (small) finer rollups, so they catch up in one statement
+            max_span = None
+
+        current = watermarks.get(level)
+        if current is None:
+            first = parse_db_datetime(await self.db.scalar(first_source))
+            if first is None:
+                return 0
+            current = floor_time(first, level)
+
+        written = 0
+        while current < target:
+            upper = target if max_span is None else min(target, current + max_span)
+            result = await self.db.execute(
+                insert(UsageRollup).from_select(ROLLUP_COLUMNS, self._source_select(level, current, upper))
+            )
+            written += max(result.rowcount or 0, 0)
+            # Rollup rows and the watermark move together, so a crash never double-counts a bucket
+            await self.db.merge(RollupWatermark(name=f"usage_{level}", watermark=upper))
+            await self.db.commit()
+            current = upper
+            watermarks[level] = current
+        return written
+
+    def _source_select(self, level: str, lo: datetime, hi: datetime):
+        if level == "minute":
+            bucket = time_bucket(UsageEvent.timestamp, level, self.dialect)
+            tool = func.coalesce(UsageEvent.tool_name, "")
+            success = func.coalesce(UsageEvent.success, True)
+            is_error = or_(UsageEvent.success == False, UsageEvent.error_message.isnot(None))
+            return select(
+                literal(level), bucket, tool, UsageEvent.event_type, success,
+                func.count(UsageEvent.id),
+                func.sum(case((is_error, 1), else_=0)),
+                func.count(UsageEvent.response_time_ms),
+                func.coalesce(func.sum(UsageEvent.response_time_ms), 0),
+                func.min(UsageEvent.response_time_ms),
+                func.max(UsageEvent.response_time_ms),
+            ).where(
+                UsageEvent.timestamp >= lo,
+                UsageEvent.timestamp < hi
+            ).group_by(bucket, tool, UsageEvent.event_type, success)
+
+        finer = LEVELS[LEVELS.index(level) - 1]
+        bucket = time_bucket(UsageRollup.bucket_start, level, self.dialect)
+        return select(
+            literal(level), bucket, UsageRollup.tool_name, UsageRollup.event_type, UsageRollup.success,
+            func.sum(UsageRollup.event_count),
+            func.sum(UsageRollup.error_count),
+            func.sum(UsageRollup.latency_count),
+            func.sum(UsageRollup.latency_sum),
+            func.min(UsageRollup.latency_min),
+            func.max(UsageRollup.latency_max),
+        ).where(
+            UsageRollup.granularity == finer,
+            UsageRollup.bucket_start >= lo,
+            UsageRollup.bucket_start < hi
+        ).group_by(bucket, UsageRollup.tool_name, UsageRollup.event_type, UsageRollup.success)
+
+    # Queries
+    async def usage_breakdown(self, start: datetime, end: datetime):
+        """Usage aggregates for [start, end] grouped by tool_name, event_type and success"""
+        return await self.usage_windows({"range": (start, end)})
+
+    async def usage_windows(
+        self,
+        windows: Dict[str, Tuple[datetime, datetime]],
+        watermarks: Optional[Dict[str, datetime]] = None
+    ):
+        """Usage aggregates for several named [start, end] windows in one statement.
+
+        Rows are grouped by window_name, tool_name, event_type and success.
+        """
+        if watermarks is None:
+            watermarks = await self.get_watermarks()
+        parts = [
+            self._segment_select(name, level, lo, hi)
+            for name, (start, end) in windows.items()
+            # Callers pass an inclusive end; segments are half-open
+            for level, lo, hi in plan_ranges(start, end + timedelta(microseconds=1), watermarks)
+        ]
+        if not parts:
+            return []
+        combined = (parts[0] if len(parts) == 1 else union_all(*parts)).subquery()
+        query = select(
+            combined.c.window_name,
+            combined.c.tool_name,
+            combined.c.event_type,
+            combined.c.success,
+            func.sum(combined.c.event_count).label("event_count"),
+            func.sum(combined.c.error_count).label("error_count"),
+            func.sum(combined.c.latency_count).label("latency_count"),
+            func.sum(combined.c.latency_sum).label("latency_sum"),
+            func.min(combined.c.latency_min).label("latency_min"),
+            func.max(combined.c.latency_max).label("latency_max"),
+        ).group_by(combined.c.window_name, combined.c.tool_name, combined.c.event_type, combined.c.success)
+        return (await self.db.execute(query)).all()
+
+    def _segment_select(self, window_name: str, level: Optional[str], lo: datetime, hi: datetime):
+        if level is None:
+            tool = func.coalesce(UsageEvent.tool_name, "")
+            success = func.coalesce(UsageEvent.success, True)
+            is_error = or_(UsageEvent.success == False, UsageEvent.error_message.isnot(None))
+            return select(
+                literal(window_name).label("window_name"),
+                tool.label("tool_name"),
+                UsageEvent.event_type.label("event_type"),
+                success.label("success"),
+                func.count(UsageEvent.id).label("event_count"),
+                func.sum(case((is_error, 1), else_=0)).label("error_count"),
+                func.count(UsageEvent.response_time_ms).label("latency_count"),
+                func.coalesce(func.sum(UsageEvent.response_time_ms), 0).label("latency_sum"),
+                func.min(UsageEvent.response_time_ms).label("latency_min"),
+                func.max(UsageEvent.response_time_ms).label("latency_max"),
+            ).where(
+                UsageEvent.timestamp >= lo,
+                UsageEvent.timestamp < hi
+            ).group_by(tool, UsageEvent.event_type, success)
+
+        return select(
+            literal(window_name).label("window_name"),
+            UsageRollup.tool_name.label("tool_name"),
+            UsageRollup.event_type.label("event_type"),
+            UsageRollup.success.label("success"),
+            func.sum(UsageRollup.event_count).label("event_count"),
+            func.sum(UsageRollup.error_count).label("error_count"),
+            func.sum(UsageRollup.latency_count).label("latency_count"),
+            func.sum(UsageRollup.latency_sum).label("latency_sum"),
+            func.min(UsageRollup.latency_min).label("latency_min"),
+            func.max(UsageRollup.latency_max).label("latency_max"),
+        ).where(
+            UsageRollup.granularity == level,
+            UsageRollup.bucket_start >= lo,
+            UsageRollup.bucket_start < hi
+        ).group_by(UsageRollup.tool_name, UsageRollup.event_type, UsageRollup.success)
+
+
+async def run_usage_rollups() -> Dict[str, int]:
+    async with AsyncSessionLocal() as db:
+        return await RollupService(db).run()
+
+
+# Lifespan-managed job; only started when ANALYTICS_ROLLUPS_ENABLED is set
+rollup_task = PeriodicTask("usage_rollups", settings.ANALYTICS_ROLLUP_INTERVAL_SECONDS, run_usage_rollups)
@@ -0,0 +1,171 @@
+"""
+Ranked full-text search over error messages and stack traces.
+
+Queries are whitespace-separated terms that must all match. A term is a word,
+a "quoted phrase" (words in order, adjacent) or either followed by * to match
+the last word as a prefix: `timeout "connection refused"` or `conn* psycopg2`.
+Each term is tokenized by the same parser that indexed the documents:
+
+- PostgreSQL: every term becomes a phraseto_tsquery (prefixes a to_tsquery
+  `:*` on the last word), so file names, paths and hosts such as `db.py` or
+  `/app/services/x.py` stay single lexemes as they are in ERROR_SEARCH_VECTOR.
+- SQLite: FTS5's unicode61 tokenizer splits on anything but letters and
+  digits, so there `user_id` is the phrase "user id".
+
+PostgreSQL matches the terms against the indexed ERROR_SEARCH_VECTOR, ranks
+with ts_rank_cd and highlights with ts_headline. SQLite matches the FTS5 table,
+ranks with bm25 and highlights with snippet(). Ranked results page on
+(rank, id) with the usual keyset cursor.
+
+`contains` is a plain case-insensitive substring filter on error_message (the
+trigram index serves it on PostgreSQL); without `q`, results are newest first.
+"""
+import re
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import func, literal, literal_column, select, table, column, Float, String
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.metrics import metrics
+from ..db.pagination import keyset_page
+from ..db.search import ERROR_SEARCH_VECTOR, ERROR_SEARCH_FTS
+from ..models.analytics import ErrorLog
+from .analytics import ERROR_COLUMNS
+
+MAX_TERMS = 16
+MARK_START, MARK_END = "<mark>", "</mark>"
+# Words around the matches in each highlighted snippet
+SNIPPET_WORDS = 16
+
+_TERM = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+_WORD = re.compile(r"[^\W_]+")
+
+_HEADLINE_OPTIONS = (
+    f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS * 2}, "
+    f"MinWords={SNIPPET_WORDS // 2}, MaxFragments=2, FragmentDelimiter=\" … \""
+)
+
+_fts = table(ERROR_SEARCH_FTS, column("rowid"))
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+class SearchTerm(NamedTuple):
+    text: str  # as typed, without quotes or the prefix *
+    words: Tuple[str, ...]  # letter/digit runs, lowercased
+    prefix: bool
+
+
+def parse_search(q: str) -> List[SearchTerm]:
+    """Split a search string into terms; raises InvalidSearch when nothing searchable is left"""
+    terms = []
+    for phrase, phrase_prefix, bare in _TERM.findall(q):
+        text = phrase if not bare else bare.rstrip("*")
+        words = tuple(word.lower() for word in _WORD.findall(text))
+        if words:
+            terms.append(SearchTerm(text.strip(), words, bool(phrase_prefix) or (bool(bare) and bare.endswith("*"))))
+    if not terms:
+        raise InvalidSearch("q has no words to search for")
+    if len(terms) > MAX_TERMS:
+        raise InvalidSearch(f"q can have at most {MAX_TERMS} terms")
+    return terms
+
+
+def _simple(fn: str, value: str):
+    return getattr(func, fn)(literal_column("'simple'"), value)
+
+
+def to_tsquery_expression(terms: List[SearchTerm]):
+    """tsquery matching every term, each parsed by PostgreSQL's own text parser"""
+    query = None
+    for term in terms:
+        if term.prefix:
+            *head, last = term.text.split()
+            # A quoted to_tsquery operand is parsed like document text; :* marks it as a prefix
+            quoted = "'" + last.replace("\\", "\\\\").replace("'", "''") + "':*"
+            part = _simple("to_tsquery", quoted)
+            if head:
+                part = func.tsquery_phrase(_simple("phraseto_tsquery", " ".join(head)), part)
+        else:
+            part = _simple("phraseto_tsquery", term.text)
+        query = part if query is None else query.op("&&")(part)
+    return query
+
+
+def to_fts5_match(terms: List[SearchTerm]) -> str:
+    """FTS5 MATCH syntax: every term a quoted phrase, * for prefixes, terms joined by AND"""
+    return " AND ".join(f'"{" ".join(term.words)}"' + ("*" if term.prefix else "") for term in terms)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_error_logs(
+    db: AsyncSession,
+    q: Optional[str] = None,
+    contains: Optional[str] = None,
+    error_type: Optional[str] = None,
+    resolved: Optional[bool] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Matching error logs (ErrorSearchResult-shaped dicts), best match first; returns (errors, next_cursor)"""
+    if not q and not contains:
+        raise InvalidSearch("Give q (full-text) and/or contains (substring)")
+    dialect = db.bind.dialect.name
+    filters = []
+    if error_type:
+        filters.append(ErrorLog.error_type == error_type)
+    if resolved is not None:
+        filters.append(ErrorLog.resolved == resolved)
+    if start_date:
+        filters.append(ErrorLog.timestamp >= start_date)
+    if end_date:
+        filters.append(ErrorLog.timestamp <= end_date)
+    if contains:
+        filters.append(ErrorLog.error_message.ilike(f"%{_escape_like(contains)}%", escape="\\"))
+
+    if not q:
+        query = select(
+            *ERROR_COLUMNS, literal(None, Float).label("rank"),
+            literal(None, String).label("message_snippet"), literal(None, String).label("stack_snippet"),
+        ).where(*filters)
+    elif dialect == "postgresql":
+        tsquery = to_tsquery_expression(parse_search(q))
+        vector = literal_column(ERROR_SEARCH_VECTOR)
+
+        def headline(document):
+            return func.ts_headline(literal_column("'simple'"), document, tsquery, _HEADLINE_OPTIONS)
+
+        query = select(
+            *ERROR_COLUMNS, func.ts_rank_cd(vector, tsquery).label("rank"),
+            headline(ErrorLog.error_message).label("message_snippet"),
+            headline(ErrorLog.stack_trace).label("stack_snippet"),
+        ).where(vector.op("@@")(tsquery), *filters)
+    elif dialect == "sqlite":
+        fts = literal_column(ERROR_SEARCH_FTS)
+
+        def snippet(column_index: int):
+            return func.snippet(fts, column_index, MARK_START, MARK_END, "…", SNIPPET_WORDS)
+
+        # bm25 is lower for better matches; negate it so rank sorts descending like ts_rank_cd
+        query = select(
+            *ERROR_COLUMNS, (-func.bm25(fts)).label("rank"),
+            snippet(0).label("message_snippet"), func.nullif(snippet(1), "").label("stack_snippet"),
+        ).select_from(_fts.join(ErrorLog, ErrorLog.id == _fts.c.rowid)).where(
+            fts.op("MATCH")(to_fts5_match(parse_search(q))), *filters
+        )
+    else:
+        raise InvalidSearch(f"Full-text search is not supported on {dialect}")
+
+    # Page over a subquery so the rank is computed once and is a plain column to the cursor
+    results = query.subquery("results")
+    page_key = results.c.rank if q else results.c.timestamp
+    metrics.inc("search.queries")
+    return await keyset_page(
+        db, select(results), page_key, results.c.id, limit, cursor=cursor, as_dicts=True
+    )
@@ -0,0 +1,112 @@
+"""
+Incremental per-session counters (total_requests / total_errors / total_processing_time_ms).
+
+Ingest stages deltas on the transaction that writes the events and a
+StagedDeltaBuffer (app.core.deltas) coalesces the committed ones per session_id;
+each flush applies a chunk of them as one
+`UPDATE sessions SET total = total + CASE session_id ... END ... RETURNING session_id`.
+
+Events often arrive before their session row (the ingest queue and spool don't
+order them), so deltas the UPDATE didn't match are kept for up to
+ANALYTICS_SESSION_COUNTER_MAX_RETRIES flushes before they are dropped. Deltas
+still buffered when a process dies are lost; `manage.py rebuild-session-counters`
+recomputes every session's totals from the rows still stored.
+"""
+from typing import Any, Dict, Iterable, List
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.deltas import StagedDeltaBuffer
+from ..core.metrics import metrics
+from ..db.database import AsyncSessionLocal
+from ..models.analytics import Session as SessionModel, UsageEvent, ErrorLog
+
+# Sessions per UPDATE; each one costs seven bind parameters
+UPDATE_CHUNK = 500
+
+
+def _merge(existing: List[int], new: List[int]) -> List[int]:
+    # [requests, errors, processing_ms, flushes without a matching session]; new activity restarts the retries
+    return [existing[0] + new[0], existing[1] + new[1], existing[2] + new[2], min(existing[3], new[3])]
+
+
+def stage_events(db: AsyncSession, events: Iterable[Dict[str, Any]]) -> None:
+    """Count usage events (requests and processing time) once `db` commits"""
+    for e in events:
+        if e.get("session_id"):
+            session_counters.stage(db, e["session_id"], [1, 0, int(e.get("response_time_ms") or 0), 0])
+
+
+def stage_errors(db: AsyncSession, errors: Iterable[Dict[str, Any]]) -> None:
+    """Count error logs once `db` commits"""
+    for e in errors:
+        if e.get("session_id"):
+            session_counters.stage(db, e["session_id"], [0, 1, 0, 0])
+
+
+def _update_statement(chunk: Dict[str, List[int]]):
+    table = SessionModel.__table__
+
+    def plus(column, index: int):
+        delta = case({session_id: d[index] for session_id, d in chunk.items()}, value=table.c.session_id, else_=0)
+        return func.coalesce(column, 0) + delta
+
+    return (
+        update(table)
+        .where(table.c.session_id.in_(list(chunk)))
+        .values(
+            total_requests=plus(table.c.total_requests, 0),
+            total_errors=plus(table.c.total_errors, 1),
+            total_processing_time_ms=plus(table.c.total_processing_time_ms, 2),
+        )
+        .returning(table.c.session_id)
+    )
+
+
+async def _write(db: AsyncSession, pending: Dict[str, List[int]]) -> Dict[str, List[int]]:
+    """Apply pending deltas; returns the ones whose session doesn't exist yet, to retry"""
+    keys = sorted(pending)  # stable order avoids row-lock deadlocks
+    unmatched = {}
+    for start in range(0, len(keys), UPDATE_CHUNK):
+        chunk = {session_id: pending[session_id] for session_id in keys[start:start + UPDATE_CHUNK]}
+        matched = set((await db.execute(_update_statement(chunk))).scalars())
+        unmatched.update({session_id: d for session_id, d in chunk.items() if session_id not in matched})
+    retry = {}
+    for session_id, (requests, errors, processing_ms, misses) in unmatched.items():
+        if misses < settings.ANALYTICS_SESSION_COUNTER_MAX_RETRIES:
+            retry[session_id] = [requests, errors, processing_ms, misses + 1]
+        else:
+            metrics.inc("session_counters.dropped")
+    return retry
+
+
+async def rebuild_session_counters(db: AsyncSession) -> int:
+    """Recompute every session's totals from the usage_events and error_logs rows still stored.
+
+    Buffered deltas are flushed first; events committed while it runs but not yet
+    flushed by a server are counted twice, so run it on a quiet system.
+    """
+    await session_counters.flush()
+
+    def per_session(model, aggregate):
+        return select(aggregate).where(model.session_id == SessionModel.session_id).scalar_subquery()
+
+    result = await db.execute(
+        update(SessionModel)
+        .values(
+            # Keep updated_at: retention reads it as the session's last activity
+            updated_at=SessionModel.updated_at,
+            total_requests=per_session(UsageEvent, func.count()),
+            total_processing_time_ms=per_session(UsageEvent, func.coalesce(func.sum(UsageEvent.response_time_ms), 0)),
+            total_errors=per_session(ErrorLog, func.count()),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+
+# Global buffer; started from the lifespan, flushed once more on shutdown
+session_counters = StagedDeltaBuffer(
+    "session_counters", settings.ANALYTICS_SESSION_COUNTER_FLUSH_MS, _merge, _write, AsyncSessionLocal
+)
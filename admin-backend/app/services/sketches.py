@@ -0,0 +1,265 @@
+"""
+Per-tool latency percentiles backed by mergeable DDSketches.
+
+Ingest appends one sketch per (minute, tool) for each batch, in the same
+transaction as the events. Compaction merges rows that share a bucket, folds
+completed hours into hour sketches and drops minute sketches once they are past
+their retention and covered by an hour. Queries merge hour sketches for whole
+hours and minute sketches at the edges, so percentiles never read raw rows;
+range edges resolve to the minute (to the hour beyond the minute retention).
+
+Because ingest appends there is no unique key to upsert on. Instead every
+compaction transaction takes COMPACTION_LOCK first, so workers compacting at
+the same time never merge or fold the same rows twice.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select, insert, update, delete, func, and_, or_, false
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.sketch import DDSketch
+from ..core.tasks import PeriodicTask
+from ..db.database import AsyncSessionLocal
+from ..db.dialect import floor_time, ceil_time, as_naive_utc, parse_db_datetime
+from ..models.analytics import UsageEvent, LatencySketch, RollupWatermark
+from .rollups import plan_ranges
+
+QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+# rollup_watermarks row marking the (exclusive) end of hours already folded into hour sketches
+HOUR_WATERMARK = "sketch_hour"
+
+# Serializes compaction across workers for the rest of each transaction
+COMPACTION_LOCK = "latency_sketch_compaction"
+
+# Upper bound on rows deleted per statement (keeps IN lists well under driver parameter limits)
+DELETE_CHUNK = 500
+
+
+def new_sketch() -> DDSketch:
+    return DDSketch(settings.ANALYTICS_SKETCH_RELATIVE_ACCURACY)
+
+
+def percentiles(sketch: Optional[DDSketch]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99 of a sketch, rounded like the other latency fields"""
+    result = {}
+    for name, q in QUANTILES.items():
+        value = sketch.quantile(q) if sketch is not None else None
+        result[name] = round(value, 2) if value is not None else None
+    return result
+
+
+def merge_all(sketches: Iterable[DDSketch]) -> DDSketch:
+    merged = new_sketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+
+class LatencySketchService:
+    """Writes, compacts and queries latency_sketches"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def record(self, events: Iterable[Tuple[datetime, Optional[str], Optional[int]]]) -> None:
+        """Append minute sketches for (timestamp, tool_name, response_time_ms) tuples; the caller commits"""
+        buckets: Dict[Tuple[datetime, str], DDSketch] = {}
+        for timestamp, tool_name, response_time_ms in events:
+            if response_time_ms is None:
+                continue
+            key = (floor_time(as_naive_utc(timestamp), "minute"), tool_name or "")
+            buckets.setdefault(key, new_sketch()).add(response_time_ms)
+        if buckets:
+            await self.db.execute(insert(LatencySketch), [
+                {"granularity": "minute", "bucket_start": bucket, "tool_name": tool,
+                 "count": sketch.count, "sketch": sketch.to_dict()}
+                for (bucket, tool), sketch in buckets.items()
+            ])
+
+    # Queries
+    async def sketches_by_tool(
+        self,
+        start: datetime,
+        end: datetime,
+        now: Optional[datetime] = None,
+        watermark_rows: Optional[Iterable[Tuple[str, datetime]]] = None
+    ) -> Dict[str, DDSketch]:
+        """Merged latency sketch per tool for [start, end] in one query.
+
+        `watermark_rows` are (name, watermark) rows already read from rollup_watermarks;
+        without them the hour watermark is looked up first.
+        """
+        now = now or datetime.utcnow()
+        minute_cutoff = now - timedelta(hours=settings.ANALYTICS_SKETCH_MINUTE_RETENTION_HOURS)
+        end = end + timedelta(microseconds=1)
+        lo = floor_time(start, "minute" if start >= minute_cutoff else "hour")
+        hi = ceil_time(end, "minute" if end >= minute_cutoff else "hour")
+
+        if watermark_rows is None:
+            watermark = await self._hour_watermark()
+        else:
+            watermark = next((parse_db_datetime(w) for name, w in watermark_rows if name == HOUR_WATERMARK), None)
+        conditions = []
+        for level, seg_lo, seg_hi in plan_ranges(lo, hi, {"hour": watermark} if watermark else {}):
+            conditions.append(and_(
+                LatencySketch.granularity == (level or "minute"),
+                LatencySketch.bucket_start >= seg_lo,
+                LatencySketch.bucket_start < seg_hi
+            ))
+        if not conditions:
+            return {}
+
+        by_tool: Dict[str, DDSketch] = {}
+        for tool_name, data in await self.db.execute(
+            select(LatencySketch.tool_name, LatencySketch.sketch).where(or_(*conditions))
+        ):
+            by_tool.setdefault(tool_name, new_sketch()).merge(DDSketch.from_dict(data))
+        return by_tool
+
+    # Compaction
+    async def compact(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Merge duplicate buckets, build completed hours and prune old minutes"""
+        now = now or datetime.utcnow()
+        merged = await self._merge_duplicates(floor_time(now, "minute"))
+        hours = await self._build_hours(now)
+        pruned = await self._prune_minutes(now)
+        return {"merged": merged, "hours": hours, "pruned": pruned}
+
+    async def _merge_duplicates(self, before: datetime) -> int:
+        """Collapse appended rows that share (granularity, bucket, tool) into one row"""
+        await self._lock()
+        key = (LatencySketch.granularity, LatencySketch.bucket_start, LatencySketch.tool_name)
+        duplicates = select(*key).where(
+            LatencySketch.bucket_start < before
+        ).group_by(*key).having(func.count(LatencySketch.id) > 1).subquery()
+        rows = (await self.db.execute(
+            select(LatencySketch.id, *key, LatencySketch.sketch).join(duplicates, and_(
+                LatencySketch.granularity == duplicates.c.granularity,
+                LatencySketch.bucket_start == duplicates.c.bucket_start,
+                LatencySketch.tool_name == duplicates.c.tool_name
+            ))
+        )).all()
+        if not rows:
+            await self.db.commit()
+            return 0
+
+        groups: Dict[tuple, DDSketch] = {}
+        for row in rows:
+            group = (row.granularity, parse_db_datetime(row.bucket_start), row.tool_name)
+            groups.setdefault(group, new_sketch()).merge(DDSketch.from_dict(row.sketch))
+        await self._delete_ids([row.id for row in rows])
+        await self._insert(groups)
+        await self.db.commit()
+        return len(rows) - len(groups)
+
+    async def _build_hours(self, now: datetime) -> int:
+        target = floor_time(now - timedelta(seconds=settings.ANALYTICS_ROLLUP_GRACE_SECONDS), "hour")
+        built = 0
+        # One day per transaction bounds memory while catching up; the watermark is
+        # re-read under the lock, since another worker may have moved it
+        while True:
+            await self._lock()
+            current = await self._hour_watermark()
+            if current is None:
+                first = parse_db_datetime(await self.db.scalar(
+                    select(func.min(LatencySketch.bucket_start)).where(LatencySketch.granularity == "minute")
+                ))
+                current = floor_time(first, "hour") if first is not None else target
+            if current >= target:
+                await self.db.commit()
+                return built
+            upper = min(target, current + timedelta(days=1))
+            groups: Dict[tuple, DDSketch] = {}
+            for bucket_start, tool_name, data in await self.db.execute(
+                select(LatencySketch.bucket_start, LatencySketch.tool_name, LatencySketch.sketch).where(
+                    LatencySketch.granularity == "minute",
+                    LatencySketch.bucket_start >= current,
+                    LatencySketch.bucket_start < upper
+                )
+            ):
+                hour = floor_time(parse_db_datetime(bucket_start), "hour")
+                groups.setdefault(("hour", hour, tool_name), new_sketch()).merge(DDSketch.from_dict(data))
+            await self._insert(groups)
+            await self.db.merge(RollupWatermark(name=HOUR_WATERMARK, watermark=upper))
+            await self.db.commit()
+            built += len(groups)
+
+    async def _prune_minutes(self, now: datetime) -> int:
+        watermark = await self._hour_watermark()
+        if watermark is None:
+            return 0
+        cutoff = min(watermark, floor_time(now - timedelta(hours=settings.ANALYTICS_SKETCH_MINUTE_RETENTION_HOURS), "hour"))
+        result = await self.db.execute(
+            delete(LatencySketch).where(
+                LatencySketch.granularity == "minute",
+                LatencySketch.bucket_start < cutoff
+            )
+        )
+        await self.db.commit()
+        return max(result.rowcount or 0, 0)
+
+    async def rebuild(self, start: datetime, now: Optional[datetime] = None, chunk_size: int = 5000) -> int:
+        """Recompute sketches from raw usage_events since `start` (e.g. for events ingested before sketches existed)"""
+        now = now or datetime.utcnow()
+        start = floor_time(start, "hour")
+        await self._lock()
+        await self.db.execute(delete(LatencySketch).where(LatencySketch.bucket_start >= start))
+        watermark = await self._hour_watermark()
+        if watermark is not None and watermark > start:
+            await self.db.merge(RollupWatermark(name=HOUR_WATERMARK, watermark=start))
+
+        recorded = 0
+        last_id = 0
+        while True:
+            rows = (await self.db.execute(
+                select(UsageEvent.id, UsageEvent.timestamp, UsageEvent.tool_name, UsageEvent.response_time_ms)
+                .where(UsageEvent.timestamp >= start, UsageEvent.id > last_id)
+                .order_by(UsageEvent.id)
+                .limit(chunk_size)
+            )).all()
+            if not rows:
+                break
+            await self.record((r.timestamp, r.tool_name, r.response_time_ms) for r in rows)
+            recorded += len(rows)
+            last_id = rows[-1].id
+        await self.db.commit()
+        await self.compact(now)
+        return recorded
+
+    async def _lock(self) -> None:
+        """Hold COMPACTION_LOCK until the current transaction ends; call it before reading anything"""
+        if self.db.bind.dialect.name == "postgresql":
+            await self.db.execute(select(func.pg_advisory_xact_lock(func.hashtext(COMPACTION_LOCK))))
+        else:
+            # SQLite has one writer at a time: an empty UPDATE takes the database write lock
+            await self.db.execute(
+                update(RollupWatermark).where(false()).values(name=RollupWatermark.name)
+                .execution_options(synchronize_session=False)
+            )
+
+    async def _hour_watermark(self) -> Optional[datetime]:
+        return parse_db_datetime(await self.db.scalar(
+            select(RollupWatermark.watermark).where(RollupWatermark.name == HOUR_WATERMARK)
+        ))
+
+    async def _delete_ids(self, ids: List[int]) -> None:
+        for i in range(0, len(ids), DELETE_CHUNK):
+            await self.db.execute(delete(LatencySketch).where(LatencySketch.id.in_(ids[i:i + DELETE_CHUNK])))
+
+    async def _insert(self, groups: Dict[tuple, DDSketch]) -> None:
+        if groups:
+            await self.db.execute(insert(LatencySketch), [
+                {"granularity": granularity, "bucket_start": bucket, "tool_name": tool,
+                 "count": sketch.count, "sketch": sketch.to_dict()}
+                for (granularity, bucket, tool), sketch in groups.items()
+            ])
+
+
+async def run_sketch_compaction() -> Dict[str, int]:
+    async with AsyncSessionLocal() as db:
+        return await LatencySketchService(db).compact()
+
+
+# Lifespan-managed job; started alongside the usage rollups
+sketch_task = PeriodicTask("latency_sketches", settings.ANALYTICS_ROLLUP_INTERVAL_SECONDS, run_sketch_compaction)
@@ -0,0 +1,208 @@
+"""
+Bucketed time series for charts.
+
+Aggregation happens in SQL (date_trunc / strftime buckets), so the payload is one
+row per bucket and series however many raw rows fall in the range. Performance
+metrics older than the raw tier are read from the downsampled minute/hour tiers.
+Series longer than the point budget are thinned with LTTB.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func, null
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.lttb import lttb
+from ..db.dialect import GRANULARITIES, time_bucket, floor_time, as_naive_utc, parse_db_datetime
+from ..models.analytics import UsageEvent, PerformanceMetric, ErrorLog, CostTracking
+from ..schemas.analytics import TimeSeries, TimeSeriesPoint, TimeSeriesResponse
+from .downsampling import MetricBucket, MetricDownsampler
+
+class InvalidTimeSeriesQuery(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Source:
+    model: type
+    timestamp: object
+    value: Optional[object]  # column aggregated by sum/avg/min/max; None means count only
+    name: object  # column the `name` filter applies to
+    dimensions: Dict[str, object] = field(default_factory=dict)
+    default_aggregate: str = "count"
+    snapshot: Optional[str] = None  # table mirrored in the analytical snapshot, if any
+
+
+SOURCES: Dict[str, Source] = {
+    "events": Source(
+        UsageEvent, UsageEvent.timestamp, UsageEvent.response_time_ms, UsageEvent.tool_name,
+        {"tool_name": UsageEvent.tool_name, "event_type": UsageEvent.event_type, "success": UsageEvent.success},
+        snapshot="usage_events",
+    ),
+    "metrics": Source(
+        PerformanceMetric, PerformanceMetric.timestamp, PerformanceMetric.metric_value, PerformanceMetric.metric_name,
+        {"metric_name": PerformanceMetric.metric_name}, "avg",
+    ),
+    "costs": Source(
+        CostTracking, CostTracking.timestamp, CostTracking.cost_usd, CostTracking.service_name,
+        {"service_name": CostTracking.service_name, "operation_type": CostTracking.operation_type}, "sum",
+        snapshot="cost_tracking",
+    ),
+    "errors": Source(
+        ErrorLog, ErrorLog.timestamp, None, ErrorLog.error_type,
+        {"error_type": ErrorLog.error_type},
+    ),
+}
+
+
+def pick_bucket(start: datetime, end: datetime, max_points: int) -> str:
+    """Finest bucket that keeps the range within max_points (day if none does)"""
+    span = end - start
+    for granularity, width in GRANULARITIES.items():
+        if span / width <= max_points:
+            return granularity
+    return "day"
+
+
+def downsample(points: List[TimeSeriesPoint], max_points: int) -> List[TimeSeriesPoint]:
+    if len(points) <= max_points:
+        return points
+    keep = lttb([(p.timestamp.timestamp(), p.value) for p in points], max_points)
+    return [points[i] for i in keep]
+
+
+def _bucket_value(bucket: MetricBucket, aggregate: str) -> float:
+    if aggregate == "avg":
+        return bucket.sum / bucket.count
+    return float(getattr(bucket, aggregate))
+
+
+class TimeSeriesService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def series(
+        self,
+        source: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        bucket: str = "auto",
+        aggregate: Optional[str] = None,
+        group_by: Optional[str] = None,
+        name: Optional[str] = None,
+        max_points: int = 500,
+        max_series: int = 10,
+        use_lttb: bool = True,
+        now: Optional[datetime] = None
+    ) -> TimeSeriesResponse:
+        spec = SOURCES[source]
+        aggregate = aggregate or spec.default_aggregate
+        if aggregate != "count" and spec.value is None:
+            raise InvalidTimeSeriesQuery(f"Source '{source}' only supports the count aggregate")
+        if group_by is not None and group_by not in spec.dimensions:
+            raise InvalidTimeSeriesQuery(
+                f"Source '{source}' can be grouped by: {', '.join(spec.dimensions)}"
+            )
+        now = now or datetime.utcnow()
+        end = as_naive_utc(end) or now
+        start = as_naive_utc(start) or end - timedelta(hours=24)
+        if start >= end:
+            raise InvalidTimeSeriesQuery("start must be before end")
+        if bucket == "auto":
+            bucket = pick_bucket(start, end, max_points)
+
+        # Metrics older than the raw tier only exist as minute/hour aggregates
+        from_tiers = source == "metrics" and floor_time(start, bucket) < now - timedelta(hours=settings.ANALYTICS_METRICS_RAW_HOURS)
+        if from_tiers and bucket == "minute" and "minute" not in MetricDownsampler.eligible_tiers(start, now):
+            bucket = "hour"
+        lo = floor_time(start, bucket)
+
+        if from_tiers:
+            rows = await self._metric_tier_rows(lo, end, bucket, aggregate, group_by, name)
+        else:
+            rows = await self._snapshot_rows(spec, lo, end, bucket, aggregate, group_by, name)
+            if rows is None:
+                rows = await self._sql_rows(spec, lo, end, bucket, aggregate, group_by, name)
+
+        by_series: Dict[Optional[str], List[TimeSeriesPoint]] = {}
+        for series_name, bucket_start, value in rows:
+            if value is not None:
+                by_series.setdefault(series_name, []).append(
+                    TimeSeriesPoint(timestamp=bucket_start, value=round(float(value), 4))
+                )
+        # High-cardinality dimensions: keep the series with the largest totals
+        ranked = sorted(by_series.items(), key=lambda item: sum(abs(p.value) for p in item[1]), reverse=True)
+
+        downsampled = False
+        series = []
+        for series_name, points in ranked[:max_series]:
+            points.sort(key=lambda p: p.timestamp)
+            if use_lttb and len(points) > max_points:
+                points = downsample(points, max_points)
+                downsampled = True
+            series.append(TimeSeries(name=None if series_name is None else str(series_name), points=points))
+        return TimeSeriesResponse(
+            source=source, aggregate=aggregate, bucket=bucket, start=lo, end=end,
+            downsampled=downsampled, series=series
+        )
+
+    async def _sql_rows(
+        self, spec: Source, lo: datetime, end: datetime, bucket: str,
+        aggregate: str, group_by: Optional[str], name: Optional[str]
+    ) -> List[Tuple]:
+        bucket_expr = time_bucket(spec.timestamp, bucket, self.db.bind.dialect.name)
+        if aggregate == "count":
+            value = func.count()
+        else:
+            value = getattr(func, aggregate)(spec.value)
+        dimension = spec.dimensions[group_by] if group_by else None
+        query = select(
+            (dimension if dimension is not None else null()).label("series"),
+            bucket_expr.label("bucket"),
+            value.label("value"),
+        ).where(spec.timestamp >= lo, spec.timestamp <= end)
+        if name:
+            query = query.where(spec.name == name)
+        query = query.group_by(*([dimension] if dimension is not None else []), bucket_expr)
+        return [
+            (row.series, parse_db_datetime(row.bucket), row.value)
+            for row in await self.db.execute(query)
+        ]
+
+    async def _snapshot_rows(
+        self, spec: Source, lo: datetime, end: datetime, bucket: str,
+        aggregate: str, group_by: Optional[str], name: Optional[str]
+    ) -> Optional[List[Tuple]]:
+        """Long ranges: whole buckets before the snapshot watermark from DuckDB, the rest from SQL"""
+        from .olap import olap_snapshot
+        if spec.snapshot is None:
+            return None
+        split = olap_snapshot.split_point(spec.snapshot, lo, end)
+        if split is None or floor_time(split, bucket) <= lo:
+            return None
+        split = floor_time(split, bucket)
+        rows = await olap_snapshot.series(
+            spec.snapshot, bucket, lo, split, aggregate,
+            value=spec.value.key if spec.value is not None else None,
+            group_by=group_by,
+            **({spec.name.key: name} if name else {})
+        )
+        if split <= end:
+            rows += await self._sql_rows(spec, split, end, bucket, aggregate, group_by, name)
+        return rows
+
+    async def _metric_tier_rows(
+        self, lo: datetime, end: datetime, bucket: str, aggregate: str,
+        group_by: Optional[str], name: Optional[str]
+    ) -> List[Tuple]:
+        downsampler = MetricDownsampler(self.db)
+        # Hour tier for hour/day buckets: far fewer rows than minutes
+        tier = "minute" if bucket == "minute" else "hour"
+        buckets = await downsampler.buckets(
+            tier, floor_time(lo, tier), end + timedelta(microseconds=1), name, await downsampler.get_watermarks()
+        )
+        grouped: Dict[Tuple[Optional[str], datetime], MetricBucket] = {}
+        for (bucket_start, metric_name), data in buckets.items():
+            key = (metric_name if group_by else None, floor_time(bucket_start, bucket))
+            grouped.setdefault(key, MetricBucket()).merge(data)
+        return [(series, bucket_start, _bucket_value(data, aggregate)) for (series, bucket_start), data in grouped.items()]
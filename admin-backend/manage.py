@@ -5,9 +5,9 @@ Management CLI for MCP Admin Backend
 import asyncio
 import click
 from sqlalchemy.orm import Session
-from app.db.database import SessionLocal, engine, Base
+from app.db.database import SessionLocal, engine, async_engine, create_schema
 from app.models.analytics import AdminUser
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash_async
 
 
 @click.group()
@@ -20,7 +20,8 @@ def cli():
 def init_db():
     """Initialize the database"""
     click.echo("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        create_schema(connection)
     click.echo("Database initialized successfully!")
 
 
@@ -43,7 +44,7 @@ def create_admin(username: str, email: str, password: str, superuser: bool):
             return
         
         # Create new admin user
-        hashed_password = get_password_hash(password)
+        hashed_password = asyncio.run(get_password_hash_async(password))
         admin_user = AdminUser(
             username=username,
             email=email,
@@ -120,6 +121,290 @@ def delete_admin(username: str):
         db.close()
 
 
+def run_async(fn):
+    """Run an async job from the CLI and release the async engine's connections afterwards"""
+    async def runner():
+        try:
+            return await fn()
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(runner())
+
+
+@cli.command()
+def rollup():
+    """Bring usage rollups, latency sketches and metric downsampling up to date"""
+    from app.services.rollups import run_usage_rollups
+    from app.services.sketches import run_sketch_compaction
+    from app.services.downsampling import run_metric_downsampling
+
+    written = run_async(run_usage_rollups)
+    for level, rows in written.items():
+        click.echo(f"{level}: {rows} rollup rows written")
+    compacted = run_async(run_sketch_compaction)
+    click.echo(f"Latency sketches: {compacted['merged']} merged, {compacted['hours']} hour sketches built, {compacted['pruned']} minute sketches pruned")
+    downsampled = run_async(run_metric_downsampling)
+    click.echo(
+        f"Performance metrics: {downsampled['minute']} minute / {downsampled['hour']} hour aggregates written, "
+        f"{downsampled['raw_pruned']} raw samples and {downsampled['minute_pruned']} minute aggregates pruned"
+    )
+
+
+@cli.command()
+@click.option('--hours', default=48, show_default=True, help='How far back to recompute')
+def rebuild_sketches(hours: int):
+    """Recompute latency sketches from raw usage events"""
+    from datetime import datetime, timedelta
+    from app.db.database import AsyncSessionLocal
+    from app.services.sketches import LatencySketchService
+
+    async def rebuild():
+        async with AsyncSessionLocal() as db:
+            return await LatencySketchService(db).rebuild(datetime.utcnow() - timedelta(hours=hours))
+
+    events = run_async(rebuild)
+    click.echo(f"Rebuilt latency sketches from {events} usage events")
+
+
+@cli.command()
+def rebuild_error_groups():
+    """Recompute error_groups (fingerprinted error aggregates) from stored error logs"""
+    from app.db.database import AsyncSessionLocal
+    from app.services.error_groups import rebuild_error_groups as rebuild_groups
+
+    async def rebuild():
+        async with AsyncSessionLocal() as db:
+            return await rebuild_groups(db)
+
+    counts = run_async(rebuild)
+    click.echo(f"Grouped {counts['errors']} error logs into {counts['groups']} error groups")
+
+
+@cli.command()
+def rebuild_session_counters():
+    """Recompute per-session totals from stored usage events and error logs"""
+    from app.db.database import AsyncSessionLocal
+    from app.services.session_counters import rebuild_session_counters as rebuild_counters
+
+    async def rebuild():
+        async with AsyncSessionLocal() as db:
+            return await rebuild_counters(db)
+
+    sessions = run_async(rebuild)
+    click.echo(f"Recomputed counters of {sessions} sessions")
+
+
+@cli.command()
+@click.option('--days', type=int, default=None, help='Override ANALYTICS_RETENTION_DAYS')
+def retention(days):
+    """Delete analytics data older than the retention window"""
+    from app.db.database import AsyncSessionLocal
+    from app.services.retention import RetentionService
+
+    async def enforce():
+        async with AsyncSessionLocal() as db:
+            return await RetentionService(db).run(days=days)
+
+    report = run_async(enforce)
+    click.echo(f"Cutoff: {report.cutoff.isoformat()}")
+    for table, result in report.tables.items():
+        dropped = f", {result.partitions} partitions dropped" if result.partitions else ""
+        click.echo(f"{table}: {result.rows} rows removed{dropped} in {result.elapsed_ms:.0f} ms")
+    click.echo(f"Total: {report.rows} rows in {report.elapsed_ms:.0f} ms")
+
+
+@cli.command()
+@click.option('--days', type=int, default=None, help='Override ANALYTICS_ARCHIVE_AFTER_DAYS')
+def archive(days):
+    """Move aged analytics rows into Parquet segments under ANALYTICS_ARCHIVE_DIR"""
+    from app.core.config import settings
+    from app.db.database import AsyncSessionLocal
+    from app.services.archive import ColdArchiver
+    from app.services.export import ExportUnavailable
+
+    if not settings.ANALYTICS_ARCHIVE_DIR:
+        raise click.ClickException("ANALYTICS_ARCHIVE_DIR is not set")
+
+    async def move():
+        async with AsyncSessionLocal() as db:
+            return await ColdArchiver(db).run(days=days, wait=True)
+
+    try:
+        report = run_async(move)
+    except ExportUnavailable as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Cutoff: {report.cutoff.isoformat()}")
+    for table, rows in report.rows.items():
+        click.echo(f"{table}: {rows} rows archived in {report.segments[table]} segments")
+    click.echo(f"Done in {report.elapsed_ms:.0f} ms")
+
+
+@cli.command()
+def olap_refresh():
+    """Copy new usage_events / cost_tracking rows into the DuckDB snapshot at ANALYTICS_OLAP_PATH"""
+    from app.services.export import ExportUnavailable
+    from app.services.olap import olap_snapshot, OlapUnavailable
+
+    try:
+        copied = run_async(olap_snapshot.refresh)
+    except (OlapUnavailable, ExportUnavailable) as e:
+        raise click.ClickException(str(e))
+    finally:
+        olap_snapshot.close()
+    for table, rows in copied.items():
+        click.echo(f"{table}: {rows} rows copied (watermark {olap_snapshot.watermarks[table].isoformat()})")
+
+
+@cli.command()
+@click.argument('sql')
+def olap_query(sql: str):
+    """Run read-only SQL against the DuckDB snapshot (tables: usage_events, cost_tracking, olap_watermarks)"""
+    from app.services.olap import olap_snapshot, OlapUnavailable
+
+    try:
+        con = olap_snapshot.connect(read_only=True)
+        result = con.execute(sql)
+    except OlapUnavailable as e:
+        raise click.ClickException(str(e))
+    except Exception as e:
+        raise click.ClickException(f"Query failed: {e}")
+    try:
+        click.echo("\t".join(column[0] for column in result.description))
+        for row in result.fetchall():
+            click.echo("\t".join("" if value is None else str(value) for value in row))
+    finally:
+        olap_snapshot.close()
+
+
+@cli.command()
+def partitions():
+    """Create upcoming time partitions and list the current ones (PostgreSQL only)"""
+    from app.core.config import settings
+    from app.db.partitions import PARTITIONED_TABLES, ensure_partitions, list_partitions
+
+    if engine.dialect.name != "postgresql":
+        click.echo("Partitioning is only used on PostgreSQL")
+        return
+    with engine.begin() as conn:
+        for name in ensure_partitions(conn, settings.ANALYTICS_PARTITION_PREMAKE_DAYS):
+            click.echo(f"Created {name}")
+        for table in PARTITIONED_TABLES:
+            parts = list_partitions(conn, table)
+            if not parts:
+                click.echo(f"{table}: not partitioned (run `alembic upgrade head`)")
+                continue
+            click.echo(f"{table}: {len(parts)} partitions")
+            for part in parts:
+                bounds = f"{part.start} .. {part.end}" if part.start else "DEFAULT"
+                click.echo(f"  {part.name}: {bounds}")
+
+
+@cli.command()
+@click.argument('table', type=click.Choice(["events", "metrics", "errors", "sessions", "costs"]))
+@click.option('--format', 'fmt', type=click.Choice(["ndjson", "csv", "parquet"]), default="ndjson", show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), default=None, help='File to write (default: stdout)')
+@click.option('--start', type=click.DateTime(), default=None, help='Only rows at or after this time (UTC)')
+@click.option('--end', type=click.DateTime(), default=None, help='Only rows at or before this time (UTC)')
+@click.option('--filter', 'filters', multiple=True, metavar='KEY=VALUE', help='Equality filter, as on the list endpoints')
+def export(table: str, fmt: str, output, start, end, filters):
+    """Stream an analytics table to NDJSON, CSV or Parquet"""
+    import sys
+    from app.services.export import InvalidExport, ExportUnavailable, export_stream
+
+    parsed = {}
+    for item in filters:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise click.BadParameter(f"expected KEY=VALUE, got '{item}'", param_hint="--filter")
+        parsed[key] = {"true": True, "false": False}.get(value.lower(), value) if key == "resolved" else value
+    if fmt == "parquet" and output is None:
+        raise click.ClickException("Parquet output needs --output")
+    try:
+        chunks = export_stream(table, fmt, start, end, **parsed)
+    except (InvalidExport, ExportUnavailable) as e:
+        raise click.ClickException(str(e))
+
+    async def write():
+        written = 0
+        target = open(output, "wb") if output else sys.stdout.buffer
+        try:
+            async for chunk in chunks:
+                target.write(chunk)
+                written += len(chunk)
+        finally:
+            if output:
+                target.close()
+        return written
+
+    written = run_async(write)
+    if output:
+        click.echo(f"Wrote {written} bytes to {output}")
+
+
+@cli.command()
+@click.option('--limit', default=1000, show_default=True, help='Rows per list')
+@click.option('--repeat', default=5, show_default=True, help='Runs per path; the best one is reported')
+def bench_lists(limit: int, repeat: int):
+    """Compare list endpoint serialization: ORM + response_model + json vs columns + orjson"""
+    import json
+    import time
+    import orjson
+    from typing import List
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+    from app.db.database import AsyncSessionLocal
+    from app.db.pagination import keyset_page
+    from app.models.analytics import UsageEvent, PerformanceMetric, ErrorLog, Session as SessionModel, CostTracking
+    from app.schemas.analytics import (
+        UsageEventResponse, PerformanceMetricResponse, ErrorLogResponse, SessionResponse, CostTrackingResponse
+    )
+    from app.services.analytics import AnalyticsService, SESSION_COLUMNS, COST_COLUMNS
+
+    lists = {
+        "sessions": (SessionModel, SessionModel.created_at, SessionResponse, SESSION_COLUMNS),
+        "events": (UsageEvent, UsageEvent.timestamp, UsageEventResponse, None),
+        "metrics": (PerformanceMetric, PerformanceMetric.timestamp, PerformanceMetricResponse, None),
+        "errors": (ErrorLog, ErrorLog.timestamp, ErrorLogResponse, None),
+        "costs": (CostTracking, CostTracking.timestamp, CostTrackingResponse, COST_COLUMNS),
+    }
+
+    async def fast_rows(db, name, model, ts_col, columns):
+        service = AnalyticsService(db)
+        if name == "events":
+            return (await service.get_usage_events(limit=limit))[0]
+        if name == "errors":
+            return (await service.get_error_logs(limit=limit))[0]
+        if name == "metrics":
+            return await service.get_performance_metrics(limit=limit)
+        return (await keyset_page(db, select(*columns), ts_col, model.id, limit, as_dicts=True))[0]
+
+    async def bench():
+        results = []
+        async with AsyncSessionLocal() as db:
+            for name, (model, ts_col, schema, columns) in lists.items():
+                adapter = TypeAdapter(List[schema])
+                legacy_ms, fast_ms, rows = [], [], 0
+                for _ in range(repeat):
+                    # What the endpoints used to do: entities, from_orm (model_validate), then FastAPI's validate + encode
+                    start = time.perf_counter()
+                    entities, _ = await keyset_page(db, select(model), ts_col, model.id, limit)
+                    content = adapter.dump_python(adapter.validate_python([schema.model_validate(e) for e in entities]), mode="json")
+                    json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+                    legacy_ms.append((time.perf_counter() - start) * 1000)
+                    db.expunge_all()
+
+                    start = time.perf_counter()
+                    orjson.dumps(await fast_rows(db, name, model, ts_col, columns))
+                    fast_ms.append((time.perf_counter() - start) * 1000)
+                    rows = len(entities)
+                results.append((name, rows, min(legacy_ms), min(fast_ms)))
+        return results
+
+    click.echo(f"{'list':<10}{'rows':>7}{'legacy ms':>12}{'fast ms':>10}{'speedup':>9}")
+    for name, rows, legacy, fast in run_async(bench):
+        click.echo(f"{name:<10}{rows:>7}{legacy:>12.1f}{fast:>10.1f}{legacy / fast if fast else 0:>8.1f}x")
+
+
 @cli.command()
 def serve():
     """Start the development server"""
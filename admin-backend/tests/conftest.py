@@ -0,0 +1,28 @@
+"""
+Shared fixtures: every test runs against a fresh SQLite database file.
+
+DATABASE_URL is set before the app is imported, since the engines are created
+at import time.
+"""
+import os
+import tempfile
+
+_DB_PATH = os.path.join(tempfile.mkdtemp(prefix="admin-backend-tests-"), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_PATH}"
+
+import pytest  # noqa: E402
+from app.db.database import engine, async_engine, create_schema  # noqa: E402
+import app.models.analytics  # noqa: E402,F401  (registers the tables)
+
+
+@pytest.fixture(autouse=True)
+async def database():
+    """Empty schema for each test"""
+    engine.dispose()
+    await async_engine.dispose()
+    if os.path.exists(_DB_PATH):
+        os.remove(_DB_PATH)
+    with engine.begin() as connection:
+        create_schema(connection)
+    yield
+    await async_engine.dispose()
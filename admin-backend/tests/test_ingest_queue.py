@@ -0,0 +1,85 @@
+"""
+Write-behind flushes: enqueue timestamps, retries and bad-record isolation
+"""
+import asyncio
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from app.core.metrics import metrics
+from app.db.database import AsyncSessionLocal
+from app.models.analytics import UsageEvent
+from app.services.ingest_queue import IngestQueue
+
+
+def event(event_type, response_time_ms: int = 5):
+    return {"event_type": event_type, "tool_name": "t", "response_time_ms": response_time_ms}
+
+
+def dropped() -> float:
+    return metrics.snapshot()["counters"].get("ingest_queue.dropped", 0)
+
+
+async def stored_event_types() -> List[str]:
+    async with AsyncSessionLocal() as db:
+        return list(await db.scalars(select(UsageEvent.event_type).order_by(UsageEvent.id)))
+
+
+async def test_records_keep_their_enqueue_time():
+    # Flushed more than a second later (CURRENT_TIMESTAMP has second resolution on SQLite)
+    queue = IngestQueue(100, 10, flush_interval_ms=1500)
+    queue.start()
+    before = datetime.utcnow()
+    assert queue.offer("event", event("a"))
+    after = datetime.utcnow()
+    await asyncio.sleep(1.7)
+    await queue.stop()
+
+    async with AsyncSessionLocal() as db:
+        assert before <= await db.scalar(select(UsageEvent.timestamp)) <= after
+
+
+async def test_rejected_records_are_isolated_by_bisection():
+    queue = IngestQueue(100, 10, 10, max_retries=0)
+    dropped_before = dropped()
+    # event_type is NOT NULL
+    batch = [("event", event(name)) for name in ["e0", "e1", None, "e3", "e4", None, "e6"]]
+
+    await queue._flush(batch)
+
+    assert await stored_event_types() == ["e0", "e1", "e3", "e4", "e6"]
+    assert dropped() - dropped_before == 2
+
+
+async def test_connection_errors_are_retried(monkeypatch):
+    queue = IngestQueue(100, 10, 10, max_retries=3, retry_backoff_ms=1)
+    write = IngestQueue._write
+    failures = [OperationalError("INSERT", {}, Exception("connection refused"))] * 2
+
+    async def flaky_write(self, batch):
+        if failures:
+            raise failures.pop()
+        await write(self, batch)
+
+    monkeypatch.setattr(IngestQueue, "_write", flaky_write)
+    await queue._flush([("event", event("e0")), ("event", event("e1"))])
+
+    assert await stored_event_types() == ["e0", "e1"]
+
+
+async def test_batch_is_dropped_once_retries_are_exhausted(monkeypatch):
+    queue = IngestQueue(100, 10, 10, max_retries=2, retry_backoff_ms=1)
+    dropped_before = dropped()
+    attempts = []
+
+    async def down(self, batch):
+        attempts.append(len(batch))
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    monkeypatch.setattr(IngestQueue, "_write", down)
+    await queue._flush([("event", event("e0")), ("event", event("e1"))])
+
+    assert attempts == [2, 2, 2]
+    assert dropped() - dropped_before == 2
@@ -0,0 +1,140 @@
+"""
+Spool replay: receive timestamps, crash recovery, poison records and checkpoints
+"""
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app.db.database import AsyncSessionLocal
+from app.models.analytics import UsageEvent, SpoolCheckpoint
+from app.services.ingest_spool import IngestSpool, CHECKPOINT_SUFFIX, REJECTED_SUFFIX
+
+
+def make_spool(directory: Path, batch_size: int = 2) -> IngestSpool:
+    return IngestSpool(str(directory), 1 << 20, 60, 10, batch_size, 1000)
+
+
+def write_segment(directory: Path, records: List[Any], name: str = "segment-000000000001-abc") -> Path:
+    """Segment file with one line per record; strings are written as they are"""
+    segment = directory / f"{name}.seg"
+    segment.write_text("".join((r if isinstance(r, str) else json.dumps(r)) + "\n" for r in records))
+    return segment
+
+
+def event(event_type: Optional[str], received: str = "2026-10-01T10:00:00") -> Dict[str, Any]:
+    return {"k": "event", "t": received, "r": {"event_type": event_type, "tool_name": "t", "response_time_ms": 5}}
+
+
+async def stored_events() -> List[tuple]:
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(select(UsageEvent.event_type, UsageEvent.timestamp).order_by(UsageEvent.id))
+        return [(event_type, timestamp) for event_type, timestamp in rows]
+
+
+async def checkpoint_rows() -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(SpoolCheckpoint))
+
+
+async def test_replay_keeps_receive_time(tmp_path):
+    segment = write_segment(tmp_path, [event("a", "2026-10-01T10:00:00.250000"), {"k": "event", "r": {"event_type": "legacy"}}])
+
+    await make_spool(tmp_path)._replay_segment(segment)
+
+    rows = await stored_events()
+    assert rows[0] == ("a", datetime(2026, 10, 1, 10, 0, 0, 250000))
+    # Records spooled without a receive time take the replay time
+    assert rows[1][0] == "legacy" and rows[1][1] > datetime(2026, 10, 1, 10, 0)
+    assert not segment.exists()
+    assert await checkpoint_rows() == 0
+
+
+async def test_crash_mid_segment_resumes_after_last_committed_chunk(tmp_path, monkeypatch):
+    segment = write_segment(tmp_path, [event(f"e{i}") for i in range(5)])
+    spool = make_spool(tmp_path, batch_size=2)
+
+    # The database goes away after the first chunk commits
+    insert = IngestSpool._insert
+    calls = []
+
+    async def flaky_insert(self, key, offset, entries):
+        calls.append(offset)
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("connection lost"))
+        await insert(self, key, offset, entries)
+
+    monkeypatch.setattr(IngestSpool, "_insert", flaky_insert)
+    with pytest.raises(OperationalError):
+        await spool._replay_segment(segment)
+    assert [row[0] for row in await stored_events()] == ["e0", "e1"]
+    assert segment.exists()
+
+    monkeypatch.setattr(IngestSpool, "_insert", insert)
+    await make_spool(tmp_path, batch_size=2)._replay_segment(segment)
+    assert [row[0] for row in await stored_events()] == ["e0", "e1", "e2", "e3", "e4"]
+
+
+async def test_crash_after_commit_does_not_reload_the_chunk(tmp_path, monkeypatch):
+    segment = write_segment(tmp_path, [event(f"e{i}") for i in range(3)])
+    insert = IngestSpool._insert
+
+    # The process dies as soon as the first chunk's transaction has committed
+    async def insert_then_die(self, key, offset, entries):
+        await insert(self, key, offset, entries)
+        raise SystemExit("killed")
+
+    monkeypatch.setattr(IngestSpool, "_insert", insert_then_die)
+    with pytest.raises(SystemExit):
+        await make_spool(tmp_path)._replay_segment(segment)
+    monkeypatch.undo()
+
+    await make_spool(tmp_path)._replay_segment(segment)
+    assert [row[0] for row in await stored_events()] == ["e0", "e1", "e2"]
+    assert not segment.exists()
+
+
+async def test_poison_record_is_isolated(tmp_path):
+    # event_type is NOT NULL: the chunk fails as a whole and is loaded record by record
+    segment = write_segment(tmp_path, [event("e0"), event(None), "not json", event("e3")])
+
+    await make_spool(tmp_path, batch_size=10)._replay_segment(segment)
+
+    assert [row[0] for row in await stored_events()] == ["e0", "e3"]
+    rejected = segment.with_suffix(REJECTED_SUFFIX).read_text().splitlines()
+    assert rejected[0] == "not json"
+    assert json.loads(rejected[1])["r"]["event_type"] is None
+
+
+async def test_checkpoint_resume(tmp_path):
+    records = [event(f"e{i}") for i in range(4)]
+    segment = write_segment(tmp_path, records)
+    lines = segment.read_bytes().splitlines(keepends=True)
+    after_two = len(lines[0]) + len(lines[1])
+
+    # Committed checkpoint in the database
+    async with AsyncSessionLocal() as db:
+        db.add(SpoolCheckpoint(segment=segment.stem, byte_offset=after_two))
+        await db.commit()
+    await make_spool(tmp_path)._replay_segment(segment)
+    assert [row[0] for row in await stored_events()] == ["e2", "e3"]
+
+    # File checkpoint left by a version that kept checkpoints next to the segment
+    legacy = write_segment(tmp_path, records, name="segment-000000000003")
+    legacy.with_suffix(CHECKPOINT_SUFFIX).write_text(str(after_two))
+    await make_spool(tmp_path)._replay_segment(legacy)
+    assert [row[0] for row in await stored_events()] == ["e2", "e3", "e2", "e3"]
+    assert not legacy.with_suffix(CHECKPOINT_SUFFIX).exists()
+
+
+async def test_segments_are_replayed_in_sequence_order(tmp_path):
+    spool = make_spool(tmp_path)
+    write_segment(tmp_path, [event("second")], name="segment-000000000010-bbb")
+    write_segment(tmp_path, [event("first")], name="segment-000000000002")
+    await spool._replay_pending()
+    assert [row[0] for row in await stored_events()] == ["first", "second"]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,54 @@
+"""
+Retention keeps everything inside the window
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.database import AsyncSessionLocal
+from app.models.analytics import UsageEvent, Session
+from app.services.retention import RetentionService, delete_in_chunks
+
+NOW = datetime(2026, 10, 18, 12, 0)
+CUTOFF = NOW - timedelta(days=90)
+
+
+def test_retention_is_off_by_default():
+    assert settings.model_fields["ANALYTICS_RETENTION_ENABLED"].default is False
+
+
+async def test_delete_in_chunks_keeps_rows_inside_the_window():
+    ages = [timedelta(days=d) for d in (200, 120, 91, 90.5)] + [timedelta(days=90), timedelta(days=89), timedelta(0)]
+    async with AsyncSessionLocal() as db:
+        for i, age in enumerate(ages):
+            db.add(UsageEvent(event_type=f"e{i}", timestamp=NOW - age))
+        await db.commit()
+
+        # Chunks smaller than the expired set exercise the loop
+        removed = await delete_in_chunks(db, UsageEvent.id, UsageEvent.timestamp, CUTOFF, chunk_size=2)
+
+        assert removed == 4
+        kept = list(await db.scalars(select(UsageEvent.event_type).order_by(UsageEvent.id)))
+        # The row exactly at the cutoff is still inside the window
+        assert kept == ["e4", "e5", "e6"]
+
+
+async def test_sessions_are_kept_while_active_inside_the_window():
+    old = NOW - timedelta(days=120)
+    recent = NOW - timedelta(days=1)
+    async with AsyncSessionLocal() as db:
+        db.add_all([
+            Session(session_id="idle", created_at=old),
+            Session(session_id="updated", created_at=old, updated_at=recent),
+            Session(session_id="ended", created_at=old, updated_at=old, ended_at=recent),
+            Session(session_id="finished-long-ago", created_at=old, updated_at=old, ended_at=old),
+            Session(session_id="new", created_at=recent),
+        ])
+        await db.commit()
+
+        report = await RetentionService(db).run(days=90, now=NOW)
+
+        assert report.tables["sessions"].rows == 2
+        kept = set(await db.scalars(select(Session.session_id)))
+        assert kept == {"updated", "ended", "new"}
@@ -0,0 +1,57 @@
+"""
+Latency sketch compaction with several workers
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app.db.database import AsyncSessionLocal
+from app.models.analytics import LatencySketch
+from app.services.sketches import LatencySketchService
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+async def seed() -> int:
+    """Three appended minute sketches per bucket for six completed hours; returns the sample count"""
+    samples = 0
+    async with AsyncSessionLocal() as db:
+        service = LatencySketchService(db)
+        for minute in range(0, 6 * 60, 7):
+            at = NOW - timedelta(hours=7) + timedelta(minutes=minute)
+            for batch in range(3):
+                await service.record([(at, "tool", 10 + batch), (at, "tool", 200)])
+                samples += 2
+        await db.commit()
+    return samples
+
+
+async def counts():
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(LatencySketch.granularity, func.sum(LatencySketch.count), func.count())
+            .group_by(LatencySketch.granularity)
+        )
+        return {granularity: (int(total), rows) for granularity, total, rows in rows}
+
+
+async def compact():
+    async with AsyncSessionLocal() as db:
+        return await LatencySketchService(db).compact(NOW)
+
+
+async def test_concurrent_compaction_counts_every_sample_once():
+    samples = await seed()
+
+    await asyncio.gather(compact(), compact(), compact())
+
+    result = await counts()
+    assert result["minute"][0] == samples
+    assert result["hour"] == (samples, 6)
+    # Every minute bucket was merged into a single row
+    assert result["minute"][1] == samples // 6
+
+    async with AsyncSessionLocal() as db:
+        by_tool = await LatencySketchService(db).sketches_by_tool(NOW - timedelta(hours=7), NOW, now=NOW)
+    assert by_tool["tool"].count == samples